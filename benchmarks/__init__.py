@@ -0,0 +1,3 @@
+"""
+OpenAI・Pineconeに接続せずに性能を測定するベンチマーク
+"""
@@ -0,0 +1,59 @@
+"""
+ベンチマーク用の日本語の合成コーパス
+"""
+
+from typing import List
+import random
+import re
+
+SUBJECTS = ["当社の製品", "新しいサービス", "管理画面", "このシステム", "利用者", "担当者", "検索機能", "データベース", "契約内容", "請求書"]
+OBJECTS = ["設定ファイル", "アクセス権限", "月次レポート", "問い合わせ", "バックアップ", "パスワード", "通知メール", "利用規約", "型番ABC-123", "保守契約"]
+VERBS = ["更新します", "確認できます", "削除されます", "登録してください", "保存されています", "送信されます", "変更できません", "参照してください"]
+CONNECTIVES = ["なお、", "また、", "ただし、", "そのため、", "例えば、", ""]
+ENDINGS = ["。", "。", "。", "！", "？"]
+
+_SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*$", re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3}
+
+
+def parse_size(value: str) -> int:
+    """「10MB」や「1GB」などの表記をバイト数に変換"""
+    match = _SIZE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"サイズの形式が正しくありません: {value}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def _sentence(rng: random.Random) -> str:
+    return (
+        rng.choice(CONNECTIVES)
+        + rng.choice(SUBJECTS) + "は"
+        + rng.choice(OBJECTS) + "を"
+        + rng.choice(VERBS)
+        + rng.choice(ENDINGS)
+    )
+
+
+def generate_corpus(size_bytes: int, seed: int = 0) -> str:
+    """UTF-8でおおよそ ``size_bytes`` バイトになる日本語テキストを生成（シードが同じなら同じ内容）"""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size_bytes:
+        # 段落ごとに数文をまとめ、時々句点のない長い箇条書きを混ぜる
+        if rng.random() < 0.05:
+            paragraph = "・".join(rng.choice(OBJECTS) for _ in range(rng.randint(20, 80))) + "\n"
+        else:
+            paragraph = "".join(_sentence(rng) for _ in range(rng.randint(3, 12))) + "\n\n"
+        parts.append(paragraph)
+        total += len(paragraph.encode("utf-8"))
+    return "".join(parts)
+
+
+def generate_queries(count: int, seed: int = 0) -> List[str]:
+    """検索・応答生成のベンチマークに使う質問を生成"""
+    rng = random.Random(seed + 1)
+    return [
+        f"{rng.choice(SUBJECTS)}の{rng.choice(OBJECTS)}について教えてください。"
+        for _ in range(count)
+    ]
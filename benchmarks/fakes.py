@@ -0,0 +1,247 @@
+"""
+OpenAI・Pineconeの代わりに使うローカルの代替実装（ベンチマーク用）
+
+いずれも入力から決まる結果を返し、遅延と失敗の発生率を指定できる。
+"""
+
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import random
+import threading
+import time
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from src.services.vector_store import (
+    VectorStoreBackend,
+    VectorMatch,
+    QueryResponse,
+    FetchResponse,
+    IndexStats
+)
+
+
+class FakeAPIError(Exception):
+    """注入した失敗（RequestPolicyが参照する status_code と headers を持つ）"""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+
+
+class FaultProfile:
+    """呼び出しごとの遅延と失敗を決める設定
+
+    遅延は ``base_latency + per_item_latency * 件数`` に ±``jitter`` の割合の揺らぎを加えた秒数。
+    失敗は ``failure_rate`` の確率で ``failure_status`` のエラーを送出する。乱数はシードで固定する。
+    """
+
+    def __init__(
+        self,
+        base_latency: float = 0.0,
+        per_item_latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 429,
+        retry_after: Optional[float] = None,
+        seed: int = 0
+    ):
+        self.base_latency = base_latency
+        self.per_item_latency = per_item_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def _next(self, items: int) -> Tuple[float, bool]:
+        with self._lock:
+            self.calls += 1
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter) if self.jitter else 1
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        return (self.base_latency + self.per_item_latency * items) * factor, fail
+
+    def apply(self, operation: str, items: int = 1) -> None:
+        """遅延を発生させ、設定した確率で失敗させる"""
+        delay, fail = self._next(items)
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise FakeAPIError(f"{operation}: 注入した失敗です", self.failure_status, self.retry_after)
+
+    async def aapply(self, operation: str, items: int = 1) -> None:
+        """``apply`` の非同期版"""
+        delay, fail = self._next(items)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if fail:
+            raise FakeAPIError(f"{operation}: 注入した失敗です", self.failure_status, self.retry_after)
+
+
+def fake_embedding(text: str, dimension: int) -> List[float]:
+    """テキストのハッシュから決まる正規化済みの疑似埋め込みベクトル"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class _FakeEmbeddings:
+    def __init__(self, dimension: int, profile: FaultProfile):
+        self.dimension = dimension
+        self.profile = profile
+
+    def create(self, model: str, input: List[str], **kwargs):
+        self.profile.apply("embeddings.create", len(input))
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(index=i, embedding=fake_embedding(text, self.dimension))
+                for i, text in enumerate(input)
+            ],
+            usage=SimpleNamespace(total_tokens=sum(len(text) for text in input))
+        )
+
+
+class FakeOpenAIClient:
+    """``embeddings.create`` のみを実装したOpenAIクライアントの代替"""
+
+    def __init__(self, dimension: int = 1536, profile: Optional[FaultProfile] = None):
+        self.embeddings = _FakeEmbeddings(dimension, profile or FaultProfile())
+
+
+class FakeChatModel(BaseChatModel):
+    """質問と文脈の長さから決まる応答を返すチャットモデルの代替"""
+
+    profile: Any = None
+    response_tokens: int = 50
+    per_token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer_tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt_length = sum(len(str(message.content)) for message in messages)
+        return [f"回答{(prompt_length + i) % 10}" for i in range(self.response_tokens)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        if self.profile is not None:
+            self.profile.apply("chat.completions.create", self.response_tokens)
+        return self._make_result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        if self.profile is not None:
+            await self.profile.aapply("chat.completions.create", self.response_tokens)
+        return self._make_result(messages)
+
+    def _make_result(self, messages: List[BaseMessage]) -> ChatResult:
+        tokens = self._answer_tokens(messages)
+        prompt_tokens = sum(len(str(message.content)) for message in messages)
+        message = AIMessage(
+            content="".join(tokens),
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens)
+            }
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if self.profile is not None:
+            self.profile.apply("chat.completions.create", 0)
+        for token in self._answer_tokens(messages):
+            if self.per_token_latency:
+                time.sleep(self.per_token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeIndex(VectorStoreBackend):
+    """メモリ上で全件のコサイン類似度を計算するPineconeインデックスの代替
+
+    サーバー側の処理時間は ``profile`` の遅延で表すため、ファイルへの保存は行わない。
+    """
+
+    def __init__(self, profile: Optional[FaultProfile] = None):
+        self.profile = profile or FaultProfile()
+        self._lock = threading.Lock()
+        self._vectors = {}  # ID -> (正規化済みベクトル, メタデータ)
+        self._ids = None  # 検索用の行列のキャッシュ（更新時に破棄）
+        self._matrix = None
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        self.profile.apply("index.upsert", len(vectors))
+        with self._lock:
+            for vector in vectors:
+                values = np.asarray(vector["values"], dtype=np.float32)
+                norm = np.linalg.norm(values)
+                self._vectors[vector["id"]] = (values / norm if norm > 0 else values, vector.get("metadata") or {})
+            self._matrix = None
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True, include_values: bool = False, min_score: Optional[float] = None):
+        self.profile.apply("index.query")
+        with self._lock:
+            if not self._vectors or top_k <= 0:
+                return QueryResponse(matches=[])
+            if self._matrix is None:
+                self._ids = list(self._vectors)
+                self._matrix = np.stack([self._vectors[vector_id][0] for vector_id in self._ids])
+            ids, matrix = self._ids, self._matrix
+
+        query_vector = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ (query_vector / np.linalg.norm(query_vector))
+        k = min(top_k, len(ids))
+        top_rows = np.argpartition(-scores, k - 1)[:k]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        matches = []
+        for row in top_rows:
+            score = float(scores[row])
+            if min_score is not None and score < min_score:
+                continue
+            values, metadata = self._vectors[ids[row]]
+            matches.append(VectorMatch(
+                id=ids[row],
+                score=score,
+                metadata=metadata if include_metadata else None,
+                values=values.tolist() if include_values else []
+            ))
+        return QueryResponse(matches=matches)
+
+    def fetch(self, ids: List[str]):
+        self.profile.apply("index.fetch", len(ids))
+        with self._lock:
+            return FetchResponse(vectors={
+                vector_id: VectorMatch(id=vector_id, metadata=self._vectors[vector_id][1], values=self._vectors[vector_id][0].tolist())
+                for vector_id in ids if vector_id in self._vectors
+            })
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> None:
+        self.profile.apply("index.delete", len(ids or []))
+        with self._lock:
+            if delete_all:
+                self._vectors = {}
+            else:
+                for vector_id in ids or []:
+                    self._vectors.pop(vector_id, None)
+            self._matrix = None
+
+    def list(self, prefix: str = "", page_size: int = 100) -> Iterator[List[str]]:
+        self.profile.apply("index.list")
+        with self._lock:
+            ids = sorted(vector_id for vector_id in self._vectors if vector_id.startswith(prefix))
+        for i in range(0, len(ids), page_size):
+            yield ids[i:i + page_size]
+
+    def describe_index_stats(self):
+        self.profile.apply("index.describe_index_stats")
+        with self._lock:
+            dimension = len(next(iter(self._vectors.values()))[0]) if self._vectors else None
+            return IndexStats(total_vector_count=len(self._vectors), dimension=dimension)
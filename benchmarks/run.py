@@ -0,0 +1,284 @@
+"""
+OpenAI・Pineconeに接続せずに、取り込みと検索・応答生成の性能を測定するベンチマーク
+
+    python -m benchmarks.run --sizes 1MB,10MB --output benchmark_results.json
+
+コーパスのサイズごとに別プロセスで実行し、ピークメモリ（最大常駐セットサイズ）を分けて測定する。
+"""
+
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.corpus import parse_size, generate_corpus, generate_queries
+from benchmarks.fakes import FaultProfile, FakeOpenAIClient, FakeChatModel, FakeIndex
+
+# 前回の結果と比較する指標と、値が大きいほど良いかどうか
+TRACKED_METRICS = {
+    "chunking_mb_per_second": True,
+    "ingestion_chunks_per_second": True,
+    "query_p50_ms": False,
+    "query_p95_ms": False,
+    "response_p50_ms": False,
+    "response_p95_ms": False,
+    "peak_rss_mb": False
+}
+
+
+def _percentiles(samples: List[float], prefix: str) -> Dict[str, float]:
+    """秒単位の計測値からミリ秒単位のパーセンタイルを計算"""
+    values = np.asarray(samples) * 1000
+    return {
+        f"{prefix}_p50_ms": round(float(np.percentile(values, 50)), 3),
+        f"{prefix}_p95_ms": round(float(np.percentile(values, 95)), 3),
+        f"{prefix}_p99_ms": round(float(np.percentile(values, 99)), 3),
+        f"{prefix}_max_ms": round(float(values.max()), 3)
+    }
+
+
+def _peak_rss_mb() -> float:
+    """このプロセスの最大常駐セットサイズ（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxはキロバイト、macOSはバイト単位
+    return round(peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_size_benchmark(size_bytes: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """指定したサイズのコーパスで取り込み・検索・応答生成を計測（ワーカープロセスで実行）
+
+    実行中のアプリの実行時設定・キャッシュ・索引を読み書きしないように一時ディレクトリで実行し、
+    実行時設定はベンチマークの指定値（指定のない項目は既定値）で固定する。
+    """
+    # 設定（secrets.toml）はリポジトリのディレクトリで読み込んでから移動する
+    from src.config.runtime_settings import get_runtime_settings
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            get_runtime_settings().update({
+                "chunk_size": options["chunk_size"],
+                "batch_size": options["batch_size"],
+                "embedding_concurrency": options["embed_concurrency"],
+                "upsert_concurrency": options["upsert_concurrency"]
+            })
+            result = _measure(size_bytes, options)
+            result["runtime_settings"] = get_runtime_settings().snapshot()
+            return result
+        finally:
+            os.chdir(original_dir)
+
+
+def _measure(size_bytes: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """一時ディレクトリ内で取り込み・検索・応答生成を計測"""
+    from src.services.pinecone_service import PineconeService
+    from src.services.langchain_service import LangChainService
+    from src.services.ingestion_journal import IngestionJournal
+    from src.services.request_policy import RequestPolicy
+    from src.services.adaptive_retrieval import AdaptiveOverfetch
+    from src.utils.text_processing import process_text_file
+
+    embed_profile = FaultProfile(
+        base_latency=options["embed_latency"],
+        per_item_latency=options["embed_latency_per_item"],
+        jitter=options["jitter"],
+        failure_rate=options["failure_rate"],
+        seed=options["seed"]
+    )
+    index_profile = FaultProfile(
+        base_latency=options["index_latency"],
+        jitter=options["jitter"],
+        failure_rate=options["failure_rate"],
+        seed=options["seed"] + 1
+    )
+    llm_profile = FaultProfile(
+        base_latency=options["llm_latency"],
+        jitter=options["jitter"],
+        failure_rate=options["failure_rate"],
+        seed=options["seed"] + 2
+    )
+
+    service = PineconeService(
+        openai_client=FakeOpenAIClient(options["dimension"], embed_profile),
+        index=FakeIndex(index_profile)
+    )
+    # 埋め込みキャッシュを通すと2回目以降の測定がAPIを経由しなくなるため無効にする
+    service.embedding_cache = None
+    # 代替実装には流量制限がないため、同時実行数のみ制御し再試行の待機を短くする
+    service.openai_policy = RequestPolicy("benchmark-openai", max_concurrency=options["max_concurrency"], base_delay=0.01)
+    service.index_policy = RequestPolicy("benchmark-index", max_concurrency=options["max_concurrency"], base_delay=0.01)
+    service.embed_concurrency = options["embed_concurrency"]
+    service.upsert_concurrency = options["upsert_concurrency"]
+    service.adaptive_overfetch = AdaptiveOverfetch() if options["adaptive_retrieval"] else None
+
+    corpus = generate_corpus(size_bytes, options["seed"])
+    corpus_mb = len(corpus.encode("utf-8")) / 1024 / 1024
+
+    started = time.perf_counter()
+    chunks = process_text_file(corpus, "benchmark.txt", options["chunk_size"])
+    chunking_seconds = time.perf_counter() - started
+    del corpus
+
+    with tempfile.TemporaryDirectory() as journal_dir:
+        journal = IngestionJournal.for_chunks(chunks, journal_dir)
+        started = time.perf_counter()
+        upload_report = service.upload_chunks(chunks, options["batch_size"], journal=journal)
+        ingestion_seconds = time.perf_counter() - started
+
+    queries = generate_queries(options["queries"], options["seed"])
+    query_samples = []
+    for query in queries:
+        started = time.perf_counter()
+        service.query(query)
+        query_samples.append(time.perf_counter() - started)
+
+    langchain_service = LangChainService(
+        service,
+        llm=FakeChatModel(profile=llm_profile, response_tokens=options["response_tokens"])
+    )
+    langchain_service.request_policy = service.openai_policy
+    response_samples = []
+    for query in queries:
+        started = time.perf_counter()
+        langchain_service.get_response(query)
+        response_samples.append(time.perf_counter() - started)
+        # 履歴が伸び続けると後半ほど遅くなるため、質問ごとに会話をリセットする
+        langchain_service.clear_memory()
+
+    return {
+        "size_bytes": size_bytes,
+        "corpus_mb": round(corpus_mb, 3),
+        "chunks": len(chunks),
+        "chunking_seconds": round(chunking_seconds, 3),
+        "chunking_mb_per_second": round(corpus_mb / chunking_seconds, 3) if chunking_seconds > 0 else None,
+        "ingestion_seconds": round(ingestion_seconds, 3),
+        "ingestion_chunks_per_second": round(len(chunks) / ingestion_seconds, 2) if ingestion_seconds > 0 else None,
+        "dead_letter_chunks": len(upload_report.get("dead_letter_chunks", [])),
+        "retried_chunks": upload_report.get("retried_chunks", 0),
+        "queries": len(queries),
+        **_percentiles(query_samples, "query"),
+        **_percentiles(response_samples, "response"),
+        "peak_rss_mb": _peak_rss_mb(),
+        "injected_failures": embed_profile.failures + index_profile.failures + llm_profile.failures,
+        "request_stats": service.get_request_stats()
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """前回の結果と比較し、許容範囲を超えて悪化した指標の一覧を返す"""
+    baseline_by_size = {result["size_bytes"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        previous = baseline_by_size.get(result["size_bytes"])
+        if previous is None:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            current_value, previous_value = result.get(metric), previous.get(metric)
+            if not current_value or not previous_value:
+                continue
+            change = (current_value - previous_value) / previous_value
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(
+                    f"{result['size_bytes']}バイト {metric}: {previous_value} -> {current_value} ({change:+.1%})"
+                )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="OpenAI・Pineconeの代替実装を使って取り込みと検索の性能を測定します")
+    parser.add_argument("--sizes", default="1MB,10MB", help="コーパスのサイズ（カンマ区切り、例: 1MB,10MB,100MB）")
+    parser.add_argument("--queries", type=int, default=200, help="検索・応答生成の測定に使う質問の数")
+    parser.add_argument("--dimension", type=int, default=1536, help="疑似埋め込みベクトルの次元数")
+    parser.add_argument("--chunk-size", type=int, default=500, help="1チャンクあたりの文字数")
+    parser.add_argument("--batch-size", type=int, default=100, help="アップロード時のバッチサイズ")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="並行して実行する埋め込みAPI呼び出しの数")
+    parser.add_argument("--upsert-concurrency", type=int, default=2, help="並行して実行するアップロードの数")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="代替APIへの同時リクエスト数の上限")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="埋め込みAPI呼び出し1回あたりの遅延（秒）")
+    parser.add_argument("--embed-latency-per-item", type=float, default=0.0005, help="埋め込みAPIの入力1件あたりの遅延（秒）")
+    parser.add_argument("--index-latency", type=float, default=0.02, help="インデックスへのリクエスト1回あたりの遅延（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="応答生成1回あたりの遅延（秒）")
+    parser.add_argument("--response-tokens", type=int, default=50, help="応答1件あたりのトークン数")
+    parser.add_argument("--jitter", type=float, default=0.1, help="遅延の揺らぎの割合")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="各API呼び出しを失敗させる確率（429として扱う）")
+    parser.add_argument("--adaptive-retrieval", action="store_true", help="IDとスコアのみで検索し、しきい値を超えた結果のみ本文を取得する")
+    parser.add_argument("--seed", type=int, default=0, help="コーパス・遅延・失敗の乱数シード")
+    parser.add_argument("--output", default="benchmark_results.json", help="結果を書き出すJSONファイルのパス")
+    parser.add_argument("--baseline", help="比較する前回の結果（JSON）。悪化した指標があれば終了コード1で終了する")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="前回の結果と比較する際に許容する悪化の割合")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    options = {
+        key: getattr(args, key)
+        for key in (
+            "queries", "dimension", "chunk_size", "batch_size", "embed_concurrency", "upsert_concurrency",
+            "max_concurrency", "embed_latency", "embed_latency_per_item", "index_latency", "llm_latency",
+            "response_tokens", "jitter", "failure_rate", "adaptive_retrieval", "seed"
+        )
+    }
+
+    results = []
+    for size in sizes:
+        print(f"{size}バイトのコーパスで測定中...")
+        # サイズごとに新しいプロセスで実行し、ピークメモリが前の測定の影響を受けないようにする
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_size_benchmark, size, options).result()
+        results.append(result)
+        print(
+            f"  チャンク数: {result['chunks']}, 取り込み: {result['ingestion_chunks_per_second']}チャンク/秒, "
+            f"検索 p50/p95: {result['query_p50_ms']}/{result['query_p95_ms']}ms, "
+            f"応答 p50/p95: {result['response_p50_ms']}/{result['response_p95_ms']}ms, "
+            f"ピークメモリ: {result['peak_rss_mb']}MB"
+        )
+
+    output = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": _git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "options": options,
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"結果を {args.output} に書き出しました")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("前回の結果から悪化した指標:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("前回の結果からの悪化はありません")
+
+
+if __name__ == "__main__":
+    main()
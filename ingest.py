@@ -0,0 +1,202 @@
+import argparse
+import fnmatch
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Tuple, Iterator
+from src.components.file_upload import read_file_content
+from src.utils.parallel_chunking import create_chunking_pool, process_text_files_parallel
+from src.utils.logging_config import configure_logging
+from src.utils.metrics import MetricsRegistry, get_metrics_sink
+from src.config.settings import (
+    LOG_LEVEL,
+    CHUNKING_WORKERS,
+    FAST_CHUNKING
+)
+
+def iter_source_files(path: str, pattern: str) -> Iterator[Tuple[str, bytes]]:
+    """ディレクトリまたはzipアーカイブから (相対パス, 内容) を順に取得"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in sorted(archive.namelist()):
+                if name.endswith("/") or not fnmatch.fnmatch(os.path.basename(name), pattern):
+                    continue
+                yield name, archive.read(name)
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            file_path = os.path.join(root, name)
+            with open(file_path, "rb") as f:
+                yield os.path.relpath(file_path, path).replace(os.sep, "/"), f.read()
+
+def iter_file_groups(files: Iterator[Tuple[str, bytes]], group_size: int) -> Iterator[List[Tuple[str, bytes]]]:
+    """メモリ使用量を抑えるため、ファイルを一定数ずつまとめて処理する"""
+    group = []
+    for item in files:
+        group.append(item)
+        if len(group) >= group_size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ディレクトリまたはzipアーカイブ内のテキストファイルを一括でインデックスに登録します")
+    parser.add_argument("path", help="取り込むディレクトリまたはzipファイルのパス")
+    parser.add_argument("--pattern", default="*.txt", help="取り込むファイル名のパターン（既定: *.txt）")
+    parser.add_argument("--chunk-size", type=int, help="1チャンクあたりの文字数（省略時は実行時設定の値）")
+    parser.add_argument("--batch-size", type=int, help="アップロード時のバッチサイズ（省略時は実行時設定の値）")
+    parser.add_argument("--chunk-workers", type=int, help=f"チャンク分割に使うプロセス数（既定: {CHUNKING_WORKERS}、FAST_CHUNKING が有効な場合は使われない）")
+    parser.add_argument("--embed-concurrency", type=int, help="並行して実行する埋め込みAPI呼び出しの数（省略時は実行時設定の値）")
+    parser.add_argument("--upsert-concurrency", type=int, help="並行して実行するアップロードの数（省略時は実行時設定の値）")
+    parser.add_argument("--files-per-group", type=int, default=50, help="まとめてチャンク分割・アップロードするファイル数")
+    parser.add_argument("--full", action="store_true", help="差分を取らずに全チャンクをアップロードする")
+    parser.add_argument("--rebuild-keyword-index", action="store_true", help="取り込み後に、登録済みの全チャンクからキーワード索引を作り直す（ハイブリッド検索を後から有効にした場合）")
+    parser.add_argument("--dry-run", action="store_true", help="チャンク分割のみ行い、埋め込み生成とアップロードは行わない")
+    parser.add_argument("--report-json", help="処理結果をJSON形式で書き出すファイルのパス")
+    parser.add_argument("--metrics-file", help="処理段階ごとのメトリクスをPrometheus形式で書き出すファイルのパス")
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="ログの出力レベル（DEBUG, INFO, WARNING など）")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    configure_logging(args.log_level)
+    if not os.path.exists(args.path):
+        print(f"パスが見つかりません: {args.path}")
+        sys.exit(1)
+
+    service = None
+    if not args.dry_run:
+        from src.services.pinecone_service import get_pinecone_service
+        service = get_pinecone_service()
+        service.embed_concurrency = args.embed_concurrency
+        service.upsert_concurrency = args.upsert_concurrency
+
+    started = time.perf_counter()
+    file_count = 0
+    chunk_count = 0
+    uploaded_chunks = 0
+    dead_letter_chunks = 0
+    estimated_tokens = 0
+    failed_files = []
+    if args.chunk_workers is None:
+        args.chunk_workers = CHUNKING_WORKERS
+    elif FAST_CHUNKING:
+        # 高速なチャンク分割はプロセスに分散しないため、指定されたプロセス数は使われない
+        print("FAST_CHUNKING が有効なため、--chunk-workers の指定は無視されます（チャンク分割は単一プロセスで行います）")
+    # チャンク分割のワーカーは全てのファイルで使い回す
+    chunking_pool = create_chunking_pool(args.chunk_workers)
+
+    for group in iter_file_groups(iter_source_files(args.path, args.pattern), args.files_per_group):
+        documents = []
+        for name, content in group:
+            try:
+                documents.append((name, read_file_content(io.BytesIO(content))))
+            except ValueError as e:
+                print(f"{name}: {str(e)}")
+                failed_files.append(name)
+
+        try:
+            chunk_lists = process_text_files_parallel(documents, args.chunk_size, args.chunk_workers, executor=chunking_pool)
+        except Exception as e:
+            # どのファイルで失敗したか分からないため、1ファイルずつ分割し直して失敗したファイルだけを除く
+            pool_broken = isinstance(e, BrokenProcessPool)
+            chunk_lists = []
+            for name, text in documents:
+                if pool_broken and chunking_pool is not None:
+                    # ワーカーが異常終了したプールは使えないため作り直す
+                    chunking_pool.shutdown()
+                    chunking_pool = create_chunking_pool(args.chunk_workers)
+                try:
+                    chunk_lists.extend(process_text_files_parallel([(name, text)], args.chunk_size, args.chunk_workers, executor=chunking_pool))
+                    pool_broken = False
+                except Exception as file_error:
+                    print(f"{name}: チャンク分割に失敗しました: {str(file_error)}")
+                    failed_files.append(name)
+                    chunk_lists.append(None)
+                    pool_broken = isinstance(file_error, BrokenProcessPool)
+
+        files = [(name, chunks) for (name, _), chunks in zip(documents, chunk_lists) if chunks is not None]
+        for name, chunks in files:
+            file_count += 1
+            chunk_count += len(chunks)
+            estimated_tokens += sum(len(chunk["text"]) for chunk in chunks)
+            print(f"[{file_count}] {name}: {len(chunks)}チャンク")
+        if args.dry_run or not files:
+            continue
+
+        # グループ内の全ファイルのチャンクを共通のバッチにまとめてアップロードする
+        try:
+            if args.full:
+                report = service.upload_chunks([chunk for _, chunks in files for chunk in chunks], args.batch_size)
+                uploaded_chunks += report["uploaded_chunks"] + report["skipped_chunks"]
+                dead_ids = set(report["dead_letter_chunks"])
+                dead_by_file = {name: [chunk["id"] for chunk in chunks if chunk["id"] in dead_ids] for name, chunks in files}
+            else:
+                report = service.sync_files(files, args.batch_size)
+                uploaded_chunks += sum(file_report["upserted_chunks"] for file_report in report["files"].values())
+                dead_by_file = {name: file_report["dead_letter_chunks"] for name, file_report in report["files"].items()}
+        except Exception as e:
+            print(str(e))
+            failed_files.extend(name for name, _ in files)
+            continue
+
+        # 一部のチャンクがデッドレターになったファイルは失敗として扱う（再実行で再試行される）
+        for name, file_dead_ids in dead_by_file.items():
+            if file_dead_ids:
+                print(f"{name}: {len(file_dead_ids)}チャンクのアップロードに失敗しました")
+                failed_files.append(name)
+                dead_letter_chunks += len(file_dead_ids)
+
+    if chunking_pool is not None:
+        chunking_pool.shutdown()
+    if args.rebuild_keyword_index and service is not None:
+        print(f"キーワード索引を作り直しました: {service.rebuild_lexical_index()}チャンク")
+    elapsed = time.perf_counter() - started
+    embedding_tokens = service.embedding_tokens if service is not None else 0
+    report = {
+        "dry_run": args.dry_run,
+        "files": file_count,
+        "chunks": chunk_count,
+        "uploaded_chunks": uploaded_chunks,
+        "dead_letter_chunks": dead_letter_chunks,
+        "failed_files": failed_files,
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(file_count / elapsed, 2) if elapsed > 0 else None,
+        "chunks_per_second": round(chunk_count / elapsed, 2) if elapsed > 0 else None,
+        "embedding_tokens": embedding_tokens,
+        "embedding_tokens_per_second": round(embedding_tokens / elapsed, 2) if elapsed > 0 else None,
+        "estimated_tokens": estimated_tokens
+    }
+
+    print("\n処理結果:")
+    print(f"ファイル数: {file_count}（失敗: {len(failed_files)}）")
+    print(f"チャンク数: {chunk_count}（アップロード: {uploaded_chunks}, 失敗: {dead_letter_chunks}）")
+    print(f"処理時間: {report['elapsed_seconds']}秒")
+    print(f"スループット: {report['files_per_second']}ファイル/秒, {report['chunks_per_second']}チャンク/秒, "
+          f"{report['embedding_tokens_per_second']}埋め込みトークン/秒")
+    if args.dry_run:
+        print(f"推定トークン数: {estimated_tokens}")
+
+    if args.report_json:
+        with open(args.report_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    metrics = get_metrics_sink()
+    if args.metrics_file and isinstance(metrics, MetricsRegistry):
+        with open(args.metrics_file, "w", encoding="utf-8") as f:
+            f.write(metrics.to_prometheus_text())
+
+    if failed_files:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
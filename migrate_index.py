@@ -0,0 +1,102 @@
+import argparse
+import json
+import sys
+import time
+from src.services.index_alias import IndexTarget, get_index_alias
+from src.utils.logging_config import configure_logging
+from src.config.settings import (
+    LOG_LEVEL
+)
+
+def print_state():
+    """検索先・移行先・切り替え前のインデックスを表示"""
+    state = get_index_alias().get_state()
+    labels = {"active": "検索先", "migration": "移行先", "previous": "切り替え前"}
+    for key, label in labels.items():
+        target = state[key]
+        if target is None:
+            print(f"{label}: なし")
+        else:
+            print(f"{label}: {target.index_name}（{target.model}, {target.index_dimension}次元）")
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="埋め込みモデルを変更した新しいインデックスに移行します（start → reindex → switch の順に実行）"
+    )
+    parser.add_argument("--log-level", default=LOG_LEVEL, help="ログの出力レベル（DEBUG, INFO, WARNING など）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="検索先と移行先のインデックスを表示")
+
+    start = subparsers.add_parser("start", help="移行先のインデックスを作成し、以降のアップロードを両方に書き込む")
+    start.add_argument("index_name", help="移行先のインデックス名（ローカルのベクトルストアの場合は保存先のディレクトリ）")
+    start.add_argument("--model", default="text-embedding-3-small", help="移行先の埋め込みモデル")
+    start.add_argument("--dimensions", type=int, help="埋め込みベクトルの次元数（省略時はモデルの既定値）")
+
+    reindex = subparsers.add_parser("reindex", help="検索先の全チャンクを移行先のモデルで埋め込み直す")
+    reindex.add_argument("--batch-size", type=int, help="まとめて取得・アップロードするチャンク数（省略時は実行時設定の値）")
+    reindex.add_argument("--embed-concurrency", type=int, help="並行して実行する埋め込みAPI呼び出しの数（省略時は実行時設定の値）")
+    reindex.add_argument("--upsert-concurrency", type=int, help="並行して実行するアップロードの数（省略時は実行時設定の値）")
+    reindex.add_argument("--report-json", help="処理結果をJSON形式で書き出すファイルのパス")
+
+    subparsers.add_parser("switch", help="検索先を移行先のインデックスに切り替える")
+    subparsers.add_parser("rollback", help="検索先を切り替え前のインデックスに戻す（切り替え後にアップロードしたチャンクは含まれない）")
+    subparsers.add_parser("abort", help="移行を中止し、移行先への書き込みを止める")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    configure_logging(args.log_level)
+    alias = get_index_alias()
+
+    try:
+        if args.command == "status":
+            print_state()
+
+        elif args.command == "start":
+            from src.services.pinecone_service import get_pinecone_service
+            target = IndexTarget(index_name=args.index_name, model=args.model, dimensions=args.dimensions)
+            target.index_dimension  # 次元数が決まらないモデルはここでエラーにする
+            alias.begin_migration(target)
+            # 移行先のインデックスを作成しておき、アプリからの書き込みがすぐに成功するようにする
+            get_pinecone_service()._get_backend(target)
+            print(f"'{target.index_name}' への移行を開始しました。続けて reindex を実行してください")
+            print_state()
+
+        elif args.command == "reindex":
+            from src.services.pinecone_service import get_pinecone_service
+            service = get_pinecone_service()
+            service.embed_concurrency = args.embed_concurrency
+            service.upsert_concurrency = args.upsert_concurrency
+            started = time.perf_counter()
+            report = service.reindex_migration(args.batch_size)
+            print(f"再埋め込み: {report['total_chunks']}チャンク（失敗: {len(report['failed_chunks'])}）")
+            print(f"処理時間: {round(time.perf_counter() - started, 3)}秒, 埋め込みトークン数: {service.embedding_tokens}")
+            if args.report_json:
+                with open(args.report_json, "w", encoding="utf-8") as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+            if report["failed_chunks"]:
+                print("失敗したチャンクがあるため、reindex を再実行してから切り替えてください")
+                sys.exit(1)
+
+        elif args.command == "switch":
+            target = alias.switch()
+            print(f"検索先を '{target.index_name}' に切り替えました（実行中のアプリにも次のリクエストから反映されます）")
+            print_state()
+
+        elif args.command == "rollback":
+            target = alias.rollback()
+            print(f"検索先を '{target.index_name}' に戻しました")
+            print_state()
+
+        elif args.command == "abort":
+            alias.abort_migration()
+            print("移行を中止しました（移行先のインデックスは削除されません）")
+            print_state()
+
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,14 @@ import json
 from datetime import datetime
 from src.services.pinecone_service import PineconeService
 from src.services.langchain_service import LangChainService
+from src.services.chat_store import get_chat_store
 from src.config.settings import (
     DEFAULT_PROMPT_TEMPLATES,
+    CHAT_RENDER_WINDOW,
+    CHAT_HISTORY_PAGE_SIZE,
+    SIDEBAR_HISTORY_WINDOW,
+    CHAT_SESSION_LIST_SIZE,
+    MEMORY_MAX_TURNS,
     load_prompt_templates
 )
 
@@ -30,6 +36,126 @@ def load_chat_history(file):
     data = json.load(file)
     return data.get("messages", [])
 
+def open_session(session_id):
+    """保存した会話を開く（直近のメッセージと会話メモリのみ読み込む）"""
+    store = get_chat_store()
+    st.session_state.chat_session_id = session_id
+    st.session_state.messages = store.load_messages(session_id, CHAT_RENDER_WINDOW) if session_id else []
+    st.session_state.chat_older_count = (
+        store.count_messages(session_id, st.session_state.messages[0]["seq"])
+        if st.session_state.messages else 0
+    )
+    if session_id:
+        memory_messages = store.load_messages(session_id, MEMORY_MAX_TURNS * 2)
+        # 窓の先頭が応答から始まらないよう、最初のユーザーの発言から復元する
+        first_user = next(
+            (i for i, message in enumerate(memory_messages) if message["role"] == "user"),
+            len(memory_messages)
+        )
+        st.session_state.langchain_service.restore_memory(
+            memory_messages[first_user:],
+            store.load_summary(session_id)
+        )
+    else:
+        st.session_state.langchain_service.clear_memory()
+
+def on_session_selected(key):
+    """サイドバーで選択した会話を開く"""
+    open_session(st.session_state[key])
+
+def trim_chat_window():
+    """チャット画面に保持するメッセージを直近の件数に戻す（古いメッセージは必要になったときに読み直す）"""
+    overflow = len(st.session_state.messages) - CHAT_RENDER_WINDOW
+    if overflow > 0:
+        del st.session_state.messages[:overflow]
+        st.session_state.chat_older_count = st.session_state.get("chat_older_count", 0) + overflow
+
+def show_older_messages():
+    """チャット画面にさらに前のメッセージを読み込んで表示"""
+    messages = st.session_state.messages
+    # 表示中のメッセージを全て削除した場合は、会話の末尾から読み込む
+    older = get_chat_store().load_messages(
+        st.session_state.chat_session_id,
+        CHAT_HISTORY_PAGE_SIZE,
+        before_seq=messages[0]["seq"] if messages else None
+    )
+    st.session_state.messages = older + messages
+    st.session_state.chat_older_count = max(0, st.session_state.chat_older_count - len(older))
+
+def render_message(message):
+    """メッセージを1件表示"""
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        # 詳細情報は開いたときだけ描画する（メッセージごとのst.jsonが再実行のたびに描画されないように）
+        if "details" in message:
+            if st.toggle("詳細情報", key=f"details_{message['seq']}"):
+                st.json(message["details"])
+
+@st.fragment
+def render_history_list():
+    """サイドバーの会話履歴（直近のメッセージのみ表示）"""
+    st.header("会話履歴")
+    messages = st.session_state.messages
+    start = max(0, len(messages) - SIDEBAR_HISTORY_WINDOW)
+    hidden = start + st.session_state.get("chat_older_count", 0)
+    if hidden > 0:
+        st.caption(f"古いメッセージ{hidden}件は省略しています")
+    for i in range(start, len(messages)):
+        message = messages[i]
+        with st.container():
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.text(f"{message['role']}: {message['content'][:50]}...")
+            with col2:
+                if st.button("削除", key=f"delete_{message['seq']}"):
+                    get_chat_store().delete_message(st.session_state.chat_session_id, message["seq"])
+                    st.session_state.messages.pop(i)
+                    # チャット画面にも反映するため、アプリ全体を再実行する
+                    st.rerun()
+
+@st.fragment
+def render_conversation(selected_template_data):
+    """チャット画面（メッセージの送信時はこの部分のみ再実行し、サイドバーは再実行しない）"""
+    # 読み込み済みの直近のメッセージのみ表示し、それより前は必要に応じて読み込む
+    older_count = st.session_state.get("chat_older_count", 0)
+    if older_count > 0:
+        st.button(f"さらに前のメッセージを表示（残り{older_count}件）", on_click=show_older_messages)
+    for message in st.session_state.messages:
+        render_message(message)
+    
+    # ユーザー入力
+    if prompt := st.chat_input("メッセージを入力してください"):
+        # ユーザーメッセージを表示し、会話ストアに追記する（全体を保存し直さず、新しいメッセージのみ追記）
+        store = get_chat_store()
+        if not st.session_state.get("chat_session_id"):
+            st.session_state.chat_session_id = store.create_session()
+        session_id = st.session_state.chat_session_id
+        st.session_state.messages.extend(store.append_messages(session_id, [{"role": "user", "content": prompt}]))
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        
+        # LangChainを使用して応答をストリーミング生成
+        langchain_service = st.session_state.langchain_service
+        with st.chat_message("assistant"):
+            with st.spinner("関連する文書を検索中..."):
+                response_stream, details = langchain_service.stream_response(
+                    prompt,
+                    system_prompt=selected_template_data["system_prompt"],
+                    response_template=selected_template_data["response_template"]
+                )
+            response = st.write_stream(response_stream)
+            # 応答を会話ストアに追記し、付与されたメッセージ番号を詳細情報の切り替えのキーに使う
+            assistant_messages = store.append_messages(session_id, [
+                {"role": "assistant", "content": response, "details": details}
+            ])
+            if st.toggle("詳細情報", key=f"details_{assistant_messages[0]['seq']}"):
+                st.json(details)
+        
+        # アシスタントの応答を履歴に追加し、保持するメッセージを直近の件数に戻す
+        st.session_state.messages.extend(assistant_messages)
+        store.save_summary(session_id, langchain_service.message_history.summary)
+        trim_chat_window()
+
 def render_chat(pinecone_service: PineconeService):
     """チャット機能のUIを表示"""
     st.title("チャット")
@@ -37,16 +163,35 @@ def render_chat(pinecone_service: PineconeService):
     
     # LangChainサービスの初期化
     if "langchain_service" not in st.session_state:
-        st.session_state.langchain_service = LangChainService()
+        st.session_state.langchain_service = LangChainService(pinecone_service)
     
     # プロンプトテンプレートの初期化
     if "prompt_templates" not in st.session_state:
         st.session_state.prompt_templates = load_prompt_templates()
     
+    store = get_chat_store()
+    
     # サイドバーに履歴管理機能を配置
     with st.sidebar:
         st.header("チャット履歴管理")
         
+        # 保存した会話の選択
+        sessions = store.list_sessions(CHAT_SESSION_LIST_SIZE)
+        session_titles = {session["id"]: session["title"] or "（無題）" for session in sessions}
+        session_ids = [None] + list(session_titles)
+        current_session_id = st.session_state.get("chat_session_id")
+        # 会話を切り替えたときに選択肢を作り直すよう、キーに現在の会話のIDを含める
+        choice_key = f"chat_session_choice_{current_session_id}"
+        st.selectbox(
+            "会話を選択",
+            session_ids,
+            index=session_ids.index(current_session_id) if current_session_id in session_ids else 0,
+            format_func=lambda session_id: session_titles.get(session_id, "新しい会話"),
+            key=choice_key,
+            on_change=on_session_selected,
+            args=(choice_key,)
+        )
+        
         # プロンプトテンプレートの選択
         st.header("プロンプトテンプレート")
         template_names = [template["name"] for template in st.session_state.prompt_templates]
@@ -58,84 +203,46 @@ def render_chat(pinecone_service: PineconeService):
         
         # 選択されたテンプレートの内容を表示
         selected_template_data = next(
-            template for template in st.session_state.prompt_templates 
+            template for template in st.session_state.prompt_templates
             if template["name"] == selected_template
         )
         with st.expander("選択中のテンプレート"):
             st.text_area("システムプロンプト", value=selected_template_data["system_prompt"], disabled=True)
             st.text_area("応答テンプレート", value=selected_template_data["response_template"], disabled=True)
         
-        # 履歴の保存
-        if st.button("現在の履歴を保存"):
-            filename = save_chat_history(st.session_state.messages)
+        # 履歴の書き出し（会話は自動で保存されるため、JSONファイルが必要な場合のみ）
+        if current_session_id and st.button("現在の履歴をJSONで書き出す"):
+            messages = store.load_messages(current_session_id, store.count_messages(current_session_id))
+            filename = save_chat_history([{key: value for key, value in message.items() if key != "seq"} for message in messages])
             st.success(f"履歴を保存しました: {filename}")
         
-        # 履歴の読み込み
+        # 履歴の読み込み（同じファイルを再実行のたびに取り込まないよう、取り込み済みのファイルを記録する）
         uploaded_file = st.file_uploader("保存した履歴を読み込む", type=['json'])
-        if uploaded_file is not None:
+        if uploaded_file is not None and st.session_state.get("imported_chat_file") != uploaded_file.file_id:
             try:
                 loaded_messages = load_chat_history(uploaded_file)
-                st.session_state.messages = loaded_messages
-                st.session_state.langchain_service.clear_memory()
+                session_id = store.create_session()
+                store.append_messages(session_id, loaded_messages)
+                st.session_state.imported_chat_file = uploaded_file.file_id
+                open_session(session_id)
                 st.success("履歴を読み込みました")
             except Exception as e:
                 st.error(f"履歴の読み込みに失敗しました: {str(e)}")
         
-        # 履歴のクリア
-        if st.button("履歴をクリア"):
-            st.session_state.messages = []
-            st.session_state.langchain_service.clear_memory()
-            st.success("履歴をクリアしました")
+        # 新しい会話を始める（保存した会話は残す）
+        if st.button("新しい会話"):
+            open_session(None)
+            st.rerun()
+        
+        # 履歴の削除
+        if current_session_id and st.button("履歴を削除"):
+            store.delete_session(current_session_id)
+            open_session(None)
+            st.success("履歴を削除しました")
+            st.rerun()
         
         # 履歴の表示
-        st.header("会話履歴")
-        for i, message in enumerate(st.session_state.messages):
-            with st.container():
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.text(f"{message['role']}: {message['content'][:50]}...")
-                with col2:
-                    if st.button("削除", key=f"delete_{i}"):
-                        st.session_state.messages.pop(i)
-                        st.rerun()
+        render_history_list()
     
     # メインのチャット表示
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            # 詳細情報が含まれている場合は表示
-            if "details" in message:
-                with st.expander("詳細情報"):
-                    st.json(message["details"])
-
-    # ユーザー入力
-    if prompt := st.chat_input("メッセージを入力してください"):
-        # ユーザーメッセージを表示
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
-
-        # 選択されたテンプレートを取得
-        selected_template_data = next(
-            template for template in st.session_state.prompt_templates 
-            if template["name"] == selected_template
-        )
-        
-        # LangChainを使用して応答を生成
-        with st.spinner("応答を生成中..."):
-            response, details = st.session_state.langchain_service.get_response(
-                prompt,
-                system_prompt=selected_template_data["system_prompt"],
-                response_template=selected_template_data["response_template"]
-            )
-            
-            # アシスタントの応答を表示
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response,
-                "details": details
-            })
-            with st.chat_message("assistant"):
-                st.markdown(response)
-                with st.expander("詳細情報"):
-                    st.json(details) 
\ No newline at end of file
+    render_conversation(selected_template_data)
@@ -23,6 +23,11 @@ def render_file_upload(pinecone_service: PineconeService):
     uploaded_file = st.file_uploader("テキストファイルをアップロード", type=['txt'])
     
     if uploaded_file is not None:
+        incremental = st.checkbox(
+            "変更されたチャンクのみアップロード",
+            value=True,
+            help="同じファイル名で保存済みの内容と比較し、変更・追加されたチャンクのみを登録して不要になったチャンクを削除します"
+        )
         if st.button("データベースに保存"):
             try:
                 with st.spinner("ファイルを処理中..."):
@@ -31,8 +36,20 @@ def render_file_upload(pinecone_service: PineconeService):
                     st.write(f"ファイルを{len(chunks)}個のチャンクに分割しました")
                     
                     with st.spinner("Pineconeにアップロード中..."):
-                        pinecone_service.upload_chunks(chunks)
-                        st.success("アップロードが完了しました！")
+                        if incremental:
+                            report = pinecone_service.sync_file_chunks(uploaded_file.name, chunks)
+                        else:
+                            report = pinecone_service.upload_chunks(chunks)
+                        dead_letter_chunks = report.get("dead_letter_chunks", [])
+                        if dead_letter_chunks:
+                            st.warning(
+                                f"{len(dead_letter_chunks)}個のチャンクのアップロードに失敗しました。"
+                                "もう一度保存すると失敗したチャンクのみ再試行します"
+                            )
+                        else:
+                            st.success("アップロードが完了しました！")
+                        with st.expander("アップロード統計"):
+                            st.json(report)
             except ValueError as e:
                 st.error(str(e))
             except Exception as e:
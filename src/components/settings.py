@@ -1,11 +1,10 @@
 import streamlit as st
 from src.services.pinecone_service import PineconeService
+from src.services.embedding_cache import get_embedding_cache
+from src.utils.metrics import MetricsRegistry, get_metrics_sink
+from src.config.runtime_settings import RUNTIME_SETTING_SPECS, get_runtime_settings
 from src.config.settings import (
-    CHUNK_SIZE,
-    BATCH_SIZE,
     EMBEDDING_MODEL,
-    DEFAULT_TOP_K,
-    SIMILARITY_THRESHOLD,
     DEFAULT_PROMPT_TEMPLATES,
     DEFAULT_SYSTEM_PROMPT,
     DEFAULT_RESPONSE_TEMPLATE,
@@ -14,35 +13,44 @@ from src.config.settings import (
     save_default_prompts
 )
 
+def runtime_number_input(label, name, current, help):
+    """実行時設定の数値を入力（範囲は設定の定義に合わせる）"""
+    _, minimum, maximum, _ = RUNTIME_SETTING_SPECS[name]
+    return st.number_input(label, min_value=minimum, max_value=maximum, value=current[name], help=help)
+
 def render_settings(pinecone_service: PineconeService):
     """設定画面のUIを表示"""
     st.title("設定")
     
+    # 保存済みの実行時設定（保存すると全てのセッションの次のリクエストから反映される）
+    current = get_runtime_settings().snapshot()
+    
     # テキスト処理設定
     st.header("テキスト処理設定")
-    chunk_size = st.number_input(
-        "チャンクサイズ（文字数）",
-        min_value=100,
-        max_value=2000,
-        value=st.session_state.get("chunk_size", CHUNK_SIZE),
+    chunk_size = runtime_number_input(
+        "チャンクサイズ（文字数）", "chunk_size", current,
         help="テキストを分割する際の1チャンクあたりの文字数"
     )
     
-    batch_size = st.number_input(
-        "バッチサイズ",
-        min_value=10,
-        max_value=500,
-        value=st.session_state.get("batch_size", BATCH_SIZE),
+    batch_size = runtime_number_input(
+        "バッチサイズ", "batch_size", current,
         help="Pineconeへのアップロード時のバッチサイズ"
     )
+    
+    embedding_concurrency = runtime_number_input(
+        "埋め込みの並行数", "embedding_concurrency", current,
+        help="アップロード時に並行して実行する埋め込みAPI呼び出しの数"
+    )
+    
+    upsert_concurrency = runtime_number_input(
+        "アップロードの並行数", "upsert_concurrency", current,
+        help="並行して実行するPineconeへのアップロードの数"
+    )
 
     # 検索設定
     st.header("検索設定")
-    top_k = st.number_input(
-        "検索結果数",
-        min_value=1,
-        max_value=20,
-        value=st.session_state.get("top_k", DEFAULT_TOP_K),
+    top_k = runtime_number_input(
+        "検索結果数", "top_k", current,
         help="検索時に返す結果の数"
     )
     
@@ -50,10 +58,20 @@ def render_settings(pinecone_service: PineconeService):
         "類似度しきい値",
         min_value=0.0,
         max_value=1.0,
-        value=st.session_state.get("similarity_threshold", SIMILARITY_THRESHOLD),
+        value=current["similarity_threshold"],
         step=0.05,
         help="この値以上の類似度を持つ結果のみを表示します"
     )
+    
+    retrieval_overfetch = runtime_number_input(
+        "候補の取得倍率", "retrieval_overfetch", current,
+        help="しきい値で絞り込む前に、検索結果数の何倍の候補を取得するか"
+    )
+    
+    context_token_budget = runtime_number_input(
+        "文脈のトークン数の上限", "context_token_budget", current,
+        help="プロンプトに含める検索結果の合計トークン数の上限"
+    )
 
     # プロンプト設定
     st.header("プロンプト設定")
@@ -157,6 +175,28 @@ def render_settings(pinecone_service: PineconeService):
         except Exception as e:
             st.error(f"データベースの状態取得に失敗しました: {str(e)}")
 
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        if st.button("埋め込みキャッシュの状態を確認"):
+            st.json(embedding_cache.get_stats())
+        if st.button("埋め込みキャッシュをクリア"):
+            embedding_cache.clear()
+            st.success("埋め込みキャッシュをクリアしました。")
+
+    if st.button("API呼び出しの状態を確認"):
+        st.json(pinecone_service.get_request_stats())
+
+    metrics = get_metrics_sink()
+    if isinstance(metrics, MetricsRegistry):
+        if st.button("処理時間の統計を確認"):
+            st.json(metrics.get_snapshot())
+        st.download_button(
+            "メトリクスをダウンロード（Prometheus形式）",
+            data=metrics.to_prometheus_text(),
+            file_name="metrics.prom",
+            mime="text/plain"
+        )
+
     if st.button("データベースをクリア"):
         if st.warning("本当にデータベースをクリアしますか？この操作は取り消せません。"):
             try:
@@ -167,10 +207,17 @@ def render_settings(pinecone_service: PineconeService):
 
     # 設定の保存
     if st.button("設定を保存"):
-        st.session_state.update({
-            "chunk_size": chunk_size,
-            "batch_size": batch_size,
-            "top_k": top_k,
-            "similarity_threshold": similarity_threshold
-        })
-        st.success("設定を保存しました。") 
\ No newline at end of file
+        try:
+            version = get_runtime_settings().update({
+                "chunk_size": chunk_size,
+                "batch_size": batch_size,
+                "embedding_concurrency": embedding_concurrency,
+                "upsert_concurrency": upsert_concurrency,
+                "top_k": top_k,
+                "similarity_threshold": similarity_threshold,
+                "retrieval_overfetch": retrieval_overfetch,
+                "context_token_budget": context_token_budget
+            })
+            st.success(f"設定を保存しました（バージョン: {version}）。次のリクエストから反映されます。")
+        except ValueError as e:
+            st.error(str(e)) 
\ No newline at end of file
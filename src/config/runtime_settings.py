@@ -0,0 +1,139 @@
+"""
+実行中に変更できる設定（検索・取り込みのパラメータ）を管理するモジュール
+
+値はファイルに保存し、サービスはリクエストごとに読み出すため、
+設定画面で保存した値は再起動せずに全てのセッション・プロセスに反映される。
+"""
+
+from typing import Dict, Any, Optional
+import json
+import os
+import threading
+from .settings import (
+    RUNTIME_SETTINGS_FILE,
+    CHUNK_SIZE,
+    BATCH_SIZE,
+    EMBEDDING_CONCURRENCY,
+    UPSERT_CONCURRENCY,
+    DEFAULT_TOP_K,
+    SIMILARITY_THRESHOLD,
+    RETRIEVAL_OVERFETCH,
+    CONTEXT_TOKEN_BUDGET
+)
+
+# 設定名 -> (型, 最小値, 最大値, 既定値)
+RUNTIME_SETTING_SPECS = {
+    "chunk_size": (int, 100, 2000, CHUNK_SIZE),
+    "batch_size": (int, 10, 500, BATCH_SIZE),
+    "embedding_concurrency": (int, 1, 32, EMBEDDING_CONCURRENCY),
+    "upsert_concurrency": (int, 1, 32, UPSERT_CONCURRENCY),
+    "top_k": (int, 1, 20, DEFAULT_TOP_K),
+    "similarity_threshold": (float, 0.0, 1.0, SIMILARITY_THRESHOLD),
+    "retrieval_overfetch": (int, 1, 10, RETRIEVAL_OVERFETCH),
+    "context_token_budget": (int, 500, 16000, CONTEXT_TOKEN_BUDGET)
+}
+
+
+class RuntimeSettings:
+    """ファイルに保存する実行時設定（ファイルが置き換えられた場合のみ読み直す）
+
+    書き込みは一時ファイル経由で置き換えるため、読み込み側が書きかけの内容を見ることはない。
+    保存のたびに ``version`` を増やし、どの設定で処理したかを詳細情報などで確認できる。
+    """
+
+    def __init__(self, path: str = RUNTIME_SETTINGS_FILE):
+        self.path = path
+        self._values = self.defaults()
+        self._version = 0
+        self._loaded_version = None  # 読み込んだファイルの (inode, 更新時刻)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def defaults() -> Dict[str, Any]:
+        """設定ファイルに記載がない場合の値"""
+        return {name: spec[3] for name, spec in RUNTIME_SETTING_SPECS.items()}
+
+    @staticmethod
+    def validate(name: str, value: Any) -> Any:
+        """値を設定の型に変換し、範囲外の場合はValueErrorを送出"""
+        if name not in RUNTIME_SETTING_SPECS:
+            raise ValueError(f"不明な設定です: {name}")
+        value_type, minimum, maximum, _ = RUNTIME_SETTING_SPECS[name]
+        value = value_type(value)
+        if not minimum <= value <= maximum:
+            raise ValueError(f"{name} は {minimum} 以上 {maximum} 以下で指定してください")
+        return value
+
+    def _refresh(self) -> None:
+        """ファイルが更新されていれば読み直す（ロックを取得した状態で呼び出す）"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._values = self.defaults()
+            self._version = 0
+            self._loaded_version = None
+            return
+        loaded_version = (stat.st_ino, stat.st_mtime_ns)
+        if loaded_version == self._loaded_version:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        values = self.defaults()
+        for name, value in data.get("values", {}).items():
+            # 手で編集された不正な値は無視し、既定値を使う
+            try:
+                values[name] = self.validate(name, value)
+            except (TypeError, ValueError):
+                continue
+        self._values = values
+        self._version = data.get("version", 0)
+        self._loaded_version = loaded_version
+
+    def get(self, name: str) -> Any:
+        """設定値を1つ取得"""
+        with self._lock:
+            self._refresh()
+            return self._values[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """全ての設定値とバージョンを取得（1回のリクエストで同じ値を使う場合）"""
+        with self._lock:
+            self._refresh()
+            return {**self._values, "version": self._version}
+
+    def update(self, values: Dict[str, Any]) -> int:
+        """設定値を検証して保存し、新しいバージョンを返す"""
+        validated = {name: self.validate(name, value) for name, value in values.items()}
+        with self._lock:
+            self._refresh()
+            new_values = {**self._values, **validated}
+            new_version = self._version + 1
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": new_version, "values": new_values}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            stat = os.stat(self.path)
+            self._values = new_values
+            self._version = new_version
+            self._loaded_version = (stat.st_ino, stat.st_mtime_ns)
+            return new_version
+
+
+_runtime_settings = None
+_runtime_settings_lock = threading.Lock()
+
+def get_runtime_settings() -> RuntimeSettings:
+    """プロセス内で共有する実行時設定を取得"""
+    global _runtime_settings
+    if _runtime_settings is None:
+        with _runtime_settings_lock:
+            if _runtime_settings is None:
+                _runtime_settings = RuntimeSettings()
+    return _runtime_settings
+
+def get_runtime_setting(name: str, value: Optional[Any] = None) -> Any:
+    """``value`` が指定されていればそれを、Noneの場合は実行時設定の値を返す"""
+    return value if value is not None else get_runtime_settings().get(name)
@@ -3,6 +3,7 @@
 """
 
 import streamlit as st
+import copy
 import os
 import json
 from dotenv import load_dotenv
@@ -18,16 +19,107 @@ OPENAI_API_KEY = st.secrets["openai_api_key"]
 PINECONE_INDEX_NAME = st.secrets["index_name"]
 PINECONE_ASSISTANT_NAME = st.secrets["assistant_name"]
 
+# Vector Store Settings
+VECTOR_STORE_BACKEND = "pinecone"  # 使用するベクトルストア（"pinecone" または "local"）
+LOCAL_VECTOR_STORE_DIR = ".vector_store"  # ローカルのベクトルストアの保存先
+INDEX_ALIAS_PATH = ".cache/index_alias.json"  # 検索に使うインデックスと移行先のインデックスの記録先（埋め込みモデルの移行用）
+CHUNK_STORE_ENABLED = False  # チャンクの本文とメタデータをローカルのチャンクストアに保存し、インデックスにはベクトルと参照のみ保存するか
+CHUNK_STORE_PATH = ".cache/chunk_store.sqlite3"  # チャンクストアの保存先（アップロードと検索を行う全てのプロセスから読める場所に置く）
+
+# Connection Settings
+HTTP_POOL_SIZE = 16  # OpenAI・Pineconeクライアントで保持するHTTP接続数
+INDEX_READY_TIMEOUT = 120  # インデックス作成後、準備完了を待つ最大時間（秒）
+INDEX_STATS_TTL = 30  # インデックスの統計情報をキャッシュする時間（秒）
+
+# Rate Limit Settings
+MAX_RETRIES = 3  # 外部API呼び出しの最大試行回数
+RETRY_BASE_DELAY = 1  # 再試行時の待機時間の基準（秒、試行ごとに倍増しジッターを加える）
+RETRY_MAX_DELAY = 30  # 再試行時の待機時間の上限（秒）
+OPENAI_REQUESTS_PER_MINUTE = 3000  # OpenAI APIの1分あたりのリクエスト数の上限
+OPENAI_TOKENS_PER_MINUTE = 1000000  # OpenAI APIの1分あたりのトークン数の上限
+OPENAI_MAX_CONCURRENCY = 16  # OpenAI APIの同時リクエスト数の上限（レート制限に応じて自動で増減）
+PINECONE_REQUESTS_PER_MINUTE = 6000  # Pineconeの1分あたりのリクエスト数の上限
+PINECONE_MAX_CONCURRENCY = 16  # Pineconeの同時リクエスト数の上限（レート制限に応じて自動で増減）
+
+# Logging / Metrics Settings
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING")  # ログの出力レベル（開発時は "DEBUG" や "INFO"）
+METRICS_ENABLED = True  # 処理段階ごとの所要時間・データ量をプロセス内で集計するか
+METRICS_PORT = None  # Prometheus形式のメトリクスを公開するポート（Noneの場合は公開しない）
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]  # 所要時間のヒストグラムの区切り（秒）
+
 # Text Processing Settings
 CHUNK_SIZE = 500  # テキストを分割する際の1チャンクあたりの文字数
+FAST_CHUNKING = False  # 形態素解析を使わず文字走査で文を区切る高速なチャンク分割を使うか（切り替えるとチャンクの区切りが変わり、登録済みのファイルは一度すべて再登録される）
+CHUNKING_WORKERS = os.cpu_count() or 1  # 複数ファイルのチャンク分割に使うプロセス数
+CHUNKING_SEGMENT_SIZE = 200000  # 大きなファイルを並列処理する際の1区間あたりの文字数
 BATCH_SIZE = 100  # Pineconeへのアップロード時のバッチサイズ
+EMBEDDING_CONCURRENCY = 4  # 並行して実行する埋め込みAPI呼び出しの数
+UPSERT_CONCURRENCY = 2  # 並行して実行するPineconeへのアップロードの数
+MAX_PENDING_BATCHES = 8  # 同時にメモリ上で処理中にできるバッチ数の上限（バックプレッシャー）
+INGESTION_JOURNAL_ENABLED = True  # アップロードの進捗をジャーナルに記録し、中断後に再開できるようにするか
+INGESTION_JOURNAL_DIR = ".cache/ingestion_journal"  # ジャーナルの保存先
+MAX_CHUNK_RETRIES = 3  # 失敗したチャンクを再試行する回数の上限（超えたらデッドレターに移す）
 
 # OpenAI Settings
-EMBEDDING_MODEL = "text-embedding-ada-002"  # 使用する埋め込みモデル
+EMBEDDING_MODEL = "text-embedding-ada-002"  # 使用する埋め込みモデル（移行後はインデックスのエイリアスに記録したモデルを使う）
+EMBEDDING_DIMENSIONS = None  # 埋め込みベクトルの次元数（text-embedding-3系のみ指定可能、Noneの場合はモデルの既定値）
+EMBEDDING_MODEL_DIMENSIONS = {  # モデルごとの既定の次元数
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072
+}
+EMBEDDING_BATCH_SIZE = 100  # 1回の埋め込みAPI呼び出しで送るテキスト数の上限
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 100000  # 1回の埋め込みAPI呼び出しで送る推定トークン数の上限
+
+# Embedding Cache Settings
+EMBEDDING_CACHE_ENABLED = True  # 埋め込みベクトルのキャッシュを使用するか
+EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite3"  # キャッシュの保存先
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # キャッシュに保持するベクトル数の上限（超えた分は古い順に削除）
 
 # Search Settings
 DEFAULT_TOP_K = 10  # デフォルトの検索結果数
 SIMILARITY_THRESHOLD = 0.7  # 類似度のしきい値（0-1の範囲）
+RETRIEVAL_OVERFETCH = 2  # しきい値での絞り込み用に、検索結果数の何倍の候補を取得するか
+
+MULTI_QUERY_RETRIEVAL = False  # 直前の質問を補ったクエリでも検索し、結果を統合するか（非同期の応答生成では同時に検索）
+
+# Adaptive Retrieval Settings
+ADAPTIVE_RETRIEVAL_ENABLED = False  # IDとスコアのみで少ない候補から検索し、足りない場合のみ取得数を増やすか（本文はしきい値を超えた結果のみ取得。ハイブリッド検索が有効な場合は使われない）
+ADAPTIVE_OVERFETCH_WINDOW = 200  # 取得数の見積もりに使う直近の検索数
+ADAPTIVE_OVERFETCH_QUANTILE = 0.9  # 直近の検索でしきい値を超えた件数のうち、最初の取得数の基準にする分位点
+ADAPTIVE_MIN_CANDIDATES = 3  # 最初に取得する候補数の下限
+
+# Context Assembly Settings
+CONTEXT_TOKEN_BUDGET = 3000  # プロンプトに含める参照文脈のトークン数の上限
+MMR_LAMBDA = 0.7  # 文脈の選択で関連度を重視する割合（1に近いほど関連度、0に近いほど多様性を重視）
+CONTEXT_DUPLICATE_THRESHOLD = 0.95  # 選択済みのチャンクとのコサイン類似度がこれ以上のチャンクは重複として除外
+
+# Hybrid Search Settings
+HYBRID_SEARCH_ENABLED = False  # ベクトル検索とキーワード検索(BM25)を組み合わせるか（登録済みのチャンクは ingest.py --rebuild-keyword-index で索引に追加）
+LEXICAL_INDEX_PATH = ".cache/lexical_index.sqlite3"  # キーワード索引の保存先（アップロードと検索を行う全てのプロセスから読める場所に置く）
+BM25_K1 = 1.5  # BM25の単語出現頻度の飽和パラメータ
+BM25_B = 0.75  # BM25の文書長による正規化の強さ
+RRF_K = 60  # Reciprocal Rank Fusionの順位の平滑化定数
+
+# Semantic Cache Settings
+SEMANTIC_CACHE_ENABLED = False  # 類似した質問に過去の回答を再利用するか（オプトイン）
+SEMANTIC_CACHE_MAX_DISTANCE = 0.05  # 回答を再利用する質問同士のコサイン距離の上限
+SEMANTIC_CACHE_TTL = 3600  # キャッシュした回答の有効期間（秒）
+SEMANTIC_CACHE_MAX_ENTRIES = 500  # キャッシュに保持する回答数の上限
+INDEX_GENERATION_PATH = ".cache/index_generation"  # インデックスの世代番号の保存先（ingest.py などの別プロセスでの更新を検索側のキャッシュに反映する）
+
+# Conversation Memory Settings
+MEMORY_MAX_TURNS = 6  # そのままプロンプトに含める直近の会話の往復数の上限
+MEMORY_TOKEN_BUDGET = 2000  # 直近の会話に使うトークン数の上限（これを超えた古い会話は要約する）
+MEMORY_SUMMARY_ENABLED = True  # 古い会話を要約して残すか（Falseの場合は破棄する）
+MEMORY_SUMMARY_MAX_CHARS = 400  # 会話の要約の最大文字数
+
+# Chat Display / History Settings
+CHAT_RENDER_WINDOW = 20  # チャット画面で最初に表示する直近のメッセージ数
+CHAT_HISTORY_PAGE_SIZE = 20  # 「さらに前のメッセージを表示」で追加表示するメッセージ数
+SIDEBAR_HISTORY_WINDOW = 20  # サイドバーの会話履歴に表示する直近のメッセージ数
+CHAT_STORE_PATH = ".cache/chat_history.sqlite3"  # 会話の保存先（メッセージごとに追記する）
+CHAT_SESSION_LIST_SIZE = 20  # サイドバーで選択できる最近の会話の数
 
 # Prompt Settings
 DEFAULT_SYSTEM_PROMPT = """あなたは親切で丁寧なAIアシスタントです。
@@ -92,20 +184,37 @@ DEFAULT_PROMPT_TEMPLATES = [
     }
 ]
 
+# 実行中に変更できる設定（src/config/runtime_settings.py）の保存先
+RUNTIME_SETTINGS_FILE = "runtime_settings.json"
+
 # プロンプトテンプレートの保存と読み込み
 PROMPT_TEMPLATES_FILE = "prompt_templates.json"
 
+# 読み込んだプロンプトテンプレートと、読み込んだ時点のファイルの (inode, 更新時刻)
+_prompt_templates_cache = None
+_prompt_templates_version = None
+
 def save_prompt_templates(templates):
-    """プロンプトテンプレートを保存"""
-    with open(PROMPT_TEMPLATES_FILE, "w", encoding="utf-8") as f:
+    """プロンプトテンプレートを保存（一時ファイル経由で置き換える）"""
+    temp_path = PROMPT_TEMPLATES_FILE + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
         json.dump(templates, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, PROMPT_TEMPLATES_FILE)
 
 def load_prompt_templates():
-    """プロンプトテンプレートを読み込み"""
-    if os.path.exists(PROMPT_TEMPLATES_FILE):
+    """プロンプトテンプレートを読み込み（ファイルが更新されていない場合はキャッシュを返す）"""
+    global _prompt_templates_cache, _prompt_templates_version
+    try:
+        stat = os.stat(PROMPT_TEMPLATES_FILE)
+    except FileNotFoundError:
+        return copy.deepcopy(DEFAULT_PROMPT_TEMPLATES)
+    version = (stat.st_ino, stat.st_mtime_ns)
+    if version != _prompt_templates_version:
         with open(PROMPT_TEMPLATES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return DEFAULT_PROMPT_TEMPLATES.copy()
+            _prompt_templates_cache = json.load(f)
+        _prompt_templates_version = version
+    # 呼び出し元で編集されてもキャッシュが変わらないようにコピーを返す
+    return copy.deepcopy(_prompt_templates_cache)
 
 # デフォルトプロンプトの保存と読み込み
 DEFAULT_PROMPTS_FILE = "default_prompts.json"
@@ -0,0 +1,84 @@
+from typing import List, Dict, Any, Optional
+from collections import deque
+import threading
+from ..config.settings import (
+    ADAPTIVE_RETRIEVAL_ENABLED,
+    ADAPTIVE_OVERFETCH_WINDOW,
+    ADAPTIVE_OVERFETCH_QUANTILE,
+    ADAPTIVE_MIN_CANDIDATES
+)
+
+
+class AdaptiveOverfetch:
+    """直近の検索のスコア分布から、類似度しきい値を超える件数を見積もって取得数を決める
+
+    検索結果はスコアの高い順に返るため、取得した候補が全てしきい値を超えた場合のみ
+    その先にもしきい値を超える候補が残っている可能性がある。そこで取得数は、直近の検索で
+    しきい値を超えた件数の分位点に境界を確認するための1件を加えた数から始め、
+    全ての候補がしきい値を超えた場合のみ倍にして取得し直す。
+    件数ではなくスコアそのものを記録するため、しきい値を変更しても記録をそのまま使える。
+    """
+
+    def __init__(
+        self,
+        window: int = ADAPTIVE_OVERFETCH_WINDOW,
+        quantile: float = ADAPTIVE_OVERFETCH_QUANTILE,
+        min_candidates: int = ADAPTIVE_MIN_CANDIDATES
+    ):
+        self.quantile = quantile
+        self.min_candidates = min_candidates
+        self._history = deque(maxlen=window)  # 検索ごとに取得した候補のスコア
+        self._lock = threading.Lock()
+
+    def _passing_counts(self, similarity_threshold: float) -> List[int]:
+        """直近の検索ごとの、しきい値を超えた件数（昇順）"""
+        with self._lock:
+            return sorted(
+                sum(1 for score in scores if score >= similarity_threshold)
+                for scores in self._history
+            )
+
+    def initial_count(self, top_k: int, similarity_threshold: float) -> int:
+        """最初に取得する候補数（記録がない場合は上位K件）"""
+        counts = self._passing_counts(similarity_threshold)
+        if not counts:
+            return top_k
+        # しきい値を超える結果がない検索が一定の割合以上ある場合は、
+        # スコアに関係なく上位K件を使うことが多いため最初から取得する
+        if counts[min(len(counts) - 1, int(len(counts) * (1 - self.quantile)))] == 0:
+            return top_k
+        expected = counts[min(len(counts) - 1, int(len(counts) * self.quantile))]
+        return min(top_k, max(self.min_candidates, expected + 1))
+
+    @staticmethod
+    def next_count(count: int, top_k: int) -> int:
+        """全ての候補がしきい値を超えた場合に取得し直す候補数"""
+        return min(top_k, count * 2)
+
+    def record(self, scores: List[float]) -> None:
+        """検索で取得した候補のスコアを記録"""
+        with self._lock:
+            self._history.append(tuple(scores))
+
+    def reset(self) -> None:
+        """記録を破棄（検索先のインデックスが切り替わり、スコアの分布が変わる場合）"""
+        with self._lock:
+            self._history.clear()
+
+    def get_stats(self, top_k: int, similarity_threshold: float) -> Dict[str, Any]:
+        """学習した取得数の統計情報"""
+        with self._lock:
+            recorded = len(self._history)
+        initial = self.initial_count(top_k, similarity_threshold)
+        return {
+            "記録した検索数": recorded,
+            "最初の取得数": initial,
+            "取得倍率": round(initial / top_k, 3) if top_k else 0.0
+        }
+
+
+def get_adaptive_overfetch() -> Optional[AdaptiveOverfetch]:
+    """適応的な取得が有効な場合のみ、取得数の学習器を作成"""
+    if not ADAPTIVE_RETRIEVAL_ENABLED:
+        return None
+    return AdaptiveOverfetch()
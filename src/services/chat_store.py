@@ -0,0 +1,159 @@
+from typing import List, Dict, Any, Optional, Iterable
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from ..config.settings import CHAT_STORE_PATH
+
+
+class ChatStore:
+    """会話をメッセージ単位でSQLiteに追記する永続ストア
+
+    保存は新しいメッセージの追記のみ、読み込みはメッセージ番号（``seq``）を指定した
+    ページ単位で行うため、長い会話でも処理量は会話全体の長さに比例しない。
+    会話メモリの要約も会話ごとに保存し、会話全体を読み直さずに会話メモリを復元できる。
+    """
+
+    def __init__(self, path: str = CHAT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, title TEXT NOT NULL, summary TEXT NOT NULL DEFAULT '', "
+            "next_seq INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "details TEXT, created_at REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+        self._conn.commit()
+
+    def create_session(self, title: str = "") -> str:
+        """新しい会話を作成し、そのIDを返す"""
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, title, now, now)
+            )
+            self._conn.commit()
+        return session_id
+
+    def append_messages(self, session_id: str, messages: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """メッセージを会話の末尾に追記し、``seq`` を付けたメッセージを返す"""
+        messages = list(messages)
+        if not messages:
+            return []
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT next_seq, title FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"会話 '{session_id}' が見つかりません")
+            next_seq, title = row
+            stored = [{**message, "seq": next_seq + i} for i, message in enumerate(messages)]
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, seq, role, content, details, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        session_id, message["seq"], message["role"], message["content"],
+                        json.dumps(message["details"], ensure_ascii=False, default=str) if "details" in message else None,
+                        now
+                    )
+                    for message in stored
+                ]
+            )
+            # 最初の質問を会話の題名にする
+            if not title:
+                first_user_message = next((message for message in stored if message["role"] == "user"), None)
+                title = first_user_message["content"][:30] if first_user_message is not None else ""
+            self._conn.execute(
+                "UPDATE sessions SET next_seq = ?, title = ?, updated_at = ? WHERE id = ?",
+                (next_seq + len(stored), title, now, session_id)
+            )
+            self._conn.commit()
+        return stored
+
+    def load_messages(self, session_id: str, limit: int, before_seq: Optional[int] = None) -> List[Dict[str, Any]]:
+        """``before_seq`` より前（省略時は末尾）の最大 ``limit`` 件のメッセージを古い順で取得"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, role, content, details FROM messages "
+                "WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (session_id, before_seq if before_seq is not None else 2 ** 62, limit)
+            ).fetchall()
+        messages = []
+        for seq, role, content, details in reversed(rows):
+            message = {"role": role, "content": content, "seq": seq}
+            if details is not None:
+                message["details"] = json.loads(details)
+            messages.append(message)
+        return messages
+
+    def count_messages(self, session_id: str, before_seq: Optional[int] = None) -> int:
+        """会話のメッセージ数（``before_seq`` を指定するとそれより前の件数）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND seq < ?",
+                (session_id, before_seq if before_seq is not None else 2 ** 62)
+            ).fetchone()[0]
+
+    def delete_message(self, session_id: str, seq: int) -> None:
+        """メッセージを1件削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ? AND seq = ?", (session_id, seq))
+            self._conn.commit()
+
+    def list_sessions(self, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """最近更新された順に会話の一覧を取得"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, title, created_at, updated_at FROM sessions ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [
+            {"id": session_id, "title": title, "created_at": created_at, "updated_at": updated_at}
+            for session_id, title, created_at, updated_at in rows
+        ]
+
+    def save_summary(self, session_id: str, summary: str) -> None:
+        """会話メモリの要約を保存"""
+        with self._lock:
+            self._conn.execute("UPDATE sessions SET summary = ? WHERE id = ?", (summary, session_id))
+            self._conn.commit()
+
+    def load_summary(self, session_id: str) -> str:
+        """保存した会話メモリの要約を取得"""
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row is not None else ""
+
+    def delete_session(self, session_id: str) -> None:
+        """会話とそのメッセージを削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def get_chat_store() -> ChatStore:
+    """プロセス内で共有する会話ストアを取得"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = ChatStore()
+    return _shared_store
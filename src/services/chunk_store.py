@@ -0,0 +1,101 @@
+from typing import List, Dict, Any, Optional
+import json
+import os
+import sqlite3
+import threading
+from ..config.settings import (
+    CHUNK_STORE_ENABLED,
+    CHUNK_STORE_PATH
+)
+
+
+class ChunkStore:
+    """チャンクIDをキーにチャンクの本文とメタデータを保存するSQLiteのストア
+
+    インデックスのメタデータには本文を含めず参照（コンテンツハッシュ）のみ保存するため、
+    検索結果の転送量が減り、チャンクの大きさもメタデータのサイズ上限に縛られない。
+    検索結果の本文はこのストアからまとめて取得する。
+    """
+
+    def __init__(self, path: str = CHUNK_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_reference(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        """インデックスのメタデータに保存する参照（本文の版を確認するためのコンテンツハッシュ）"""
+        content_hash = chunk.get("metadata", {}).get("content_hash")
+        return {"content_hash": content_hash} if content_hash is not None else {}
+
+    def put_chunks(self, chunks: List[Dict[str, Any]]) -> None:
+        """``{"id", "text", "metadata"}`` 形式のチャンクを保存（同じIDは上書き）"""
+        rows = [
+            (chunk["id"], chunk["text"], json.dumps(chunk.get("metadata", {}), ensure_ascii=False))
+            for chunk in chunks
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, text, metadata) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def get_chunks(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """チャンクIDごとのメタデータ（本文は ``text`` に含める）を取得（保存されていないIDは含まない）"""
+        found = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self._lock:
+            # SQLiteのパラメータ数上限を超えないように分割して検索
+            for i in range(0, len(unique_ids), 500):
+                part = unique_ids[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({placeholders})",
+                    part
+                ).fetchall()
+                for chunk_id, text, metadata in rows:
+                    found[chunk_id] = {**json.loads(metadata), "text": text}
+        return found
+
+    def delete_chunks(self, ids: List[str]) -> None:
+        """チャンクを削除"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """全てのチャンクを削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def count(self) -> int:
+        """保存しているチャンク数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def get_chunk_store() -> Optional[ChunkStore]:
+    """プロセス内で共有するチャンクストアを取得（無効な場合はNone）"""
+    global _shared_store
+    if not CHUNK_STORE_ENABLED:
+        return None
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = ChunkStore()
+    return _shared_store
@@ -0,0 +1,187 @@
+from typing import List, Dict, Any, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+from langchain.schema import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from ..config.settings import (
+    MEMORY_MAX_TURNS,
+    MEMORY_TOKEN_BUDGET,
+    MEMORY_SUMMARY_ENABLED
+)
+
+logger = logging.getLogger(__name__)
+
+SummarizeFn = Callable[[str, List[BaseMessage]], str]
+
+
+def estimate_message_tokens(messages: List[BaseMessage]) -> int:
+    """メッセージのトークン数を概算（日本語は1文字1トークン程度）"""
+    return sum(len(str(message.content)) for message in messages)
+
+
+class ConversationMemory:
+    """直近の会話をトークン数の上限内でそのまま保持し、それより古い会話を要約にまとめる会話メモリ
+
+    ``ChatMessageHistory`` と同じ ``messages``・``add_user_message``・``add_ai_message``・``clear`` を持つ。
+    要約は共有のバックグラウンドスレッドで行うため、応答生成の待ち時間には含まれない。
+    要約が終わるまでの間、要約待ちの会話は上限の範囲内でそのままプロンプトに含める。
+    """
+
+    def __init__(
+        self,
+        summarize_fn: Optional[SummarizeFn] = None,
+        max_turns: int = MEMORY_MAX_TURNS,
+        token_budget: int = MEMORY_TOKEN_BUDGET,
+        summary_enabled: bool = MEMORY_SUMMARY_ENABLED
+    ):
+        self.summarize_fn = summarize_fn
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_enabled = summary_enabled and summarize_fn is not None
+        self.summary = ""
+        self._turns = []  # 直近の会話（1往復ごとのメッセージのリスト）
+        self._current = []  # 応答待ちのユーザーメッセージ
+        self._pending = []  # 要約待ちの会話
+        self._summarizing = False
+        self._summarized_turns = 0
+        self._dropped_turns = 0
+        self._generation = 0  # clear() のたびに増やし、それ以前に始めた要約の結果を捨てる
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """プロンプトに含めるメッセージ（要約 + 要約待ちの会話 + 直近の会話）"""
+        with self._lock:
+            messages = []
+            if self.summary:
+                messages.append(SystemMessage(content=f"これまでの会話の要約:\n{self.summary}"))
+            # 要約が追いつかない場合も、要約待ちの会話は新しいものからトークン数の上限までに抑える
+            pending = []
+            pending_tokens = 0
+            for turn in reversed(self._pending):
+                pending_tokens += estimate_message_tokens(turn)
+                if pending_tokens > self.token_budget:
+                    break
+                pending.insert(0, turn)
+            for turn in pending + self._turns:
+                messages.extend(turn)
+            messages.extend(self._current)
+            return messages
+
+    def add_user_message(self, message: str) -> None:
+        with self._lock:
+            self._current.append(HumanMessage(content=message))
+
+    def add_ai_message(self, message: str) -> None:
+        """応答を追加して1往復を確定し、上限を超えた古い会話を要約に回す"""
+        with self._lock:
+            self._turns.append(self._current + [AIMessage(content=message)])
+            self._current = []
+            self._fold_old_turns()
+            if self._pending and not self._summarizing:
+                self._start_summary()
+
+    def _exceeds_limits(self) -> bool:
+        # 直近の1往復は必ず残す
+        return len(self._turns) > 1 and (
+            len(self._turns) > self.max_turns
+            or sum(estimate_message_tokens(turn) for turn in self._turns) > self.token_budget
+        )
+
+    def _fold_old_turns(self) -> None:
+        while self._exceeds_limits():
+            turn = self._turns.pop(0)
+            if self.summary_enabled:
+                self._pending.append(turn)
+            else:
+                self._dropped_turns += 1
+
+    def _start_summary(self) -> None:
+        self._summarizing = True
+        _get_summary_executor().submit(self._summarize, self._generation)
+
+    def _summarize(self, generation: int) -> None:
+        """要約待ちの会話を現在の要約に取り込む（バックグラウンドスレッドで実行）"""
+        with self._lock:
+            turns = list(self._pending)
+            summary = self.summary
+        messages = [message for turn in turns for message in turn]
+
+        try:
+            new_summary = self.summarize_fn(summary, messages)
+        except Exception as e:
+            logger.warning("会話の要約に失敗しました: %s", e)
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._summarizing = False
+                # 要約できない間も、要約待ちの会話がトークン数の上限を超えないよう古いものから破棄する
+                while len(self._pending) > 1 and sum(estimate_message_tokens(turn) for turn in self._pending) > self.token_budget:
+                    self._pending.pop(0)
+                    self._dropped_turns += 1
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.summary = new_summary
+            del self._pending[:len(turns)]
+            self._summarized_turns += len(turns)
+            # 要約中に追加された会話があれば続けて要約する
+            if self._pending:
+                self._start_summary()
+            else:
+                self._summarizing = False
+
+    def clear(self) -> None:
+        self.restore("", [])
+
+    def restore(self, summary: str, messages: List[BaseMessage]) -> None:
+        """保存した要約と直近のメッセージから会話メモリを復元
+
+        上限を超える古い会話は保存時に要約済みのはずなので、要約し直さずに破棄する。
+        応答のないユーザーメッセージ（応答生成の失敗など）は含めない。
+        """
+        turns = []
+        turn = []
+        for message in messages:
+            turn.append(message)
+            if isinstance(message, AIMessage):
+                turns.append(turn)
+                turn = []
+        
+        with self._lock:
+            self._generation += 1
+            self.summary = summary
+            self._turns = turns
+            self._current = []
+            self._pending = []
+            self._summarizing = False
+            self._summarized_turns = 0
+            self._dropped_turns = 0
+            while self._exceeds_limits():
+                self._turns.pop(0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """保持している会話の状態（詳細情報の表示用）"""
+        with self._lock:
+            return {
+                "直近の会話数": len(self._turns),
+                "要約待ちの会話数": len(self._pending),
+                "要約済みの会話数": self._summarized_turns,
+                "破棄した会話数": self._dropped_turns,
+                "要約の文字数": len(self.summary)
+            }
+
+
+_summary_executor = None
+_summary_executor_lock = threading.Lock()
+
+def _get_summary_executor() -> ThreadPoolExecutor:
+    """全セッションで共有する要約用のスレッドプールを取得"""
+    global _summary_executor
+    if _summary_executor is None:
+        with _summary_executor_lock:
+            if _summary_executor is None:
+                _summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+    return _summary_executor
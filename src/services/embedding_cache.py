@@ -0,0 +1,204 @@
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+from array import array
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from ..config.settings import (
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES
+)
+
+
+class EmbeddingCache:
+    """SQLiteに保存する永続的な埋め込みベクトルキャッシュ
+
+    キーは (モデル名, 正規化したテキストのハッシュ) で、
+    エントリ数が上限を超えると最終アクセスが古いものから削除する（LRU）。
+    キャッシュヒット時の最終アクセス時刻はメモリ上に貯めておき、書き込み時にまとめて反映する
+    （読み込みのたびにSQLiteへの書き込みが発生しないように）。
+    """
+
+    ACCESS_FLUSH_SIZE = 1000  # 最終アクセス時刻をまとめて反映する件数
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_access = set()  # 最終アクセス時刻が未反映のキー
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        # エントリ数の見積もり（上限を超えた可能性がある場合のみ数え直す）
+        self._entry_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """キャッシュキー用にテキストを正規化"""
+        return unicodedata.normalize("NFC", text).strip()
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        """モデル名とテキストからキャッシュキーを作成"""
+        digest = hashlib.sha256(cls.normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """テキストごとのキャッシュ済みベクトルを取得（存在しない場合はNone）"""
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # SQLiteのパラメータ数上限を超えないように分割して検索
+            for i in range(0, len(unique_keys), 500):
+                part = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    part
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            self._pending_access.update(found)
+            if len(self._pending_access) >= self.ACCESS_FLUSH_SIZE:
+                self._flush_access()
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for result in results if result is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+
+        return results
+
+    def _flush_access(self) -> None:
+        """貯めておいた最終アクセス時刻を反映（ロックを取得した状態で呼び出し、コミットは呼び出し元で行う）"""
+        if not self._pending_access:
+            return
+        keys = list(self._pending_access)
+        self._pending_access.clear()
+        now = time.time()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            self._conn.execute(
+                f"UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})",
+                [now, *part]
+            )
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """ベクトルをキャッシュに保存し、上限を超えた分を削除"""
+        now = time.time()
+        rows = [
+            (self.make_key(model, text), model, array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+
+        with self._lock:
+            self._flush_access()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            # 上書きの場合も加算するため見積もりは実際以上になる。上限を超えた場合のみ数え直す
+            self._entry_count += len(rows)
+            if self._entry_count > self.max_entries:
+                self._entry_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._entry_count > self.max_entries:
+                # 削除のたびに走らないよう、上限の1割分の余裕を持たせて削除
+                excess = self._entry_count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (excess,)
+                )
+                self._entry_count -= excess
+            self._conn.commit()
+
+    def get_or_compute(self, model: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """キャッシュにないテキストのみ ``compute`` で計算して結果を返す"""
+        results = self.get_many(model, texts)
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if missing:
+            # 同じテキストが複数回含まれていても計算は1回にする
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = compute(missing_texts)
+            self.put_many(model, missing_texts, computed)
+            computed_by_text = dict(zip(missing_texts, computed))
+            for i in missing:
+                results[i] = computed_by_text[texts[i]]
+
+        return results
+
+    async def aget_or_compute(self, model: str, texts: List[str], compute: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[List[float]]:
+        """``get_or_compute`` の非同期版（SQLiteの読み書きはスレッドで行い、イベントループを止めない）"""
+        results = await asyncio.to_thread(self.get_many, model, texts)
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if missing:
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = await compute(missing_texts)
+            await asyncio.to_thread(self.put_many, model, missing_texts, computed)
+            computed_by_text = dict(zip(missing_texts, computed))
+            for i in missing:
+                results[i] = computed_by_text[texts[i]]
+
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """キャッシュのヒット率などの統計情報を取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None
+            }
+
+    def clear(self) -> None:
+        """キャッシュを全て削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._pending_access.clear()
+            self._entry_count = 0
+            self.hits = 0
+            self.misses = 0
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """プロセス内で共有する埋め込みキャッシュを取得（無効化されている場合はNone）"""
+    global _shared_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = EmbeddingCache()
+    return _shared_cache
@@ -0,0 +1,173 @@
+from typing import Dict, Any, Optional
+from dataclasses import dataclass, asdict
+import json
+import os
+import threading
+from ..config.settings import (
+    PINECONE_INDEX_NAME,
+    VECTOR_STORE_BACKEND,
+    LOCAL_VECTOR_STORE_DIR,
+    INDEX_ALIAS_PATH,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL_DIMENSIONS
+)
+
+
+@dataclass(frozen=True)
+class IndexTarget:
+    """インデックスと、そのインデックスのベクトルを生成する埋め込みモデルの組"""
+    index_name: str  # Pineconeのインデックス名（ローカルのベクトルストアの場合は保存先のディレクトリ）
+    model: str
+    dimensions: Optional[int] = None  # Noneの場合はモデルの既定の次元数
+
+    @property
+    def index_dimension(self) -> int:
+        """インデックスに保存するベクトルの次元数"""
+        if self.dimensions is not None:
+            return self.dimensions
+        if self.model not in EMBEDDING_MODEL_DIMENSIONS:
+            raise ValueError(f"埋め込みモデル '{self.model}' の次元数が不明です。次元数を指定してください")
+        return EMBEDDING_MODEL_DIMENSIONS[self.model]
+
+    @property
+    def cache_model(self) -> str:
+        """埋め込みキャッシュのキーに使うモデル名（次元数が異なるベクトルを区別する）"""
+        return self.model if self.dimensions is None else f"{self.model}:{self.dimensions}"
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["IndexTarget"]:
+        if not data:
+            return None
+        return cls(index_name=data["index_name"], model=data["model"], dimensions=data.get("dimensions"))
+
+
+def default_index_target() -> IndexTarget:
+    """設定ファイルの値から決まる、移行前のインデックス"""
+    index_name = LOCAL_VECTOR_STORE_DIR if VECTOR_STORE_BACKEND == "local" else PINECONE_INDEX_NAME
+    return IndexTarget(index_name=index_name, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS)
+
+
+class IndexAlias:
+    """検索に使うインデックス（``active``）と移行先のインデックス（``migration``）の記録
+
+    埋め込みモデルを移行する間は、アップロードを両方のインデックスに書き込み、
+    移行先の再埋め込みが終わったら ``switch`` で検索先を一度に切り替える。
+    記録はファイルに保存するため、移行ツールでの切り替えが実行中のアプリにも反映される
+    （ファイルが置き換えられた場合のみ読み直す）。
+    ``path`` にNoneを渡すとファイルに保存せずメモリ上でのみ管理する。
+    """
+
+    def __init__(self, path: Optional[str] = INDEX_ALIAS_PATH, default: Optional[IndexTarget] = None):
+        self.path = path
+        self.default = default or default_index_target()
+        self._state = {"active": self.default, "migration": None, "previous": None}
+        self._loaded_version = None
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        """ファイルが更新されていれば読み直す（ロックを取得した状態で呼び出す）"""
+        if self.path is None:
+            return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._state = {"active": self.default, "migration": None, "previous": None}
+            self._loaded_version = None
+            return
+        # 一時ファイルからの置き換えでinodeも変わるため、更新時刻の精度が粗くても変更を検出できる
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version == self._loaded_version:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._state = {
+            "active": IndexTarget.from_dict(data.get("active")) or self.default,
+            "migration": IndexTarget.from_dict(data.get("migration")),
+            "previous": IndexTarget.from_dict(data.get("previous"))
+        }
+        self._loaded_version = version
+
+    def _save(self, state: Dict[str, Optional[IndexTarget]]) -> None:
+        """記録を更新（一時ファイル経由で置き換えるため、読み込み側が途中の状態を見ることはない）"""
+        self._state = state
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {key: asdict(target) if target is not None else None for key, target in state.items()},
+                f, ensure_ascii=False, indent=2
+            )
+        os.replace(temp_path, self.path)
+        stat = os.stat(self.path)
+        self._loaded_version = (stat.st_ino, stat.st_mtime_ns)
+
+    def get_state(self) -> Dict[str, Optional[IndexTarget]]:
+        """``active``・``migration``・``previous`` の現在の値"""
+        with self._lock:
+            self._refresh()
+            return dict(self._state)
+
+    @property
+    def active(self) -> IndexTarget:
+        """検索に使うインデックス"""
+        return self.get_state()["active"]
+
+    @property
+    def migration(self) -> Optional[IndexTarget]:
+        """移行中のインデックス（移行中でなければNone）"""
+        return self.get_state()["migration"]
+
+    def begin_migration(self, target: IndexTarget) -> None:
+        """移行先のインデックスを登録し、以降のアップロードを両方に書き込む"""
+        with self._lock:
+            self._refresh()
+            state = self._state
+            if target.index_name == state["active"].index_name:
+                raise ValueError(f"インデックス '{target.index_name}' は現在検索に使われています")
+            if state["migration"] is not None and state["migration"] != target:
+                raise ValueError(f"インデックス '{state['migration'].index_name}' への移行が進行中です")
+            self._save({**state, "migration": target})
+
+    def switch(self) -> IndexTarget:
+        """検索先を移行先のインデックスに切り替え、移行前のインデックスを戻し先として残す"""
+        with self._lock:
+            self._refresh()
+            state = self._state
+            if state["migration"] is None:
+                raise ValueError("移行中のインデックスがありません")
+            self._save({"active": state["migration"], "migration": None, "previous": state["active"]})
+            return state["migration"]
+
+    def rollback(self) -> IndexTarget:
+        """検索先を切り替え前のインデックスに戻す"""
+        with self._lock:
+            self._refresh()
+            state = self._state
+            if state["previous"] is None:
+                raise ValueError("切り替え前のインデックスの記録がありません")
+            self._save({"active": state["previous"], "migration": None, "previous": state["active"]})
+            return state["previous"]
+
+    def abort_migration(self) -> None:
+        """移行を中止し、移行先への書き込みを止める（移行先のインデックスは削除しない）"""
+        with self._lock:
+            self._refresh()
+            self._save({**self._state, "migration": None})
+
+
+_shared_alias = None
+_shared_alias_lock = threading.Lock()
+
+def get_index_alias() -> IndexAlias:
+    """プロセス内で共有するインデックスのエイリアスを取得"""
+    global _shared_alias
+    if _shared_alias is None:
+        with _shared_alias_lock:
+            if _shared_alias is None:
+                _shared_alias = IndexAlias()
+    return _shared_alias
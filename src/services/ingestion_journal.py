@@ -0,0 +1,155 @@
+from typing import List, Dict, Any, Optional
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from ..config.settings import INGESTION_JOURNAL_DIR
+
+
+class IngestionJournal:
+    """チャンクごとの処理状態を追記していくインジェストジャーナル（JSONL）
+
+    状態は ``embedded``（埋め込み生成済み）、``upserted``（アップロード済み）、
+    ``failed``（失敗・再試行対象）、``dead``（再試行上限に達した）、
+    ``retry``（デッドレターから再試行対象に戻した）のいずれか。
+    中断したジョブは同じジャーナルを読み込むことで、アップロード済みのチャンクを飛ばして再開できる。
+    ``embedded`` のチャンクもベクトルは保存しないため、再開時は埋め込みから処理し直す
+    （埋め込みキャッシュが有効な場合のみ、生成済みのベクトルはAPIを呼び出さずに取得できる）。
+    再試行上限に達したチャンクはデッドレターファイルに書き出し、そのジョブでは再試行しない
+    （次にジョブを実行したときに ``retry_dead`` で再試行対象に戻す）。
+    """
+
+    EMBEDDED = "embedded"
+    UPSERTED = "upserted"
+    FAILED = "failed"
+    DEAD = "dead"
+    RETRY = "retry"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dead_letter_path = path + ".dead_letter.jsonl"
+        self.states = {}
+        self.attempts = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # 既存のジャーナルを再生して最新の状態を復元
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中で中断された最終行は無視する
+                        continue
+                    self._apply(entry)
+
+    @staticmethod
+    def _scope_prefix(scope: str) -> str:
+        """ジャーナルのファイル名に付ける、対象（ファイル名など）ごとの接頭辞"""
+        return hashlib.sha256(scope.encode("utf-8")).hexdigest()[:16] + "_"
+
+    @classmethod
+    def for_chunks(cls, chunks: List[Dict[str, Any]], directory: str = INGESTION_JOURNAL_DIR, scope: Optional[str] = None) -> "IngestionJournal":
+        """チャンクの内容から決まるジョブIDのジャーナルを開く（同じ内容の再アップロードで再開できる）
+
+        ``scope`` を指定すると、その対象のジャーナルとしてファイル名に接頭辞を付ける
+        （``remove_stale`` で同じ対象の古いジャーナルを削除できるように）。
+        """
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            digest.update(chunk["id"].encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(chunk["text"].encode("utf-8"))
+            digest.update(b"\0")
+        prefix = cls._scope_prefix(scope) if scope is not None else ""
+        return cls(os.path.join(directory, f"{prefix}{digest.hexdigest()[:32]}.jsonl"))
+
+    def remove_stale(self, scope: str) -> None:
+        """同じ対象の他のジャーナルを削除（差分の取り直しで、以前のジョブは不要になった場合）
+
+        デッドレターファイルは失敗の記録として残す。
+        """
+        directory = os.path.dirname(self.path) or "."
+        pattern = os.path.join(glob.escape(directory), self._scope_prefix(scope) + "*.jsonl")
+        for path in glob.glob(pattern):
+            if path != self.path and not path.endswith(".dead_letter.jsonl"):
+                os.remove(path)
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        self.states[entry["id"]] = entry["state"]
+        if entry["state"] == self.FAILED:
+            self.attempts[entry["id"]] = self.attempts.get(entry["id"], 0) + 1
+        elif entry["state"] == self.RETRY:
+            self.attempts[entry["id"]] = 0
+
+    def record(self, ids: List[str], state: str, error: Optional[str] = None) -> None:
+        """チャンクの状態をジャーナルに追記"""
+        if not ids:
+            return
+        now = time.time()
+        entries = []
+        for chunk_id in ids:
+            entry = {"id": chunk_id, "state": state, "ts": now}
+            if error:
+                entry["error"] = error
+            entries.append(entry)
+
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            for entry in entries:
+                self._apply(entry)
+
+    def add_dead_letters(self, chunks: List[Dict[str, Any]], error: Optional[str] = None) -> None:
+        """再試行上限に達したチャンクをデッドレターとして記録"""
+        if not chunks:
+            return
+        with self._lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(json.dumps({"chunk": chunk, "error": error, "ts": time.time()}, ensure_ascii=False) + "\n")
+        self.record([chunk["id"] for chunk in chunks], self.DEAD, error)
+
+    def get_dead_letters(self) -> List[Dict[str, Any]]:
+        """デッドレターとして記録されたチャンクを取得"""
+        if not os.path.exists(self.dead_letter_path):
+            return []
+        with open(self.dead_letter_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def retry_dead(self) -> int:
+        """デッドレターのチャンクを再試行対象に戻し、戻した件数を返す（一時的な障害で失敗した場合に備える）"""
+        with self._lock:
+            dead_ids = [chunk_id for chunk_id, state in self.states.items() if state == self.DEAD]
+        self.record(dead_ids, self.RETRY)
+        return len(dead_ids)
+
+    def pending(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """アップロード済み・デッドレター以外のチャンクを返す"""
+        with self._lock:
+            return [
+                chunk for chunk in chunks
+                if self.states.get(chunk["id"]) not in (self.UPSERTED, self.DEAD)
+            ]
+
+    def count(self, state: str) -> int:
+        """指定した状態のチャンク数を取得"""
+        with self._lock:
+            return sum(1 for value in self.states.values() if value == state)
+
+    def remove(self) -> None:
+        """ジャーナルファイルを削除（デッドレターは残す）"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.states = {}
+            self.attempts = {}
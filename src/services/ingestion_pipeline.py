@@ -0,0 +1,156 @@
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
+import logging
+import threading
+import time
+from ..config.settings import (
+    EMBEDDING_CONCURRENCY,
+    UPSERT_CONCURRENCY,
+    MAX_PENDING_BATCHES
+)
+
+logger = logging.getLogger(__name__)
+
+EmbedFn = Callable[[List[Dict[str, Any]]], Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]
+UpsertFn = Callable[[List[Dict[str, Any]], int], None]
+
+
+class StageStats:
+    """パイプラインの各ステージの処理量と処理時間を集計"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.first_started = None
+        self.last_finished = None
+        self._lock = threading.Lock()
+
+    def record(self, items: int, started: float, finished: float) -> None:
+        """1バッチ分の処理結果を記録"""
+        with self._lock:
+            self.batches += 1
+            self.items += items
+            self.busy_seconds += finished - started
+            if self.first_started is None or started < self.first_started:
+                self.first_started = started
+            if self.last_finished is None or finished > self.last_finished:
+                self.last_finished = finished
+
+    def to_dict(self) -> Dict[str, Any]:
+        """統計情報を辞書形式で取得"""
+        wall_seconds = 0.0
+        if self.first_started is not None and self.last_finished is not None:
+            wall_seconds = self.last_finished - self.first_started
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+            "items_per_second": round(self.items / wall_seconds, 2) if wall_seconds > 0 else None
+        }
+
+
+class IngestionPipeline:
+    """埋め込み生成とアップロードを重ねて実行するパイプライン
+
+    埋め込みステージとアップロードステージはそれぞれ独立したスレッドプールで動作し、
+    処理中のバッチ数を ``max_pending_batches`` で制限することで、
+    大きなアップロードでもメモリ使用量が増え続けないようにする。
+    アップロードに失敗したバッチは、埋め込みに失敗したチャンクと同様に失敗したチャンクとして返し、
+    他のバッチの処理は続ける。
+    """
+
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        upsert_fn: UpsertFn,
+        embed_workers: int = EMBEDDING_CONCURRENCY,
+        upsert_workers: int = UPSERT_CONCURRENCY,
+        max_pending_batches: int = MAX_PENDING_BATCHES
+    ):
+        self.embed_fn = embed_fn
+        self.upsert_fn = upsert_fn
+        self.embed_workers = max(1, embed_workers)
+        self.upsert_workers = max(1, upsert_workers)
+        self.max_pending_batches = max(1, max_pending_batches)
+
+    def run(self, batches: Iterable[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """バッチ列を処理し、ステージごとのスループットと失敗したチャンクを返す"""
+        embed_stats = StageStats("embed")
+        upsert_stats = StageStats("upsert")
+        slots = threading.BoundedSemaphore(self.max_pending_batches)
+        failed_chunks = []
+        errors = []
+        lock = threading.Lock()
+        started = time.perf_counter()
+        total_chunks = 0
+
+        def upsert_stage(vectors: List[Dict[str, Any]], batch: List[Dict[str, Any]], batch_num: int) -> None:
+            try:
+                stage_started = time.perf_counter()
+                self.upsert_fn(vectors, batch_num)
+                upsert_stats.record(len(vectors), stage_started, time.perf_counter())
+            except Exception as e:
+                # 埋め込み済みのチャンクも含めて再試行の対象にする
+                logger.warning("バッチ %d の%d件を再試行の対象にします: %s", batch_num, len(vectors), str(e))
+                vector_ids = {vector["id"] for vector in vectors}
+                with lock:
+                    failed_chunks.extend(chunk for chunk in batch if chunk["id"] in vector_ids)
+            finally:
+                slots.release()
+
+        def embed_stage(batch: List[Dict[str, Any]], batch_num: int) -> Optional[Future]:
+            try:
+                stage_started = time.perf_counter()
+                vectors, batch_failed = self.embed_fn(batch)
+                embed_stats.record(len(batch), stage_started, time.perf_counter())
+                if batch_failed:
+                    with lock:
+                        failed_chunks.extend(batch_failed)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                slots.release()
+                return None
+
+            if not vectors:
+                slots.release()
+                return None
+            # スロットはアップロード完了時に解放される
+            return upsert_pool.submit(upsert_stage, vectors, batch, batch_num)
+
+        with ThreadPoolExecutor(max_workers=self.upsert_workers, thread_name_prefix="upsert") as upsert_pool:
+            with ThreadPoolExecutor(max_workers=self.embed_workers, thread_name_prefix="embed") as embed_pool:
+                embed_futures = []
+                for batch_num, batch in enumerate(batches, 1):
+                    # 処理中のバッチ数が上限に達している間は次のバッチを読み込まない
+                    slots.acquire()
+                    if errors:
+                        slots.release()
+                        break
+                    total_chunks += len(batch)
+                    logger.info("バッチ %d を処理中... (%d件)", batch_num, len(batch))
+                    embed_futures.append(embed_pool.submit(embed_stage, batch, batch_num))
+
+                upsert_futures = [future.result() for future in embed_futures]
+
+            for future in upsert_futures:
+                if future is not None:
+                    future.result()
+
+        if errors:
+            raise errors[0]
+
+        elapsed = time.perf_counter() - started
+        return {
+            "total_chunks": total_chunks,
+            "elapsed_seconds": round(elapsed, 3),
+            "chunks_per_second": round(total_chunks / elapsed, 2) if elapsed > 0 else None,
+            "stages": {
+                "embed": embed_stats.to_dict(),
+                "upsert": upsert_stats.to_dict()
+            },
+            "failed_chunks": failed_chunks
+        }
@@ -1,133 +1,466 @@
-from typing import List, Dict, Any, Tuple
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_community.chat_message_histories import ChatMessageHistory
+from typing import List, Dict, Any, Tuple, Optional, Iterator
+from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage, AIMessage
-import os
+from langchain.schema import BaseMessage, HumanMessage, AIMessage
+from langchain_core.language_models.chat_models import BaseChatModel
+import asyncio
+import logging
+import time
+from .pinecone_service import PineconeService, get_pinecone_service
+from .request_policy import get_request_policy
+from .conversation_memory import ConversationMemory, estimate_message_tokens
+from .semantic_cache import SemanticAnswerCache, get_semantic_cache, get_index_generation
+from ..utils.metrics import RequestTimer, measure_stage
+from ..utils.context_assembly import assemble_context
+from ..config.runtime_settings import get_runtime_settings
 from ..config.settings import (
-    PINECONE_API_KEY,
-    PINECONE_INDEX_NAME,
     OPENAI_API_KEY,
-    DEFAULT_TOP_K,
-    SIMILARITY_THRESHOLD,
     DEFAULT_SYSTEM_PROMPT,
-    DEFAULT_RESPONSE_TEMPLATE
+    DEFAULT_RESPONSE_TEMPLATE,
+    MEMORY_SUMMARY_MAX_CHARS,
+    MULTI_QUERY_RETRIEVAL
 )
 
+logger = logging.getLogger(__name__)
+
 class LangChainService:
-    def __init__(self):
-        """LangChainサービスの初期化"""
+    def __init__(self, pinecone_service: Optional[PineconeService] = None, llm: Optional[BaseChatModel] = None):
+        """LangChainサービスの初期化（``llm`` を渡すとOpenAIの代わりにそのチャットモデルを使う）"""
+        # プロセス内で共有するPineconeServiceのベクトルストアを使い回す
+        self.pinecone_service = pinecone_service or get_pinecone_service()
+        
         # チャットモデルの初期化
-        self.llm = ChatOpenAI(
+        # 再試行はリクエストポリシーで行うため、クライアント側の再試行は無効にする
+        self.llm = llm or ChatOpenAI(
             api_key=OPENAI_API_KEY,
             model_name="gpt-3.5-turbo",
-            temperature=0.7
-        )
-        
-        # 埋め込みモデルの初期化
-        self.embeddings = OpenAIEmbeddings(
-            api_key=OPENAI_API_KEY,
-            model="text-embedding-ada-002"
+            temperature=0.7,
+            max_retries=0
         )
+        self.request_policy = get_request_policy("openai")
         
-        # PineconeのAPIキーを環境変数に設定
-        os.environ["PINECONE_API_KEY"] = PINECONE_API_KEY
-        
-        # Pineconeベクトルストアの初期化
-        self.vectorstore = PineconeVectorStore.from_existing_index(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=self.embeddings
-        )
+        # 質問の埋め込みは、検索先のインデックスと同じモデルを使うようPineconeServiceで行う
         
-        # チャット履歴の初期化
-        self.message_history = ChatMessageHistory()
+        # チャット履歴の初期化（古い会話はバックグラウンドで要約してトークン数を抑える）
+        self.message_history = ConversationMemory(summarize_fn=self._summarize_history)
         
         # デフォルトのプロンプトテンプレート
         self.system_prompt = DEFAULT_SYSTEM_PROMPT
         self.response_template = DEFAULT_RESPONSE_TEMPLATE
 
-    def get_relevant_context(self, query: str, top_k: int = DEFAULT_TOP_K) -> Tuple[str, List[Dict[str, Any]]]:
-        """クエリに関連する文脈を取得"""
-        # より多くの結果を取得して、後でフィルタリング
-        docs = self.vectorstore.similarity_search_with_score(query, k=top_k * 2)
+    def _summarize_history(self, summary: str, messages: List[BaseMessage]) -> str:
+        """これまでの要約に古い会話を取り込んだ新しい要約を生成"""
+        conversation = "\n".join(
+            f"{'ユーザー' if isinstance(message, HumanMessage) else 'アシスタント'}: {message.content}"
+            for message in messages
+        )
+        prompt = ChatPromptTemplate.from_messages([
+            ("system",
+             "これまでの会話の要約と、その後の会話が与えられます。"
+             "後の質問に答えるために必要な事実・ユーザーの関心・決定事項を残し、"
+             "{max_chars}文字以内の日本語の要約に更新してください。"),
+            ("human", "これまでの要約:\n{summary}\n\nその後の会話:\n{conversation}")
+        ])
+        inputs = {
+            "max_chars": MEMORY_SUMMARY_MAX_CHARS,
+            "summary": summary or "（なし）",
+            "conversation": conversation
+        }
+        response = self.request_policy.call(
+            lambda: (prompt | self.llm).invoke(inputs),
+            "会話の要約",
+            tokens=len(summary) + estimate_message_tokens(messages)
+        )
+        return response.content[:MEMORY_SUMMARY_MAX_CHARS * 2]
+
+    def _retrieval_queries(self, query: str) -> List[str]:
+        """検索に使うクエリの一覧（設定により、直前の質問を補った追加クエリを含める）"""
+        queries = [query]
+        if MULTI_QUERY_RETRIEVAL:
+            previous_questions = [
+                message.content for message in self.message_history.messages
+                if isinstance(message, HumanMessage)
+            ]
+            if previous_questions:
+                # 「それはいつ？」のような、前の質問を前提にした質問でも関連する文書を探せるようにする
+                queries.append(f"{previous_questions[-1]}\n{query}")
+        return queries
+
+    @staticmethod
+    def _merge_results(results_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """複数クエリの検索結果を統合（同じチャンクはスコアの高い方を残す）
+
+        ハイブリッド検索の結果はRRFスコア（``rank_score``）、それ以外はコサイン類似度で比較する。
+        """
+        def ranking_score(match):
+            rank_score = getattr(match, "rank_score", None)
+            return rank_score if rank_score is not None else match.score
         
-        # スコアでフィルタリング
-        filtered_docs = [
-            doc for doc in docs 
-            if doc[1] >= SIMILARITY_THRESHOLD
-        ][:top_k]  # 上位K件に制限
+        def merge(matches_list):
+            best = {}
+            for matches in matches_list:
+                for match in matches:
+                    if match.id not in best or ranking_score(match) > ranking_score(best[match.id]):
+                        best[match.id] = match
+            return sorted(best.values(), key=ranking_score, reverse=True)
+        
+        if len(results_list) == 1:
+            return results_list[0]
+        return {
+            "matches": merge(results["matches"] for results in results_list),
+            "candidates": merge(results["candidates"] for results in results_list),
+            "query_vector": results_list[0]["query_vector"]
+        }
+
+    def get_relevant_context(self, query: str, top_k: Optional[int] = None, timer: Optional[RequestTimer] = None) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """クエリに関連する文脈を取得し、(文脈, 検索結果の詳細, 文脈の統計情報) を返す"""
+        # 1回のリクエストでは同じ設定値を使う（検索中に設定が保存されても途中で変わらない）
+        settings = get_runtime_settings().snapshot()
+        top_k = top_k or settings["top_k"]
+        # PineconeServiceのベクトルストア経由で検索し、スコアでフィルタリング
+        results = self._merge_results([
+            self.pinecone_service.query(
+                retrieval_query,
+                top_k=top_k,
+                similarity_threshold=settings["similarity_threshold"],
+                timer=timer,
+                include_values=True
+            )
+            for retrieval_query in self._retrieval_queries(query)
+        ])
+        return self._assemble_context(query, results, top_k, timer, settings)
+
+    async def aget_relevant_context(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        timer: Optional[RequestTimer] = None,
+        query_vector: Optional[List[float]] = None
+    ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """``get_relevant_context`` の非同期版（複数のクエリは同時に検索する）"""
+        settings = get_runtime_settings().snapshot()
+        top_k = top_k or settings["top_k"]
+        queries = self._retrieval_queries(query)
+        results_list = await asyncio.gather(*[
+            self.pinecone_service.aquery(
+                retrieval_query,
+                top_k=top_k,
+                similarity_threshold=settings["similarity_threshold"],
+                timer=timer,
+                include_values=True,
+                # 元の質問の埋め込みは取得済みであれば使い回す
+                query_vector=query_vector if retrieval_query == query else None
+            )
+            for retrieval_query in queries
+        ])
+        return self._assemble_context(query, self._merge_results(results_list), top_k, timer, settings)
+
+    def _assemble_context(
+        self,
+        query: str,
+        results: Dict[str, Any],
+        top_k: int,
+        timer: Optional[RequestTimer],
+        settings: Dict[str, Any]
+    ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """検索結果から文脈に含めるチャンクを選び、(文脈, 検索結果の詳細, 文脈の統計情報) を返す"""
+        filtered_matches = results["matches"]
         
         # フィルタリング後の結果が0件の場合は、スコアに関係なく上位K件を使用
-        if not filtered_docs and docs:
-            filtered_docs = docs[:top_k]
+        if not filtered_matches and results["candidates"]:
+            filtered_matches = results["candidates"][:top_k]
+        
+        # 重複を除き、多様性を考慮してトークン数の上限まで詰める
+        with measure_stage("context_assembly", timer, candidates=len(filtered_matches)) as stage:
+            filtered_matches, context_stats = assemble_context(
+                results["query_vector"],
+                filtered_matches,
+                token_budget=settings["context_token_budget"],
+                max_chunks=top_k
+            )
+            context_stats["設定バージョン"] = settings["version"]
+            stage["context_tokens"] = context_stats["トークン数"]
         
-        context_text = "\n".join([doc[0].page_content for doc in filtered_docs])
+        filtered_docs = [(match.metadata["text"], match.score) for match in filtered_matches]
+        
+        context_text = "\n".join([doc[0] for doc in filtered_docs])
         search_details = [
             {
                 "スコア": round(doc[1], 4),  # 類似度スコアを小数点4桁まで表示
-                "テキスト": doc[0].page_content[:100] + "..."  # テキストの一部を表示
+                "テキスト": doc[0][:100] + "..."  # テキストの一部を表示
             }
             for doc in filtered_docs
         ]
         
-        print(f"検索クエリ: {query}")  # デバッグ用
-        print(f"検索結果数: {len(filtered_docs)}")  # デバッグ用
+        logger.debug("検索クエリ: %s（検索結果数: %d）", query, len(filtered_docs))
         for detail in search_details:
-            print(f"スコア: {detail['スコア']}, テキスト: {detail['テキスト']}")  # デバッグ用
+            logger.debug("スコア: %s, テキスト: %s", detail["スコア"], detail["テキスト"])
         
-        return context_text, search_details
+        return context_text, search_details, context_stats
 
-    def get_response(self, query: str, system_prompt: str = None, response_template: str = None) -> Tuple[str, Dict[str, Any]]:
-        """クエリに対する応答を生成"""
-        # プロンプトの設定
-        system_prompt = system_prompt or self.system_prompt
-        response_template = response_template or self.response_template
-        
-        # プロンプトテンプレートの設定
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("system", "参照文脈:\n{context}"),
-            ("human", "{input}")
-        ])
+    def _lookup_cached_answer(
+        self,
+        query: str,
+        system_prompt: str,
+        response_template: str,
+        timer: RequestTimer,
+        query_vector: Optional[List[float]] = None
+    ) -> Tuple[Optional[Tuple], Optional[Tuple[str, Dict[str, Any]]]]:
+        """類似質問の回答キャッシュを確認し、(キャッシュキー, ヒットした回答) を返す
+
+        回答は会話履歴にも依存するため、履歴（要約を含む）がある場合はキャッシュを使わない。
+        """
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is None or self.message_history.messages:
+            return None, None
         
-        # チェーンの初期化
-        chain = prompt | self.llm
+        with measure_stage("cache_lookup", timer) as stage:
+            # 検索時と同じ埋め込みを使う（キャッシュ・流量制限はPineconeServiceで共通）
+            if query_vector is None:
+                query_vector = self.pinecone_service.get_embedding(query)
+            template_key = SemanticAnswerCache.make_template_key(system_prompt, response_template)
+            generation = get_index_generation()
+            cache_key = (query_vector, template_key, generation)
+            
+            cached = semantic_cache.lookup(*cache_key)
+            stage["hits"] = int(cached is not None)
+        if cached is None:
+            return cache_key, None
         
+        answer, details, distance = cached
+        details["キャッシュヒット"] = True
+        details["キャッシュ距離"] = round(distance, 4)
+        details["処理時間の内訳"] = timer.breakdown()
+        return cache_key, (answer, details)
+
+    def _prepare_chain(self, query: str, system_prompt: str, response_template: str, timer: RequestTimer) -> Tuple[Any, Dict[str, Any], Dict[str, Any]]:
+        """応答生成用のチェーン・入力・詳細情報を準備"""
         # 関連する文脈を取得
-        context, search_details = self.get_relevant_context(query)
-        
-        # チャット履歴を取得
-        chat_history = self.message_history.messages
-        
-        # 応答を生成
-        response = chain.invoke({
-            "chat_history": chat_history,
-            "context": context,
-            "input": query
-        })
-        
-        # メッセージを履歴に追加
-        self.message_history.add_user_message(query)
-        self.message_history.add_ai_message(response.content)
+        context, search_details, context_stats = self.get_relevant_context(query, timer=timer)
+        return self._build_chain(query, system_prompt, response_template, context, search_details, context_stats, timer)
+
+    def _build_chain(
+        self,
+        query: str,
+        system_prompt: str,
+        response_template: str,
+        context: str,
+        search_details: List[Dict[str, Any]],
+        context_stats: Dict[str, Any],
+        timer: RequestTimer
+    ) -> Tuple[Any, Dict[str, Any], Dict[str, Any]]:
+        """取得した文脈から応答生成用のチェーン・入力・詳細情報を作成"""
+        with measure_stage("prompt_build", timer) as stage:
+            # プロンプトテンプレートの設定
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", system_prompt),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("system", "参照文脈:\n{context}"),
+                ("human", "{input}")
+            ])
+            
+            # チェーンの初期化
+            chain = prompt | self.llm
+            
+            # チャット履歴を取得
+            chat_history = self.message_history.messages
+            
+            inputs = {
+                "chat_history": chat_history,
+                "context": context,
+                "input": query
+            }
+            stage["prompt_tokens"] = self._estimate_prompt_tokens(inputs)
         
         # 詳細情報の作成
         details = {
             "モデル": "GPT-3.5-turbo",
-            "会話履歴": "有効",
+            "会話履歴": self.message_history.get_stats(),
             "文脈検索": {
                 "検索結果数": len(search_details),
+                "文脈のトークン数": context_stats["トークン数"],
+                "重複として除外": context_stats["重複として除外"],
+                "上限超過で除外": context_stats["上限超過で除外"],
+                "切り詰め": context_stats["切り詰め"],
+                "設定バージョン": context_stats["設定バージョン"],
                 "マッチしたチャンク": search_details
             },
             "プロンプト": {
                 "システムプロンプト": system_prompt,
                 "応答テンプレート": response_template
-            }
+            },
+            "キャッシュヒット": False
+        }
+        
+        return chain, inputs, details
+
+    @staticmethod
+    def _estimate_prompt_tokens(inputs: Dict[str, Any]) -> int:
+        """流量制限用にプロンプトのトークン数を概算（日本語は1文字1トークン程度）"""
+        history_length = estimate_message_tokens(inputs["chat_history"])
+        return history_length + len(inputs["context"]) + len(inputs["input"])
+
+    def _finish_response(self, query: str, answer: str, details: Dict[str, Any], cache_key: Optional[Tuple]) -> None:
+        """生成した応答を履歴と回答キャッシュに記録"""
+        # メッセージを履歴に追加
+        self.message_history.add_user_message(query)
+        self.message_history.add_ai_message(answer)
+        
+        if cache_key is not None and not details["キャッシュヒット"]:
+            get_semantic_cache().store(*cache_key, answer, details)
+
+    def get_response(self, query: str, system_prompt: str = None, response_template: str = None) -> Tuple[str, Dict[str, Any]]:
+        """クエリに対する応答を生成"""
+        started = time.perf_counter()
+        timer = RequestTimer()
+        
+        # プロンプトの設定
+        system_prompt = system_prompt or self.system_prompt
+        response_template = response_template or self.response_template
+        
+        # 類似質問の回答キャッシュを確認
+        cache_key, cached = self._lookup_cached_answer(query, system_prompt, response_template, timer)
+        if cached is not None:
+            answer, details = cached
+            self._finish_response(query, answer, details, cache_key)
+            return answer, details
+        
+        chain, inputs, details = self._prepare_chain(query, system_prompt, response_template, timer)
+        
+        # 応答を生成
+        prompt_tokens = self._estimate_prompt_tokens(inputs)
+        with measure_stage("llm", timer, prompt_tokens=prompt_tokens) as stage:
+            response = self.request_policy.call(
+                lambda: chain.invoke(inputs),
+                "応答の生成",
+                tokens=prompt_tokens
+            )
+            stage["completion_chars"] = len(response.content)
+            # APIが返した実際のトークン数があれば概算値を置き換える
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                stage["prompt_tokens"] = usage.get("input_tokens", prompt_tokens)
+                stage["completion_tokens"] = usage.get("output_tokens", 0)
+        
+        details["応答時間"] = {
+            "合計（秒）": round(time.perf_counter() - started, 3)
         }
+        details["処理時間の内訳"] = timer.breakdown()
+        self._finish_response(query, response.content, details, cache_key)
         
         return response.content, details
 
+    async def aget_response(self, query: str, system_prompt: str = None, response_template: str = None) -> Tuple[str, Dict[str, Any]]:
+        """``get_response`` の非同期版
+
+        埋め込み・応答生成は非同期クライアントで待機し、複数クエリの検索は同時に実行するため、
+        1つのサーバープロセスで多数のセッションの待ち時間を重ねられる。
+        """
+        started = time.perf_counter()
+        timer = RequestTimer()
+        
+        # プロンプトの設定
+        system_prompt = system_prompt or self.system_prompt
+        response_template = response_template or self.response_template
+        
+        # 回答キャッシュの確認と検索で同じ埋め込みを使うため、先に1回だけ取得する
+        with measure_stage("embed", timer, items=1, chars=len(query)):
+            query_vector = await self.pinecone_service.aget_embedding(query)
+        
+        # 類似質問の回答キャッシュを確認
+        cache_key, cached = self._lookup_cached_answer(query, system_prompt, response_template, timer, query_vector)
+        if cached is not None:
+            answer, details = cached
+            self._finish_response(query, answer, details, cache_key)
+            return answer, details
+        
+        context, search_details, context_stats = await self.aget_relevant_context(query, timer=timer, query_vector=query_vector)
+        chain, inputs, details = self._build_chain(query, system_prompt, response_template, context, search_details, context_stats, timer)
+        
+        # 応答を生成
+        prompt_tokens = self._estimate_prompt_tokens(inputs)
+        with measure_stage("llm", timer, prompt_tokens=prompt_tokens) as stage:
+            response = await self.request_policy.acall(
+                lambda: chain.ainvoke(inputs),
+                "応答の生成",
+                tokens=prompt_tokens
+            )
+            stage["completion_chars"] = len(response.content)
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                stage["prompt_tokens"] = usage.get("input_tokens", prompt_tokens)
+                stage["completion_tokens"] = usage.get("output_tokens", 0)
+        
+        details["応答時間"] = {
+            "合計（秒）": round(time.perf_counter() - started, 3)
+        }
+        details["処理時間の内訳"] = timer.breakdown()
+        self._finish_response(query, response.content, details, cache_key)
+        
+        return response.content, details
+
+    def stream_response(self, query: str, system_prompt: str = None, response_template: str = None) -> Tuple[Iterator[str], Dict[str, Any]]:
+        """クエリに対する応答をトークン単位で返すジェネレーターと詳細情報を返す
+
+        詳細情報の応答時間と会話履歴は、ジェネレーターを最後まで読み終えた時点で記録される。
+        """
+        started = time.perf_counter()
+        timer = RequestTimer()
+        
+        # プロンプトの設定
+        system_prompt = system_prompt or self.system_prompt
+        response_template = response_template or self.response_template
+        
+        # 類似質問の回答キャッシュを確認
+        cache_key, cached = self._lookup_cached_answer(query, system_prompt, response_template, timer)
+        if cached is not None:
+            answer, details = cached
+            
+            def replay() -> Iterator[str]:
+                yield answer
+                self._finish_response(query, answer, details, cache_key)
+            
+            return replay(), details
+        
+        chain, inputs, details = self._prepare_chain(query, system_prompt, response_template, timer)
+        
+        def generate() -> Iterator[str]:
+            first_token_at = None
+            parts = []
+            
+            prompt_tokens = self._estimate_prompt_tokens(inputs)
+            with measure_stage("llm", timer, prompt_tokens=prompt_tokens) as stage:
+                response_stream = self.request_policy.stream(
+                    lambda: chain.stream(inputs),
+                    "応答の生成",
+                    tokens=prompt_tokens
+                )
+                for chunk in response_stream:
+                    if not chunk.content:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(chunk.content)
+                    yield chunk.content
+                stage["completion_chars"] = sum(len(part) for part in parts)
+            
+            finished = time.perf_counter()
+            details["応答時間"] = {
+                "最初のトークンまで（秒）": round((first_token_at or finished) - started, 3),
+                "合計（秒）": round(finished - started, 3)
+            }
+            details["処理時間の内訳"] = timer.breakdown()
+            self._finish_response(query, "".join(parts), details, cache_key)
+        
+        return generate(), details
+
     def clear_memory(self):
         """会話メモリをクリア"""
-        self.message_history.clear() 
\ No newline at end of file
+        self.message_history.clear()
+
+    def restore_memory(self, messages: List[Dict[str, Any]], summary: str = "") -> None:
+        """保存した会話（``role`` と ``content`` を持つ辞書）と要約から会話メモリを復元"""
+        self.message_history.restore(summary, [
+            HumanMessage(content=message["content"]) if message["role"] == "user" else AIMessage(content=message["content"])
+            for message in messages
+        ]) 
\ No newline at end of file
@@ -0,0 +1,195 @@
+from typing import List, Dict, Any, Optional, Tuple
+from collections import Counter
+import math
+import os
+import sqlite3
+import threading
+from ..utils.text_processing import JapaneseTextProcessor
+from ..config.settings import (
+    HYBRID_SEARCH_ENABLED,
+    LEXICAL_INDEX_PATH,
+    BM25_K1,
+    BM25_B,
+    RRF_K
+)
+
+
+class BM25Index:
+    """Janomeで抽出した索引語によるBM25の転置インデックス（SQLiteに保存）
+
+    追加・削除したチャンクの行のみ書き込み、検索のたびにSQLiteから読むため、
+    アプリと ``ingest.py`` など複数のプロセスが同じ索引を更新しても互いの変更を上書きしない。
+    索引にはIDと索引語の出現回数のみ保存し、本文はチャンクストアまたはベクトルのインデックスから取得する。
+    """
+
+    def __init__(self, path: str = LEXICAL_INDEX_PATH, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.text_processor = JapaneseTextProcessor()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 統計値の更新は BEGIN IMMEDIATE で他のプロセスと直列化するため、トランザクションは明示的に開始する
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, id TEXT NOT NULL, count INTEGER NOT NULL, length INTEGER NOT NULL, "
+            "PRIMARY KEY (term, id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_id ON postings (id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO stats (key, value) VALUES ('document_count', 0), ('total_length', 0)")
+
+    def analyze(self, text: str) -> Dict[str, int]:
+        """テキストの索引語ごとの出現回数"""
+        return dict(Counter(self.text_processor.extract_terms(text)))
+
+    def _delete_rows(self, ids: List[str]) -> None:
+        """文書と索引語の行を削除し、統計値を更新（トランザクション内で呼び出す）"""
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            count, total_length = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents WHERE id IN ({placeholders})",
+                part
+            ).fetchone()
+            if not count:
+                continue
+            self._conn.execute(f"DELETE FROM documents WHERE id IN ({placeholders})", part)
+            self._conn.execute(f"DELETE FROM postings WHERE id IN ({placeholders})", part)
+            self._update_stats(-count, -total_length)
+
+    def _update_stats(self, count_delta: int, length_delta: int) -> None:
+        self._conn.executemany(
+            "UPDATE stats SET value = value + ? WHERE key = ?",
+            [(count_delta, "document_count"), (length_delta, "total_length")]
+        )
+
+    def add_documents(self, chunks: List[Dict[str, Any]]) -> None:
+        """チャンクを索引に追加（同じIDは置き換え）
+
+        チャンクに ``term_counts`` が含まれていれば、形態素解析を省略してその出現回数を使う。
+        """
+        # 形態素解析はロックの外で行う
+        analyzed = {}
+        for chunk in chunks:
+            term_counts = chunk.get("term_counts")
+            analyzed[chunk["id"]] = term_counts if term_counts is not None else self.analyze(chunk["text"])
+        if not analyzed:
+            return
+        lengths = {doc_id: sum(term_counts.values()) for doc_id, term_counts in analyzed.items()}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_rows(list(analyzed))
+                self._conn.executemany("INSERT INTO documents (id, length) VALUES (?, ?)", lengths.items())
+                self._conn.executemany(
+                    "INSERT INTO postings (term, id, count, length) VALUES (?, ?, ?, ?)",
+                    [
+                        (term, doc_id, count, lengths[doc_id])
+                        for doc_id, term_counts in analyzed.items()
+                        for term, count in term_counts.items()
+                    ]
+                )
+                self._update_stats(len(lengths), sum(lengths.values()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def remove_documents(self, ids: List[str]) -> None:
+        """指定したIDを索引から削除"""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_rows(list(dict.fromkeys(ids)))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self) -> None:
+        """索引を全て削除"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM documents")
+                self._conn.execute("DELETE FROM postings")
+                self._conn.execute("UPDATE stats SET value = 0")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def missing_ids(self, ids: List[str]) -> List[str]:
+        """索引に含まれていないIDを返す（既存のチャンクを索引に追加する場合）"""
+        found = set()
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                found.update(row[0] for row in self._conn.execute(
+                    f"SELECT id FROM documents WHERE id IN ({placeholders})", part
+                ))
+        return [doc_id for doc_id in ids if doc_id not in found]
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """BM25スコアの高い順に (ID, スコア) を返す"""
+        query_terms = set(self.text_processor.extract_terms(query))
+        if not query_terms:
+            return []
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT key, value FROM stats"))
+            document_count = stats["document_count"]
+            if not document_count:
+                return []
+            average_length = stats["total_length"] / document_count
+
+            scores = Counter()
+            for term in query_terms:
+                postings = self._conn.execute(
+                    "SELECT id, count, length FROM postings WHERE term = ?", (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, count, length in postings:
+                    denominator = count + self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] += idf * count * (self.k1 + 1) / denominator
+
+        return scores.most_common(top_k)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT value FROM stats WHERE key = 'document_count'").fetchone()[0]
+
+
+def reciprocal_rank_fusion(ranked_id_lists: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """複数の順位付きIDリストをReciprocal Rank Fusionで統合"""
+    scores = Counter()
+    for ranked_ids in ranked_id_lists:
+        for rank, doc_id in enumerate(ranked_ids, 1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return scores.most_common()
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+def get_lexical_index() -> Optional[BM25Index]:
+    """プロセス内で共有するBM25索引を取得（ハイブリッド検索が無効な場合はNone）"""
+    global _shared_index
+    if not HYBRID_SEARCH_ENABLED:
+        return None
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                _shared_index = BM25Index()
+    return _shared_index
@@ -1,25 +1,126 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Tuple, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
 from pinecone import Pinecone, ServerlessSpec
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
+import httpx
+import logging
+import re
+import threading
 import time
+import numpy as np
+from .ingestion_pipeline import IngestionPipeline
+from .embedding_cache import get_embedding_cache
+from .semantic_cache import bump_index_generation
+from .vector_store import VectorStoreBackend, PineconeBackend, LocalVectorStore, VectorMatch
+from .index_alias import IndexTarget, IndexAlias, get_index_alias
+from .lexical_index import get_lexical_index, reciprocal_rank_fusion
+from .adaptive_retrieval import get_adaptive_overfetch
+from .chunk_store import ChunkStore, get_chunk_store
+from .ingestion_journal import IngestionJournal
+from .request_policy import get_request_policy, is_input_error
+from ..config.runtime_settings import get_runtime_setting
+from ..utils.metrics import RequestTimer, get_metrics_sink, measure_stage
 from ..config.settings import (
     PINECONE_API_KEY,
     PINECONE_INDEX_NAME,
+    VECTOR_STORE_BACKEND,
     OPENAI_API_KEY,
-    EMBEDDING_MODEL,
-    BATCH_SIZE,
-    DEFAULT_TOP_K,
-    SIMILARITY_THRESHOLD
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_TOKENS_PER_REQUEST,
+    INGESTION_JOURNAL_ENABLED,
+    MAX_CHUNK_RETRIES,
+    HTTP_POOL_SIZE,
+    INDEX_READY_TIMEOUT,
+    INDEX_STATS_TTL
 )
 
+logger = logging.getLogger(__name__)
+
 class PineconeService:
-    def __init__(self):
-        """Pineconeサービスの初期化"""
+    def __init__(self, openai_client: Optional[OpenAI] = None, index: Optional[VectorStoreBackend] = None):
+        """Pineconeサービスの初期化
+
+        ``openai_client`` と ``index`` を渡すと、設定から接続先を作らずにそれらを使う
+        （ベンチマークなどでローカルの代替実装に差し替える場合）。
+        """
         try:
+            # 非同期クライアントはイベントループごとに必要になった時点で作成する
+            # （クライアントを差し替えた場合は作成せず、同期クライアントをスレッドで呼び出す）
+            self._async_openai_client = None
+            self._async_openai_loop = None
+            self._use_async_openai = openai_client is None
+            
             # OpenAIクライアントの初期化
-            if not OPENAI_API_KEY:
-                raise ValueError("OpenAI APIキーが設定されていません")
-            self.openai_client = OpenAI(api_key=OPENAI_API_KEY)
+            if openai_client is not None:
+                self.openai_client = openai_client
+            else:
+                if not OPENAI_API_KEY:
+                    raise ValueError("OpenAI APIキーが設定されていません")
+                # 並行リクエストでも接続を使い回せるよう、接続プールの大きさを指定
+                # 再試行はリクエストポリシーで行うため、クライアント側の再試行は無効にする
+                self.openai_client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    max_retries=0,
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=HTTP_POOL_SIZE,
+                            max_keepalive_connections=HTTP_POOL_SIZE
+                        )
+                    )
+                )
+            
+            # 埋め込みキャッシュ（LangChainServiceと共有）
+            self.embedding_cache = get_embedding_cache()
+            
+            # 埋め込みAPIで消費したトークン数
+            self.embedding_tokens = 0
+            self._usage_lock = threading.Lock()
+            
+            # アップロード時の並行数（バッチ処理などから変更できる。Noneの場合は実行時設定の値）
+            self.embed_concurrency = None
+            self.upsert_concurrency = None
+            
+            # ハイブリッド検索用のキーワード索引（無効な場合はNone）
+            self.lexical_index = get_lexical_index()
+            
+            # 検索時の取得数の学習器（適応的な取得が無効な場合はNone）
+            self.adaptive_overfetch = get_adaptive_overfetch()
+            
+            # チャンクの本文の保存先（無効な場合はNoneで、本文はインデックスのメタデータに保存する）
+            self.chunk_store = get_chunk_store()
+            
+            # インデックス統計情報のキャッシュ
+            self._stats_cache = None
+            self._stats_cached_at = 0.0
+            self._stats_lock = threading.Lock()
+            
+            # 外部API呼び出しの流量制限・再試行（プロセス内で共有）
+            self.openai_policy = get_request_policy("openai")
+            
+            # インデックス名ごとに接続済みのベクトルストア（埋め込みモデルの移行中は2つになる）
+            self._backends = {}
+            self._backends_lock = threading.Lock()
+            
+            # 渡されたベクトルストアを使う場合はPineconeに接続せず、移行の記録も使わない
+            if index is not None:
+                self.index_policy = get_request_policy("local")
+                self.pc = None
+                self.alias = IndexAlias(path=None)
+                self._backends[self.alias.active.index_name] = index
+                self._active_target_seen = self.alias.active
+                return
+            
+            # 検索先と移行先のインデックスの記録（移行ツールと共有）
+            self.alias = get_index_alias()
+            self._active_target_seen = self.alias.active
+            
+            # ローカルのベクトルストアを使う場合はPineconeに接続しない
+            if VECTOR_STORE_BACKEND == "local":
+                self.index_policy = get_request_policy("local")
+                self.pc = None
+                self._get_backend(self._active_target_seen)
+                return
             
             # Pineconeの初期化
             if not PINECONE_API_KEY:
@@ -27,242 +128,1045 @@ class PineconeService:
             if not PINECONE_INDEX_NAME:
                 raise ValueError("Pineconeインデックス名が設定されていません")
             
-            self.pc = Pinecone(api_key=PINECONE_API_KEY)
+            self.pc = Pinecone(api_key=PINECONE_API_KEY, pool_threads=HTTP_POOL_SIZE)
+            self.index_policy = get_request_policy("pinecone")
             
             # インデックスの存在確認と初期化
-            self._initialize_index()
+            self._get_backend(self._active_target_seen)
             
         except Exception as e:
             raise Exception(f"Pineconeサービスの初期化に失敗しました: {str(e)}")
 
-    def _initialize_index(self):
-        """インデックスの初期化"""
-        max_retries = 3
-        retry_delay = 2  # seconds
+    def _initialize_index(self, target: IndexTarget) -> VectorStoreBackend:
+        """インデックスの初期化（存在しない場合は埋め込みモデルの次元数で作成）"""
+        # インデックスの存在確認
+        existing_indexes = self.index_policy.call(
+            lambda: self.pc.list_indexes().names(),
+            "インデックスの初期化"
+        )
+        logger.info("既存のインデックス: %s", existing_indexes)
         
-        for attempt in range(max_retries):
-            try:
-                # インデックスの存在確認
-                existing_indexes = self.pc.list_indexes().names()
-                print(f"既存のインデックス: {existing_indexes}")
-                
-                if PINECONE_INDEX_NAME not in existing_indexes:
-                    print(f"インデックス '{PINECONE_INDEX_NAME}' が存在しないため、新規作成します")
-                    # インデックスが存在しない場合は作成
-                    spec = ServerlessSpec(
-                        cloud="aws",
-                        region="us-west-2"
-                    )
-                    self.pc.create_index(
-                        name=PINECONE_INDEX_NAME,
-                        dimension=1536,  # OpenAIの埋め込みモデルの次元数
-                        metric="cosine",
-                        spec=spec
-                    )
-                    print(f"インデックス '{PINECONE_INDEX_NAME}' の作成を開始しました")
-                    # インデックスの作成完了を待機
-                    time.sleep(10)
-                
-                # インデックスの取得
-                self.index = self.pc.Index(PINECONE_INDEX_NAME)
-                print(f"インデックス '{PINECONE_INDEX_NAME}' に接続しました")
-                
-                # インデックスの状態を確認
-                stats = self.index.describe_index_stats()
-                print(f"インデックスの状態: {stats.total_vector_count}件のベクトル")
-                
+        if target.index_name not in existing_indexes:
+            logger.info("インデックス '%s' が存在しないため、新規作成します", target.index_name)
+            # インデックスが存在しない場合は作成
+            spec = ServerlessSpec(
+                cloud="aws",
+                region="us-west-2"
+            )
+            self.index_policy.call(
+                lambda: self.pc.create_index(
+                    name=target.index_name,
+                    dimension=target.index_dimension,
+                    metric="cosine",
+                    spec=spec
+                ),
+                "インデックスの作成"
+            )
+            logger.info("インデックス '%s' の作成を開始しました（%d次元）", target.index_name, target.index_dimension)
+            # インデックスの作成完了を待機
+            self._wait_for_index_ready(target.index_name)
+        
+        # インデックスの取得（統計情報は必要になった時点で取得する）
+        backend = PineconeBackend(self.pc.Index(target.index_name, pool_threads=HTTP_POOL_SIZE))
+        logger.info("インデックス '%s' に接続しました", target.index_name)
+        return backend
+
+    def _wait_for_index_ready(self, index_name: str, timeout: float = INDEX_READY_TIMEOUT) -> None:
+        """作成したインデックスが利用可能になるまでポーリング"""
+        deadline = time.monotonic() + timeout
+        poll_interval = 0.5
+        
+        while True:
+            status = self.index_policy.call(
+                lambda: self.pc.describe_index(index_name).status,
+                "インデックスの状態確認"
+            )
+            if status["ready"]:
+                logger.info("インデックス '%s' の準備が完了しました", index_name)
                 return
-                
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"インデックスの初期化に失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                    print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 待機時間を倍増
+            if time.monotonic() >= deadline:
+                raise Exception(f"インデックス '{index_name}' の準備が{timeout}秒以内に完了しませんでした")
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 5)
+
+    def _get_backend(self, target: IndexTarget) -> VectorStoreBackend:
+        """インデックスに接続したベクトルストアを取得（初回のみ接続する）"""
+        backend = self._backends.get(target.index_name)
+        if backend is not None:
+            return backend
+        with self._backends_lock:
+            if target.index_name not in self._backends:
+                if self.pc is None:
+                    self._backends[target.index_name] = LocalVectorStore(target.index_name)
+                    logger.info("ローカルのベクトルストア '%s' を使用します", target.index_name)
                 else:
-                    raise Exception(f"インデックスの初期化に失敗しました（最大試行回数到達）: {str(e)}")
+                    self._backends[target.index_name] = self._initialize_index(target)
+            return self._backends[target.index_name]
 
-    def get_embedding(self, text: str) -> List[float]:
+    def _active_target(self) -> IndexTarget:
+        """検索に使うインデックス（移行ツールで切り替えられた場合は次のリクエストから反映）"""
+        target = self.alias.active
+        if target != self._active_target_seen:
+            logger.info("検索先のインデックスを '%s'（%s）に切り替えました", target.index_name, target.model)
+            self._active_target_seen = target
+            # 埋め込みモデルが変わると過去の質問のベクトルと比較できないため、回答キャッシュも無効化する
+            bump_index_generation()
+            self.invalidate_index_stats()
+            # スコアの分布も変わるため、取得数の学習をやり直す
+            if self.adaptive_overfetch is not None:
+                self.adaptive_overfetch.reset()
+        return target
+
+    def _write_targets(self) -> List[IndexTarget]:
+        """アップロード・削除の対象となるインデックス（移行中は検索先と移行先の両方）"""
+        targets = [self._active_target()]
+        migration = self.alias.migration
+        if migration is not None and migration != targets[0]:
+            targets.append(migration)
+        return targets
+
+    @property
+    def index(self) -> VectorStoreBackend:
+        """検索に使うベクトルストア"""
+        return self._get_backend(self._active_target())
+
+    def get_embedding(self, text: str, target: Optional[IndexTarget] = None) -> List[float]:
         """テキストの埋め込みベクトルを取得"""
-        max_retries = 3
-        retry_delay = 1  # seconds
+        return self.get_embeddings([text], target)[0]
+
+    def get_embeddings(self, texts: List[str], target: Optional[IndexTarget] = None) -> List[List[float]]:
+        """複数テキストの埋め込みベクトルを取得（キャッシュ済みのテキストはAPIを呼び出さない）
+
+        ``target`` を省略すると検索に使うインデックスの埋め込みモデルで生成する。
+        """
+        target = target or self._active_target()
+        if self.embedding_cache is None:
+            return self._create_embeddings(texts, target)
+        return self.embedding_cache.get_or_compute(
+            target.cache_model, texts, lambda missing: self._create_embeddings(missing, target)
+        )
+
+    @staticmethod
+    def _embedding_params(target: IndexTarget) -> Dict[str, Any]:
+        """埋め込みAPIに渡すモデル名と次元数"""
+        params = {"model": target.model}
+        if target.dimensions is not None:
+            params["dimensions"] = target.dimensions
+        return params
+
+    def _create_embeddings(self, texts: List[str], target: IndexTarget) -> List[List[float]]:
+        """複数テキストの埋め込みベクトルを1回のAPI呼び出しでまとめて取得"""
+        response = self.openai_policy.call(
+            lambda: self.openai_client.embeddings.create(
+                input=texts,
+                **self._embedding_params(target)
+            ),
+            "埋め込みベクトルの生成",
+            tokens=sum(self._estimate_tokens(text) for text in texts)
+        )
+        if response.usage is not None:
+            with self._usage_lock:
+                self.embedding_tokens += response.usage.total_tokens
+            get_metrics_sink().increment("rag_embedding_api_tokens_total", response.usage.total_tokens)
+        # レスポンスの順序は保証されないため、indexで入力順に並べ直す
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    def _get_async_openai_client(self) -> Optional[AsyncOpenAI]:
+        """実行中のイベントループで使う非同期OpenAIクライアントを取得"""
+        if not self._use_async_openai:
+            return None
+        # 非同期の接続プールは作成したイベントループでしか使えないため、ループが変わったら作り直す
+        loop = asyncio.get_running_loop()
+        if self._async_openai_loop is not loop:
+            self._async_openai_client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=HTTP_POOL_SIZE,
+                        max_keepalive_connections=HTTP_POOL_SIZE
+                    )
+                )
+            )
+            self._async_openai_loop = loop
+        return self._async_openai_client
+
+    async def aget_embedding(self, text: str, target: Optional[IndexTarget] = None) -> List[float]:
+        """``get_embedding`` の非同期版"""
+        return (await self.aget_embeddings([text], target))[0]
+
+    async def aget_embeddings(self, texts: List[str], target: Optional[IndexTarget] = None) -> List[List[float]]:
+        """``get_embeddings`` の非同期版"""
+        target = target or self._active_target()
+        if self.embedding_cache is None:
+            return await self._acreate_embeddings(texts, target)
+        return await self.embedding_cache.aget_or_compute(
+            target.cache_model, texts, lambda missing: self._acreate_embeddings(missing, target)
+        )
+
+    async def _acreate_embeddings(self, texts: List[str], target: IndexTarget) -> List[List[float]]:
+        """``_create_embeddings`` の非同期版"""
+        client = self._get_async_openai_client()
+        if client is None:
+            return await asyncio.to_thread(self._create_embeddings, texts, target)
+        response = await self.openai_policy.acall(
+            lambda: client.embeddings.create(
+                input=texts,
+                **self._embedding_params(target)
+            ),
+            "埋め込みベクトルの生成",
+            tokens=sum(self._estimate_tokens(text) for text in texts)
+        )
+        if response.usage is not None:
+            with self._usage_lock:
+                self.embedding_tokens += response.usage.total_tokens
+            get_metrics_sink().increment("rag_embedding_api_tokens_total", response.usage.total_tokens)
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """テキストのトークン数を概算（日本語は1文字1トークン程度として安全側に見積もる）"""
+        return max(1, len(text))
+
+    def _split_embedding_batches(self, chunks: List[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """チャンクを件数と推定トークン数の上限に収まるサブバッチに分割"""
+        sub_batch = []
+        sub_batch_tokens = 0
+        
+        for chunk in chunks:
+            tokens = self._estimate_tokens(chunk["text"])
+            if sub_batch and (
+                len(sub_batch) >= EMBEDDING_BATCH_SIZE
+                or sub_batch_tokens + tokens > EMBEDDING_MAX_TOKENS_PER_REQUEST
+            ):
+                yield sub_batch
+                sub_batch = []
+                sub_batch_tokens = 0
+            sub_batch.append(chunk)
+            sub_batch_tokens += tokens
+        
+        if sub_batch:
+            yield sub_batch
+
+    def _embed_chunks(self, chunks: List[Dict[str, Any]], target: Optional[IndexTarget] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """チャンクをまとめて埋め込み、アップロード用ベクトルと失敗したチャンクを返す"""
+        vectors = []
+        failed_chunks = []
         
-        for attempt in range(max_retries):
+        for sub_batch in self._split_embedding_batches(chunks):
             try:
-                response = self.openai_client.embeddings.create(
-                    model=EMBEDDING_MODEL,
-                    input=text
-                )
-                return response.data[0].embedding
+                logger.debug("%d件のチャンクの埋め込みベクトルをまとめて生成中...", len(sub_batch))
+                texts = [chunk["text"] for chunk in sub_batch]
+                with measure_stage("embed", items=len(texts), chars=sum(len(text) for text in texts)):
+                    embeddings = self.get_embeddings(texts, target)
+                for chunk, vector in zip(sub_batch, embeddings):
+                    vectors.append({
+                        "id": chunk["id"],
+                        "values": vector,
+                        "metadata": self._vector_metadata(chunk)
+                    })
             except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"埋め込みベクトルの生成に失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                    print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise Exception(f"埋め込みベクトルの生成に失敗しました（最大試行回数到達）: {str(e)}")
+                # 流量制限・サーバーエラー・タイムアウトは入力を分けても解消しないため、
+                # 分割して呼び出し回数を増やさずにまとめて失敗として扱う（再試行はジョブ全体で行う）
+                if len(sub_batch) == 1 or not is_input_error(e):
+                    logger.warning("%d件のチャンクの処理中にエラーが発生しました: %s", len(sub_batch), e)
+                    failed_chunks.extend(sub_batch)
+                    continue
+                # 一部の入力だけが原因の可能性があるため、半分に分けて失敗したチャンクを特定する
+                logger.warning("%d件のまとめて生成に失敗したため、分割して再試行します: %s", len(sub_batch), e)
+                middle = len(sub_batch) // 2
+                for half in (sub_batch[:middle], sub_batch[middle:]):
+                    half_vectors, half_failed = self._embed_chunks(half, target)
+                    vectors.extend(half_vectors)
+                    failed_chunks.extend(half_failed)
+        
+        return vectors, failed_chunks
+
+    def _vector_metadata(self, chunk: Dict[str, Any]) -> Dict[str, Any]:
+        """インデックスに保存するメタデータ（チャンクストアを使う場合は参照のみ）"""
+        if self.chunk_store is not None:
+            return ChunkStore.make_reference(chunk)
+        return {**chunk.get("metadata", {}), "text": chunk["text"]}
+
+    def _upsert_vectors(self, vectors: List[Dict[str, Any]], batch_num: int, target: Optional[IndexTarget] = None) -> None:
+        """ベクトルのバッチをアップロード"""
+        index = self._get_backend(target or self._active_target())
+        logger.debug("%d件のベクトルをアップロード中...", len(vectors))
+        with measure_stage("upsert", items=len(vectors)):
+            self.index_policy.call(
+                lambda: index.upsert(vectors=vectors),
+                f"バッチ {batch_num} のアップロード"
+            )
+        logger.debug("バッチ %d のアップロードが完了しました", batch_num)
 
-    def upload_chunks(self, chunks: List[Dict[str, Any]], batch_size: int = BATCH_SIZE) -> None:
-        """チャンクをPineconeにアップロード"""
+    def upload_chunks(self, chunks: List[Dict[str, Any]], batch_size: Optional[int] = None, journal: Optional[IngestionJournal] = None) -> Dict[str, Any]:
+        """チャンクをPineconeにアップロードし、ステージごとの処理統計を返す
+
+        処理状態はインジェストジャーナルに記録され、中断後に同じチャンクを渡すと
+        アップロード済みのチャンクを飛ばして再開する（以前のジョブでデッドレターになった
+        チャンクは再試行する）。再開時、アップロードしていないチャンクは埋め込みから処理し直す
+        （埋め込みキャッシュが無効な場合は埋め込みAPIを再度呼び出す）。埋め込みとアップロードのどちらで
+        失敗したチャンクも、再試行回数の上限まで再試行してからデッドレターに移す。一部のチャンクがデッドレターになった場合も例外は送出しないため、
+        呼び出し元は返り値の ``dead_letter_chunks`` で部分的な失敗を確認する。
+        埋め込みモデルの移行中は、移行先のインデックスにもそのモデルで埋め込んで書き込む。
+        ``batch_size`` と並行数は、指定がなければ実行時設定の値を使う。
+        """
         if not chunks:
-            print("アップロードするチャンクがありません")
-            return
+            logger.info("アップロードするチャンクがありません")
+            return {}
+        batch_size = get_runtime_setting("batch_size", batch_size)
+        embed_workers = get_runtime_setting("embedding_concurrency", self.embed_concurrency)
+        upsert_workers = get_runtime_setting("upsert_concurrency", self.upsert_concurrency)
 
         try:
+            if journal is None and INGESTION_JOURNAL_ENABLED:
+                journal = IngestionJournal.for_chunks(chunks)
+            
             total_chunks = len(chunks)
-            print(f"アップロード開始: 合計{total_chunks}件のチャンク")
-            
-            # チャンクをバッチに分割
-            for i in range(0, len(chunks), batch_size):
-                batch = chunks[i:i + batch_size]
-                batch_num = i // batch_size + 1
-                print(f"\nバッチ {batch_num} を処理中... ({len(batch)}件)")
-                
-                # バッチ内の各チャンクの埋め込みベクトルを取得
-                vectors = []
-                retry_chunks = []  # 再試行が必要なチャンク
-                
-                for j, chunk in enumerate(batch, 1):
-                    try:
-                        print(f"  チャンク {j}/{len(batch)} の埋め込みベクトルを生成中...")
-                        vector = self.get_embedding(chunk["text"])
-                        vectors.append({
-                            "id": chunk["id"],
-                            "values": vector,
-                            "metadata": {
-                                "text": chunk["text"]
-                            }
-                        })
-                    except Exception as e:
-                        print(f"  チャンク {chunk['id']} の処理中にエラーが発生しました: {str(e)}")
-                        retry_chunks.append(chunk)
-                        continue
-                
-                if vectors:
-                    max_retries = 3
-                    retry_delay = 2
+            if journal is not None:
+                retried_dead = journal.retry_dead()
+                if retried_dead:
+                    logger.info("以前のジョブでデッドレターになったチャンク %d件 を再試行します", retried_dead)
+            pending_chunks = journal.pending(chunks) if journal is not None else chunks
+            skipped_chunks = total_chunks - len(pending_chunks)
+            logger.info("アップロード開始: 合計%d件のチャンク（処理済みのため省略: %d件）", total_chunks, skipped_chunks)
+            
+            # 途中で検索先が切り替わっても、同じジョブ内では同じインデックスに書き込む
+            primary, *secondaries = self._write_targets()
+            # 移行先のインデックス用のベクトル（チャンクID -> 移行先ごとのベクトル）
+            secondary_vectors = {}
+            secondary_lock = threading.Lock()
+            # アップロードできたチャンク（ジャーナルでアップロード済みとして省略したものを含む）
+            pending_ids = {chunk["id"] for chunk in pending_chunks}
+            upserted_ids = {chunk["id"] for chunk in chunks if chunk["id"] not in pending_ids}
+            chunks_by_id = {chunk["id"]: chunk for chunk in pending_chunks}
+            
+            def embed_and_record(batch):
+                vectors, failed = self._embed_chunks(batch, primary)
+                for target in secondaries:
+                    # どちらか一方でも失敗したチャンクは、両方とも再試行に回す
+                    embedded_ids = {vector["id"] for vector in vectors}
+                    target_vectors, target_failed = self._embed_chunks(
+                        [chunk for chunk in batch if chunk["id"] in embedded_ids], target
+                    )
+                    failed_ids = {chunk["id"] for chunk in target_failed}
+                    vectors = [vector for vector in vectors if vector["id"] not in failed_ids]
+                    failed = failed + target_failed
+                    with secondary_lock:
+                        for vector in target_vectors:
+                            secondary_vectors.setdefault(vector["id"], {})[target] = vector
+                if journal is not None:
+                    journal.record([vector["id"] for vector in vectors], IngestionJournal.EMBEDDED)
+                return vectors, failed
+            
+            def upsert_and_record(vectors, batch_num):
+                self._upsert_vectors(vectors, batch_num, primary)
+                if secondaries:
+                    with secondary_lock:
+                        by_target = [secondary_vectors.pop(vector["id"], {}) for vector in vectors]
+                    for target in secondaries:
+                        self._upsert_vectors(
+                            [entry[target] for entry in by_target if target in entry], batch_num, target
+                        )
+                # 本文はアップロードに成功してからチャンクストアに保存する（失敗したチャンクの本文で古いベクトルの本文を上書きしないように）
+                if self.chunk_store is not None:
+                    with measure_stage("chunk_store", items=len(vectors)):
+                        self.chunk_store.put_chunks([chunks_by_id[vector["id"]] for vector in vectors])
+                if journal is not None:
+                    journal.record([vector["id"] for vector in vectors], IngestionJournal.UPSERTED)
+                with secondary_lock:
+                    upserted_ids.update(vector["id"] for vector in vectors)
+            
+            attempts = dict(journal.attempts) if journal is not None else {}
+            dead_chunks = []
+            retried_chunks = 0
+            report = None
+            
+            try:
+                while pending_chunks:
+                    # 埋め込み生成とアップロードを並行して実行
+                    pipeline = IngestionPipeline(
+                        embed_fn=embed_and_record,
+                        upsert_fn=upsert_and_record,
+                        embed_workers=embed_workers,
+                        upsert_workers=upsert_workers
+                    )
+                    batches = (pending_chunks[i:i + batch_size] for i in range(0, len(pending_chunks), batch_size))
+                    run_report = pipeline.run(batches)
+                    if report is None:
+                        report = run_report
+                    
+                    # 失敗したチャンクは再試行回数の上限までのみ再試行する
+                    failed_chunks = run_report.pop("failed_chunks")
+                    if journal is not None:
+                        journal.record([chunk["id"] for chunk in failed_chunks], IngestionJournal.FAILED)
+                    pending_chunks = []
+                    for chunk in failed_chunks:
+                        attempts[chunk["id"]] = attempts.get(chunk["id"], 0) + 1
+                        if attempts[chunk["id"]] >= MAX_CHUNK_RETRIES:
+                            dead_chunks.append(chunk)
+                        else:
+                            pending_chunks.append(chunk)
                     
-                    for attempt in range(max_retries):
-                        try:
-                            # バッチをアップロード
-                            print(f"  {len(vectors)}件のベクトルをアップロード中...")
-                            self.index.upsert(vectors=vectors)
-                            print(f"  バッチ {batch_num} のアップロードが完了しました")
-                            break
-                        except Exception as e:
-                            if attempt < max_retries - 1:
-                                print(f"  バッチ {batch_num} のアップロードに失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                                print(f"  {retry_delay}秒後に再試行します...")
-                                time.sleep(retry_delay)
-                                retry_delay *= 2
-                            else:
-                                raise Exception(f"バッチ {batch_num} のアップロードに失敗しました（最大試行回数到達）: {str(e)}")
-                
-                # 失敗したチャンクを再試行
-                if retry_chunks:
-                    print(f"\n失敗したチャンク {len(retry_chunks)}件 を再試行します...")
-                    self.upload_chunks(retry_chunks, batch_size)
-            
-            print("\nアップロード完了")
+                    if pending_chunks:
+                        retried_chunks += len(pending_chunks)
+                        logger.warning("失敗したチャンク %d件 を再試行します...", len(pending_chunks))
+            finally:
+                # 一部でもアップロードされた可能性があるため、回答キャッシュと統計情報を無効化
+                bump_index_generation()
+                self.invalidate_index_stats()
+            
+            if dead_chunks:
+                logger.error("%d件のチャンクが再試行の上限に達したため、デッドレターに移しました", len(dead_chunks))
+                if journal is not None:
+                    journal.add_dead_letters(dead_chunks, "再試行の上限に達しました")
+            
+            # アップロードできたチャンクのみキーワード索引に追加する（ベクトルのないチャンクが検索されないように）
+            if self.lexical_index is not None:
+                self.lexical_index.add_documents([chunk for chunk in chunks if chunk["id"] in upserted_ids])
+            
+            # 全て完了したジョブのジャーナルは不要なので削除する
+            if journal is not None and not dead_chunks:
+                journal.remove()
+            
+            report = report or {"total_chunks": 0, "stages": {}}
+            report.update({
+                "skipped_chunks": skipped_chunks,
+                "uploaded_chunks": len(upserted_ids) - skipped_chunks,
+                "retried_chunks": retried_chunks,
+                "dead_letter_chunks": [chunk["id"] for chunk in dead_chunks]
+            })
+            
+            logger.info("アップロード完了: %s秒", report.get("elapsed_seconds", 0))
+            for stage, stats in report["stages"].items():
+                logger.info("  %s: %s件, %s件/秒", stage, stats["items"], stats["items_per_second"])
+            return report
             
         except Exception as e:
             raise Exception(f"チャンクのアップロードに失敗しました: {str(e)}")
 
-    def query(self, query_text: str, top_k: int = DEFAULT_TOP_K, similarity_threshold: float = SIMILARITY_THRESHOLD) -> Dict[str, Any]:
-        """クエリに基づいて類似チャンクを検索"""
-        max_retries = 3
-        retry_delay = 1
+    def _list_file_chunk_ids(self, filename: str) -> List[str]:
+        """ファイルに属するチャンクIDをインデックスから取得
+
+        接頭辞の一覧には ``doc_chunk_x.txt`` のような別のファイルのチャンクも含まれるため、
+        ``{ファイル名}_chunk_{番号}`` の形式のIDのみ返す。
+        """
+        pattern = re.compile(rf"{re.escape(filename)}_chunk_\d+")
+        def list_ids():
+            ids = []
+            for page in self.index.list(prefix=f"{filename}_chunk_"):
+                ids.extend(vector_id for vector_id in page if pattern.fullmatch(vector_id))
+            return ids
+        return self.index_policy.call(list_ids, "チャンクIDの一覧取得")
+
+    def _fetch_content_hashes(self, ids: List[str], batch_size: int = 100) -> Dict[str, str]:
+        """チャンクIDごとに保存済みのコンテンツハッシュを取得"""
+        hashes = {}
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            response = self.index_policy.call(
+                lambda: self.index.fetch(ids=batch),
+                "保存済みチャンクの取得"
+            )
+            for vector_id, vector in response.vectors.items():
+                metadata = vector.metadata or {}
+                hashes[vector_id] = metadata.get("content_hash")
+        return hashes
+
+    def delete_chunks(self, ids: List[str], batch_size: int = 1000) -> None:
+        """指定したチャンクIDをまとめて削除（移行中は移行先のインデックスからも削除）"""
+        for target in self._write_targets():
+            index = self._get_backend(target)
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                self.index_policy.call(lambda: index.delete(ids=batch), "チャンクの削除")
+        if ids:
+            if self.chunk_store is not None:
+                self.chunk_store.delete_chunks(ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove_documents(ids)
+            bump_index_generation()
+            self.invalidate_index_stats()
+
+    def _plan_file_sync(self, filename: str, chunks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """ファイルの変更・追加されたチャンクと、不要になったチャンクIDを求める"""
+        existing_ids = self._list_file_chunk_ids(filename)
+        existing_hashes = self._fetch_content_hashes(existing_ids)
         
-        for attempt in range(max_retries):
-            try:
-                # より多くの候補を取得
-                query_vector = self.get_embedding(query_text)
-                print(f"検索クエリ: {query_text}")
-                print(f"類似度しきい値: {similarity_threshold}")
-                print(f"取得する候補数: {top_k * 2}")
-                
-                # より多くの候補を取得（フィルタリング用）
-                results = self.index.query(
+        # 内容が変わっていないチャンクは埋め込みもアップロードもしない
+        changed_chunks = [
+            chunk for chunk in chunks
+            if existing_hashes.get(chunk["id"]) != chunk["metadata"]["content_hash"]
+        ]
+        new_ids = {chunk["id"] for chunk in chunks}
+        stale_ids = [vector_id for vector_id in existing_ids if vector_id not in new_ids]
+        
+        logger.info(
+            "'%s' の差分: 変更・追加 %d件, 削除 %d件, 変更なし %d件",
+            filename, len(changed_chunks), len(stale_ids), len(chunks) - len(changed_chunks)
+        )
+        return changed_chunks, stale_ids
+
+    def sync_files(self, files: List[Tuple[str, List[Dict[str, Any]]]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """複数のファイルのチャンクを差分のみアップロードし、不要になったチャンクを削除
+
+        差分の確認はファイルごとに並行して行い、変更されたチャンクは全てのファイルで共通のバッチに
+        まとめてアップロードする（小さなファイルが多くても埋め込みとアップロードのバッチが小さくならないように）。
+        返り値はアップロードの統計情報に、ファイル名ごとの結果を ``files`` として加えたもの。
+        チャンクIDはファイル内の位置で決まるため、途中に文章を挿入・削除するとそれ以降の
+        チャンクは内容が同じでも変更として扱われ、アップロードし直す（埋め込みはキャッシュから取得する）。
+        """
+        filenames = [filename for filename, _ in files]
+        try:
+            workers = max(1, min(len(files), get_runtime_setting("upsert_concurrency", self.upsert_concurrency)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                plans = list(executor.map(lambda item: self._plan_file_sync(*item), files))
+            
+            changed_chunks = [chunk for changed, _ in plans for chunk in changed]
+            report = {}
+            if changed_chunks:
+                # 差分ごとにジョブIDが変わるため、同じファイルの以前のジョブのジャーナルは削除する
+                journal = None
+                if INGESTION_JOURNAL_ENABLED:
+                    scope = "\n".join(filenames)
+                    journal = IngestionJournal.for_chunks(changed_chunks, scope=scope)
+                    journal.remove_stale(scope)
+                report = self.upload_chunks(changed_chunks, batch_size, journal=journal)
+            self.delete_chunks([vector_id for _, stale_ids in plans for vector_id in stale_ids])
+            
+            # ハイブリッド検索を後から有効にした場合など、変更のないチャンクが索引にない場合は追加する
+            if self.lexical_index is not None:
+                changed_ids = {chunk["id"] for chunk in changed_chunks}
+                unchanged_chunks = [chunk for _, chunks in files for chunk in chunks if chunk["id"] not in changed_ids]
+                missing_ids = set(self.lexical_index.missing_ids([chunk["id"] for chunk in unchanged_chunks]))
+                if missing_ids:
+                    self.lexical_index.add_documents([chunk for chunk in unchanged_chunks if chunk["id"] in missing_ids])
+                report["keyword_indexed_chunks"] = len(missing_ids)
+            
+            dead_ids = set(report.get("dead_letter_chunks", []))
+            report["files"] = {}
+            for (filename, chunks), (changed, stale_ids) in zip(files, plans):
+                file_dead_ids = [chunk["id"] for chunk in changed if chunk["id"] in dead_ids]
+                report["files"][filename] = {
+                    "upserted_chunks": len(changed) - len(file_dead_ids),
+                    "unchanged_chunks": len(chunks) - len(changed),
+                    "deleted_chunks": len(stale_ids),
+                    "dead_letter_chunks": file_dead_ids
+                }
+            return report
+            
+        except Exception as e:
+            raise Exception(f"{', '.join(repr(filename) for filename in filenames)} の差分アップロードに失敗しました: {str(e)}")
+
+    def sync_file_chunks(self, filename: str, chunks: List[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """ファイルのチャンクを差分のみアップロードし、不要になったチャンクを削除"""
+        report = self.sync_files([(filename, chunks)], batch_size)
+        report.update(report.pop("files")[filename])
+        return report
+
+    def _iter_stored_chunks(self, target: IndexTarget, fetch_size: int = 100) -> Iterator[List[Dict[str, Any]]]:
+        """インデックスに保存済みのチャンクを本文とメタデータの形で順に取得
+
+        本文はチャンクストアから取得し、チャンクストアにないチャンク（チャンクストアを
+        使う前にアップロードしたもの）のみインデックスのメタデータから取得する。
+        """
+        index = self._get_backend(target)
+        for page in index.list(prefix=""):
+            for i in range(0, len(page), fetch_size):
+                batch = page[i:i + fetch_size]
+                metadata_by_id, stored_ids = self._lookup_chunk_metadata(batch, index)
+                chunks = []
+                for vector_id in batch:
+                    metadata = dict(metadata_by_id.get(vector_id, {}))
+                    text = metadata.pop("text", None)
+                    if text is not None:
+                        chunks.append({"id": vector_id, "text": text, "metadata": metadata})
+                # 書き込み先には参照のみ保存されるため、インデックスにのみあった本文をチャンクストアに移す
+                if self.chunk_store is not None:
+                    self.chunk_store.put_chunks([chunk for chunk in chunks if chunk["id"] not in stored_ids])
+                if chunks:
+                    yield chunks
+
+    def reindex_migration(self, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """検索先のインデックスの全チャンクを移行先の埋め込みモデルで埋め込み直し、移行先に書き込む
+
+        移行中のアップロードは両方のインデックスに書き込まれるため、再埋め込みと並行して
+        アップロードを続けてもよい。途中で中断した場合も、埋め込みキャッシュにより
+        再実行時に生成済みのベクトルはAPIを呼び出さずに書き込まれる。
+        """
+        source = self._active_target()
+        target = self.alias.migration
+        if target is None:
+            raise Exception("移行中のインデックスがありません。先に移行を開始してください")
+        batch_size = get_runtime_setting("batch_size", batch_size)
+        
+        try:
+            logger.info(
+                "'%s'（%s）から '%s'（%s, %d次元）への再埋め込みを開始します",
+                source.index_name, source.model, target.index_name, target.model, target.index_dimension
+            )
+            pipeline = IngestionPipeline(
+                embed_fn=lambda batch: self._embed_chunks(batch, target),
+                upsert_fn=lambda vectors, batch_num: self._upsert_vectors(vectors, batch_num, target),
+                embed_workers=get_runtime_setting("embedding_concurrency", self.embed_concurrency),
+                upsert_workers=get_runtime_setting("upsert_concurrency", self.upsert_concurrency)
+            )
+            report = pipeline.run(self._iter_stored_chunks(source, batch_size))
+            failed_chunks = report.pop("failed_chunks")
+            report.update({
+                "source_index": source.index_name,
+                "target_index": target.index_name,
+                "failed_chunks": [chunk["id"] for chunk in failed_chunks]
+            })
+            if failed_chunks:
+                logger.error("%d件のチャンクの再埋め込みに失敗しました", len(failed_chunks))
+            return report
+            
+        except Exception as e:
+            raise Exception(f"移行先インデックスへの再埋め込みに失敗しました: {str(e)}")
+
+    def query(
+        self,
+        query_text: str,
+        top_k: Optional[int] = None,
+        similarity_threshold: Optional[float] = None,
+        timer: Optional[RequestTimer] = None,
+        include_values: bool = False,
+        query_vector: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """クエリに基づいて類似チャンクを検索
+
+        ``timer`` を渡すと処理段階ごとの所要時間を記録し、``include_values`` を指定すると
+        検索結果にベクトルを含める（文脈の選択でチャンク同士の類似度を計算する場合）。
+        埋め込み済みの場合は ``query_vector`` を渡すと埋め込みを省略する。
+        ``top_k`` と ``similarity_threshold`` は、指定がなければ実行時設定の値を使う。
+        適応的な取得が有効な場合は、IDとスコアのみで検索してから本文を取得する（``_adaptive_query``）。
+        ハイブリッド検索が有効な場合は適応的な取得より優先し、``hybrid_query`` で検索する
+        （ベクトル検索の取得数は上位K件に固定され、適応的な取得は使われない）。
+        """
+        top_k = get_runtime_setting("top_k", top_k)
+        similarity_threshold = get_runtime_setting("similarity_threshold", similarity_threshold)
+        if self.lexical_index is not None:
+            return self.hybrid_query(query_text, top_k, similarity_threshold, timer, include_values, query_vector)
+        
+        # 埋め込みと検索は同じインデックス（埋め込みモデル）に対して行う
+        target = self._active_target()
+        index = self._get_backend(target)
+        if query_vector is None:
+            with measure_stage("embed", timer, items=1, chars=len(query_text)):
+                query_vector = self.get_embedding(query_text, target)
+        if self.adaptive_overfetch is not None:
+            return self._adaptive_query(index, query_vector, top_k, similarity_threshold, timer, include_values)
+        # しきい値で絞り込むため、上位K件の数倍の候補を取得する
+        candidate_count = top_k * get_runtime_setting("retrieval_overfetch")
+        logger.debug("検索クエリ: %s（類似度しきい値: %s, 取得する候補数: %d）", query_text, similarity_threshold, candidate_count)
+        
+        # より多くの候補を取得（フィルタリング用）
+        with measure_stage("vector_query", timer) as stage:
+            results = self.index_policy.call(
+                lambda: index.query(
                     vector=query_vector,
-                    top_k=top_k * 2,  # フィルタリング用に2倍取得
-                    include_metadata=True
+                    top_k=candidate_count,
+                    include_metadata=True,
+                    include_values=include_values
+                ),
+                "検索クエリの実行"
+            )
+            stage["matches"] = len(results.matches)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("候補のスコア: %s", [round(match.score, 3) for match in results.matches])
+        
+        candidates = self._hydrate_matches(results.matches, index, timer)
+        with measure_stage("filter", timer, candidates=len(candidates)) as stage:
+            # 類似度でフィルタリング
+            filtered_matches = [
+                match for match in candidates
+                if match.score >= similarity_threshold
+            ]
+            # 上位K件に制限
+            filtered_matches = filtered_matches[:top_k]
+            stage["matches"] = len(filtered_matches)
+        
+        logger.debug("最終的な検索結果数: %d/%d", len(filtered_matches), len(results.matches))
+        
+        return {
+            "matches": filtered_matches,
+            "candidates": candidates,  # しきい値で絞り込む前の候補
+            "total_matches": len(results.matches),
+            "filtered_matches": len(filtered_matches),
+            "query_vector": query_vector
+        }
+
+    def _adaptive_query(
+        self,
+        index: VectorStoreBackend,
+        query_vector: List[float],
+        top_k: int,
+        similarity_threshold: float,
+        timer: Optional[RequestTimer],
+        include_values: bool
+    ) -> Dict[str, Any]:
+        """IDとスコアのみで少ない候補から検索し、しきい値を超えた結果のみ本文を取得
+
+        取得数は直近の検索のスコア分布から決め、取得した候補が全てしきい値を超えた場合のみ
+        増やして検索し直す。しきい値を超えた結果がない場合は、上位K件の本文を取得して
+        ``candidates`` として返す（``candidates`` には本文を取得した結果のみ含める）。
+        """
+        def search(count):
+            return self.index_policy.call(
+                lambda: index.query(vector=query_vector, top_k=count, include_metadata=False, include_values=False),
+                "検索クエリの実行"
+            ).matches
+        
+        count = self.adaptive_overfetch.initial_count(top_k, similarity_threshold)
+        with measure_stage("vector_query", timer) as stage:
+            rounds = 1
+            candidates = search(count)
+            passing = [match for match in candidates if match.score >= similarity_threshold]
+            # 結果はスコア順のため、全ての候補がしきい値を超えた場合のみ続きに候補が残っている可能性がある
+            while len(passing) == len(candidates) == count < top_k:
+                count = self.adaptive_overfetch.next_count(count, top_k)
+                rounds += 1
+                candidates = search(count)
+                passing = [match for match in candidates if match.score >= similarity_threshold]
+            # しきい値を超えた結果がない場合は、スコアに関係なく上位K件を使うため取得し直す
+            if not passing and len(candidates) == count < top_k:
+                count = top_k
+                rounds += 1
+                candidates = search(count)
+            self.adaptive_overfetch.record([match.score for match in candidates])
+            stage["matches"] = len(candidates)
+            stage["rounds"] = rounds
+        logger.debug(
+            "候補のスコア: %s（取得数: %d, 検索回数: %d）",
+            [round(match.score, 3) for match in candidates], count, rounds
+        )
+        
+        hydrate_matches = passing[:top_k] if passing else candidates[:top_k]
+        hydrated = []
+        # チャンクストアを使う場合、本文はチャンクストアから取得するためインデックスからはベクトルのみ取得する
+        if hydrate_matches and (include_values or self.chunk_store is None):
+            with measure_stage("hydrate", timer, items=len(hydrate_matches)):
+                fetched = self.index_policy.call(
+                    lambda: index.fetch(ids=[match.id for match in hydrate_matches]),
+                    "保存済みチャンクの取得"
+                ).vectors
+            # 検索と取得の間に削除されたチャンクは除く
+            hydrated = [
+                VectorMatch(
+                    id=match.id,
+                    score=match.score,
+                    metadata=fetched[match.id].metadata,
+                    values=list(fetched[match.id].values) if include_values else []
                 )
-                
-                print(f"取得した候補数: {len(results.matches)}")
-                if results.matches:
-                    print("候補のスコア:")
-                    for match in results.matches:
-                        print(f"スコア: {match.score:.3f}")
-                
-                # 類似度でフィルタリング
-                filtered_matches = [
-                    match for match in results.matches
-                    if match.score >= similarity_threshold
-                ]
-                
-                print(f"フィルタリング後の候補数: {len(filtered_matches)}")
-                
-                # 上位K件に制限
-                filtered_matches = filtered_matches[:top_k]
-                
-                print(f"最終的な検索結果数: {len(filtered_matches)}")
-                for match in filtered_matches:
-                    print(f"スコア: {match.score:.3f}, テキスト: {match.metadata['text'][:100]}...")
-                
-                return {
-                    "matches": filtered_matches,
-                    "total_matches": len(results.matches),
-                    "filtered_matches": len(filtered_matches)
-                }
-                
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"検索クエリの実行に失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                    print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise Exception(f"検索クエリの実行に失敗しました（最大試行回数到達）: {str(e)}")
+                for match in hydrate_matches if match.id in fetched
+            ]
+        elif hydrate_matches:
+            hydrated = hydrate_matches
+        hydrated = self._hydrate_matches(hydrated, index, timer)
+        filtered_matches = hydrated if passing else []
+        logger.debug("最終的な検索結果数: %d/%d", len(filtered_matches), len(candidates))
+        
+        return {
+            "matches": filtered_matches,
+            "candidates": hydrated,
+            "total_matches": len(candidates),
+            "filtered_matches": len(filtered_matches),
+            "query_vector": query_vector
+        }
+
+    async def aquery(
+        self,
+        query_text: str,
+        top_k: Optional[int] = None,
+        similarity_threshold: Optional[float] = None,
+        timer: Optional[RequestTimer] = None,
+        include_values: bool = False,
+        query_vector: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """``query`` の非同期版
+
+        埋め込みは非同期クライアントで取得する。インデックスへの問い合わせは
+        同期クライアントしかないバックエンドもあるため、既定のスレッドプールで実行する。
+        """
+        if query_vector is None:
+            with measure_stage("embed", timer, items=1, chars=len(query_text)):
+                query_vector = await self.aget_embedding(query_text)
+        return await asyncio.to_thread(
+            self.query, query_text, top_k, similarity_threshold, timer, include_values, query_vector
+        )
 
-    def get_index_stats(self) -> Dict[str, Any]:
-        """インデックスの統計情報を取得"""
-        max_retries = 3
-        retry_delay = 1
+    def hybrid_query(
+        self,
+        query_text: str,
+        top_k: Optional[int] = None,
+        similarity_threshold: Optional[float] = None,
+        timer: Optional[RequestTimer] = None,
+        include_values: bool = False,
+        query_vector: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """ベクトル検索とキーワード検索(BM25)の結果をReciprocal Rank Fusionで統合して検索
+
+        キーワード検索で一致したチャンクは類似度しきい値に関係なく候補に含めるため、
+        型番や製品名の完全一致はベクトル検索の多めの取得に頼らずに見つけられる。
+        結果は統合後のRRFスコア（``rank_score``）の順に並べ、``score`` にはコサイン類似度を残す。
+        """
+        top_k = get_runtime_setting("top_k", top_k)
+        similarity_threshold = get_runtime_setting("similarity_threshold", similarity_threshold)
+        target = self._active_target()
+        index = self._get_backend(target)
+        if query_vector is None:
+            with measure_stage("embed", timer, items=1, chars=len(query_text)):
+                query_vector = self.get_embedding(query_text, target)
+        with measure_stage("vector_query", timer) as stage:
+            results = self.index_policy.call(
+                lambda: index.query(vector=query_vector, top_k=top_k, include_metadata=True, include_values=include_values),
+                "検索クエリの実行"
+            )
+            stage["matches"] = len(results.matches)
+        vector_candidates = self._hydrate_matches(results.matches, index, timer)
+        with measure_stage("lexical_query", timer) as stage:
+            lexical_hits = self.lexical_index.search(query_text, top_k)
+            stage["matches"] = len(lexical_hits)
         
-        for attempt in range(max_retries):
-            try:
-                stats = self.index.describe_index_stats()
-                return {
-                    "total_vector_count": stats.total_vector_count,
-                    "dimension": stats.dimension,
-                    "index_name": PINECONE_INDEX_NAME,
-                    "metric": "cosine"
-                }
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"インデックスの統計情報の取得に失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                    print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise Exception(f"インデックスの統計情報の取得に失敗しました（最大試行回数到達）: {str(e)}")
+        logger.debug("検索クエリ: %s（ベクトル検索: %d件, キーワード検索: %d件）", query_text, len(results.matches), len(lexical_hits))
+        
+        with measure_stage("filter", timer, candidates=len(results.matches) + len(lexical_hits)) as stage:
+            vector_matches = [match for match in vector_candidates if match.score >= similarity_threshold]
+            fused_matches = self._fuse_matches(vector_matches, lexical_hits, index, query_vector, include_values, timer)
+            filtered_matches = fused_matches[:top_k]
+            stage["matches"] = len(filtered_matches)
+        logger.debug("最終的な検索結果数: %d", len(filtered_matches))
+        
+        vector_ids = {match.id for match in vector_matches}
+        return {
+            "matches": filtered_matches,
+            "candidates": fused_matches + [match for match in vector_candidates if match.id not in vector_ids],
+            "total_matches": len(results.matches) + len(lexical_hits),
+            "filtered_matches": len(filtered_matches),
+            "query_vector": query_vector
+        }
 
-    def clear_index(self) -> None:
-        """インデックスをクリア"""
-        max_retries = 3
-        retry_delay = 2
+    def _lookup_chunk_metadata(
+        self,
+        ids: List[str],
+        index: VectorStoreBackend,
+        index_metadata: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> Tuple[Dict[str, Dict[str, Any]], Set[str]]:
+        """チャンクIDごとの本文を含むメタデータを取得し、(メタデータ, チャンクストアから取得したID) を返す
+
+        チャンクストアを優先し、チャンクストアにないチャンク（チャンクストアを使う前にアップロードしたもの）は
+        インデックスのメタデータを使う。``index_metadata`` に取得済みのインデックスのメタデータを渡すと、
+        本文を含まないものだけインデックスから取得し、参照のコンテンツハッシュと異なる版の本文は使わない。
+        本文が見つからないチャンクは返り値に含めない。
+        """
+        index_metadata = index_metadata or {}
+        stored = self.chunk_store.get_chunks(ids) if self.chunk_store is not None else {}
+        for chunk_id in list(stored):
+            expected_hash = index_metadata.get(chunk_id, {}).get("content_hash")
+            if expected_hash is not None and stored[chunk_id].get("content_hash") != expected_hash:
+                del stored[chunk_id]
         
-        for attempt in range(max_retries):
-            try:
-                self.index.delete(delete_all=True)
-                print("インデックスをクリアしました")
-                return
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    print(f"インデックスのクリアに失敗しました（試行 {attempt + 1}/{max_retries}）: {str(e)}")
-                    print(f"{retry_delay}秒後に再試行します...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    raise Exception(f"インデックスのクリアに失敗しました（最大試行回数到達）: {str(e)}") 
\ No newline at end of file
+        # 本文が手元にないチャンクのみインデックスから取得する（IDとスコアのみで検索した場合など）
+        missing_ids = [
+            chunk_id for chunk_id in ids
+            if chunk_id not in stored and "text" not in index_metadata.get(chunk_id, {})
+        ]
+        fetched = {}
+        if missing_ids:
+            fetched = self.index_policy.call(
+                lambda: index.fetch(ids=missing_ids),
+                "保存済みチャンクの取得"
+            ).vectors
+        
+        metadata_by_id = dict(stored)
+        for chunk_id in ids:
+            if chunk_id in metadata_by_id:
+                continue
+            if chunk_id in fetched:
+                metadata = fetched[chunk_id].metadata or {}
+            else:
+                metadata = index_metadata.get(chunk_id, {})
+            if "text" in metadata:
+                metadata_by_id[chunk_id] = metadata
+        return metadata_by_id, set(stored)
+
+    def _hydrate_matches(self, matches: List[VectorMatch], index: VectorStoreBackend, timer: Optional[RequestTimer] = None) -> List[VectorMatch]:
+        """チャンクストアから検索結果の本文とメタデータをまとめて取得して付け加える
+
+        チャンクストアにない結果（チャンクストアを使う前にアップロードしたもの）は
+        インデックスのメタデータの本文を使い、本文が見つからない結果は除く。
+        """
+        if self.chunk_store is None or not matches:
+            return matches
+        with measure_stage("chunk_lookup", timer, items=len(matches)) as stage:
+            metadata_by_id, stored_ids = self._lookup_chunk_metadata(
+                [match.id for match in matches],
+                index,
+                {match.id: match.metadata for match in matches if match.metadata}
+            )
+            stage["misses"] = len(matches) - len(stored_ids)
+        
+        hydrated = []
+        for match in matches:
+            metadata = metadata_by_id.get(match.id, {})
+            if "text" not in metadata:
+                logger.warning("チャンク %s の本文が見つからないため、検索結果から除外します", match.id)
+                continue
+            hydrated.append(VectorMatch(id=match.id, score=match.score, metadata=metadata, values=match.values))
+        return hydrated
+
+    def _fuse_matches(
+        self,
+        vector_matches: List[VectorMatch],
+        lexical_hits: List[Tuple[str, float]],
+        index: VectorStoreBackend,
+        query_vector: List[float],
+        include_values: bool = False,
+        timer: Optional[RequestTimer] = None
+    ) -> List[VectorMatch]:
+        """ベクトル検索とキーワード検索の結果をRRFで統合し、RRFスコア（``rank_score``）の順に並べる
+
+        キーワード検索だけでヒットしたチャンクは、インデックスから取得したベクトルでコサイン類似度を
+        計算して ``score`` に設定し、本文はチャンクストアまたはインデックスのメタデータから取得する。
+        """
+        matches_by_id = {match.id: match for match in vector_matches}
+        fused = reciprocal_rank_fusion([
+            [match.id for match in vector_matches],
+            [doc_id for doc_id, _ in lexical_hits]
+        ])
+        
+        lexical_only_ids = [doc_id for doc_id, _ in fused if doc_id not in matches_by_id]
+        if lexical_only_ids:
+            with measure_stage("lexical_fetch", timer, items=len(lexical_only_ids)):
+                fetched = self.index_policy.call(
+                    lambda: index.fetch(ids=lexical_only_ids),
+                    "保存済みチャンクの取得"
+                ).vectors
+                metadata_by_id, _ = self._lookup_chunk_metadata(
+                    [doc_id for doc_id in lexical_only_ids if doc_id in fetched],
+                    index,
+                    {doc_id: vector.metadata or {} for doc_id, vector in fetched.items()}
+                )
+            query = np.asarray(query_vector, dtype=np.float32)
+            query_norm = np.linalg.norm(query)
+            for doc_id in lexical_only_ids:
+                if doc_id not in metadata_by_id:
+                    continue
+                values = np.asarray(fetched[doc_id].values, dtype=np.float32)
+                denominator = query_norm * np.linalg.norm(values)
+                matches_by_id[doc_id] = VectorMatch(
+                    id=doc_id,
+                    score=float(values @ query / denominator) if denominator > 0 else 0.0,
+                    metadata=metadata_by_id[doc_id],
+                    values=list(fetched[doc_id].values) if include_values else []
+                )
+        
+        fused_matches = []
+        for doc_id, rrf_score in fused:
+            match = matches_by_id.get(doc_id)
+            if match is not None:
+                fused_matches.append(VectorMatch(
+                    id=doc_id, score=match.score, metadata=match.metadata, values=match.values, rank_score=rrf_score
+                ))
+        return fused_matches
+
+    def invalidate_index_stats(self) -> None:
+        """キャッシュしたインデックスの統計情報を破棄"""
+        with self._stats_lock:
+            self._stats_cache = None
+
+    def get_index_stats(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """インデックスの統計情報を取得（INDEX_STATS_TTL秒間はキャッシュを返す）"""
+        # 検索先が切り替わっていればキャッシュは破棄される
+        target = self._active_target()
+        with self._stats_lock:
+            if (
+                not force_refresh
+                and self._stats_cache is not None
+                and time.monotonic() - self._stats_cached_at < INDEX_STATS_TTL
+            ):
+                return dict(self._stats_cache)
+        
+        stats = self.index_policy.call(
+            self._get_backend(target).describe_index_stats,
+            "インデックスの統計情報の取得"
+        )
+        migration = self.alias.migration
+        result = {
+            "total_vector_count": stats.total_vector_count,
+            "dimension": stats.dimension,
+            "index_name": target.index_name,
+            "embedding_model": target.model,
+            "migration_index_name": migration.index_name if migration is not None else None,
+            "chunk_store_count": self.chunk_store.count() if self.chunk_store is not None else None,
+            "backend": VECTOR_STORE_BACKEND,
+            "metric": "cosine"
+        }
+        with self._stats_lock:
+            self._stats_cache = result
+            self._stats_cached_at = time.monotonic()
+        return dict(result)
+
+    def get_request_stats(self) -> Dict[str, Any]:
+        """外部API呼び出しの流量制限・再試行の統計情報を取得"""
+        stats = {
+            "openai": self.openai_policy.get_stats(),
+            "index": self.index_policy.get_stats()
+        }
+        if self.adaptive_overfetch is not None:
+            stats["adaptive_retrieval"] = self.adaptive_overfetch.get_stats(
+                get_runtime_setting("top_k"), get_runtime_setting("similarity_threshold")
+            )
+        return stats
+
+    def rebuild_lexical_index(self, batch_size: int = 100) -> int:
+        """検索先のインデックスに保存済みの全チャンクからキーワード索引を作り直し、索引に追加した件数を返す
+
+        ハイブリッド検索を有効にする前にアップロードしたチャンクを索引に含める場合に使う。
+        """
+        if self.lexical_index is None:
+            raise Exception("ハイブリッド検索が無効です。HYBRID_SEARCH_ENABLED を True にしてください")
+        try:
+            self.lexical_index.clear()
+            indexed = 0
+            for chunks in self._iter_stored_chunks(self._active_target(), batch_size):
+                self.lexical_index.add_documents(chunks)
+                indexed += len(chunks)
+            bump_index_generation()
+            logger.info("キーワード索引を作り直しました（%d件）", indexed)
+            return indexed
+        except Exception as e:
+            raise Exception(f"キーワード索引の作り直しに失敗しました: {str(e)}")
+
+    def clear_index(self) -> None:
+        """インデックスをクリア（移行中は移行先のインデックスもクリア）"""
+        for target in self._write_targets():
+            index = self._get_backend(target)
+            self.index_policy.call(
+                lambda: index.delete(delete_all=True),
+                "インデックスのクリア"
+            )
+        if self.chunk_store is not None:
+            self.chunk_store.clear()
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+        bump_index_generation()
+        self.invalidate_index_stats()
+        logger.info("インデックスをクリアしました")
+
+
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+def get_pinecone_service() -> PineconeService:
+    """プロセス内で共有するPineconeServiceを取得（初回呼び出し時のみ初期化）"""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_service_lock:
+            if _shared_service is None:
+                _shared_service = PineconeService()
+    return _shared_service
@@ -0,0 +1,342 @@
+from typing import Dict, Any, Optional, Callable, Iterator, Awaitable, TypeVar
+from contextlib import contextmanager, asynccontextmanager
+import asyncio
+import logging
+import random
+import threading
+import time
+from ..config.settings import (
+    MAX_RETRIES,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+    OPENAI_MAX_CONCURRENCY,
+    PINECONE_REQUESTS_PER_MINUTE,
+    PINECONE_MAX_CONCURRENCY
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 非同期呼び出しで同時実行数の枠が空くのを確認する間隔（秒）
+ASYNC_SLOT_POLL_INTERVAL = 0.01
+
+# 再試行しても結果が変わらないクライアントエラー
+NON_RETRYABLE_STATUS_CODES = {400, 401, 403, 404, 422}
+
+# 入力の一部（特定のテキストなど）が原因の可能性があるクライアントエラー
+INPUT_ERROR_STATUS_CODES = {400, 422}
+
+
+class RequestFailedError(Exception):
+    """再試行しても成功しなかったAPI呼び出しの例外（元の例外のステータスコードを保持する）"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """1分あたりの上限を平滑化して適用するトークンバケット"""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_take(self, amount: float) -> float:
+        """溜まっていれば取り出して0を返し、足りなければ必要な待機秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def acquire(self, amount: float = 1) -> float:
+        """必要な量が溜まるまで待機し、待機した秒数を返す"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            wait = self._try_take(amount)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def aacquire(self, amount: float = 1) -> float:
+        """``acquire`` の非同期版（待機中もイベントループを止めない）"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            wait = self._try_take(amount)
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def drain(self) -> None:
+        """レート制限を受けた際に、溜まっている分を使い切ったことにする"""
+        with self._lock:
+            self._tokens = 0
+            self._updated = time.monotonic()
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD方式で同時実行数の上限を調整するリミッター
+
+    成功するたびに上限を少しずつ増やし（加算的増加）、
+    レート制限を受けたら半分に減らす（乗算的減少）。
+    """
+
+    def __init__(self, max_limit: int, initial_limit: Optional[int] = None, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial_limit if initial_limit is not None else max(min_limit, max_limit // 2))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """空きがあれば枠を確保してTrueを返す（待機しない）"""
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_rate_limited(self) -> None:
+        with self._condition:
+            self.limit = max(self.min_limit, self.limit / 2)
+
+
+def _get_status_code(error: Exception) -> Optional[int]:
+    """OpenAI・Pineconeの例外からHTTPステータスコードを取得"""
+    for attribute in ("status_code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+def is_input_error(error: Exception) -> bool:
+    """入力の内容が原因のエラーか（入力を分けて再試行すると成功する可能性がある場合）"""
+    return _get_status_code(error) in INPUT_ERROR_STATUS_CODES
+
+def _get_retry_after(error: Exception) -> Optional[float]:
+    """例外に含まれるRetry-Afterヘッダーから待機秒数を取得"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class RequestPolicy:
+    """外部APIの呼び出しに共通の流量制限・同時実行数制御・再試行を適用する"""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: int = MAX_RETRIES,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = RETRY_MAX_DELAY
+    ):
+        self.name = name
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrency) if max_concurrency else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "failures": 0, "rate_limited": 0, "retries": 0, "throttled_seconds": 0.0}
+
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    @contextmanager
+    def slot(self, tokens: int = 0):
+        """流量制限と同時実行数の枠を確保した状態で処理を実行"""
+        throttled = 0.0
+        if self.request_bucket is not None:
+            throttled += self.request_bucket.acquire(1)
+        if self.token_bucket is not None and tokens:
+            throttled += self.token_bucket.acquire(tokens)
+        if throttled:
+            self._count("throttled_seconds", throttled)
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        self._count("requests")
+        try:
+            yield
+        finally:
+            if self.concurrency is not None:
+                self.concurrency.release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens: int = 0):
+        """``slot`` の非同期版（スレッドを占有せずに枠が空くのを待つ）"""
+        throttled = 0.0
+        if self.request_bucket is not None:
+            throttled += await self.request_bucket.aacquire(1)
+        if self.token_bucket is not None and tokens:
+            throttled += await self.token_bucket.aacquire(tokens)
+        if throttled:
+            self._count("throttled_seconds", throttled)
+        if self.concurrency is not None:
+            # 同期呼び出しとリミッターを共有するため、空くまで短い間隔で確認する
+            while not self.concurrency.try_acquire():
+                await asyncio.sleep(ASYNC_SLOT_POLL_INTERVAL)
+        self._count("requests")
+        try:
+            yield
+        finally:
+            if self.concurrency is not None:
+                self.concurrency.release()
+
+    def _handle_failure(self, error: Exception, attempt: int, operation: str) -> float:
+        """失敗を記録し、再試行する場合は待機秒数を返す（再試行しない場合は例外を送出）"""
+        self._count("failures")
+        status = _get_status_code(error)
+        if status == 429:
+            self._count("rate_limited")
+            if self.concurrency is not None:
+                self.concurrency.on_rate_limited()
+            if self.request_bucket is not None:
+                self.request_bucket.drain()
+
+        if status in NON_RETRYABLE_STATUS_CODES or attempt >= self.max_retries - 1:
+            raise RequestFailedError(f"{operation}に失敗しました（最大試行回数到達）: {str(error)}", status) from error
+
+        retry_after = _get_retry_after(error)
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            # 指数バックオフにジッターを加え、同時に再試行が集中しないようにする
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        self._count("retries")
+        logger.warning(
+            "%sに失敗しました（試行 %d/%d）: %s。%.1f秒後に再試行します...",
+            operation, attempt + 1, self.max_retries, error, delay
+        )
+        return delay
+
+    def call(self, func: Callable[[], T], operation: str, tokens: int = 0) -> T:
+        """関数を流量制限の範囲内で実行し、失敗時は再試行する"""
+        attempt = 0
+        while True:
+            try:
+                with self.slot(tokens):
+                    result = func()
+            except Exception as e:
+                time.sleep(self._handle_failure(e, attempt, operation))
+                attempt += 1
+                continue
+            if self.concurrency is not None:
+                self.concurrency.on_success()
+            return result
+
+    async def acall(self, func: Callable[[], Awaitable[T]], operation: str, tokens: int = 0) -> T:
+        """``call`` の非同期版（``func`` はコルーチンを返す関数）"""
+        attempt = 0
+        while True:
+            try:
+                async with self.aslot(tokens):
+                    result = await func()
+            except Exception as e:
+                await asyncio.sleep(self._handle_failure(e, attempt, operation))
+                attempt += 1
+                continue
+            if self.concurrency is not None:
+                self.concurrency.on_success()
+            return result
+
+    def stream(self, func: Callable[[], Iterator[T]], operation: str, tokens: int = 0) -> Iterator[T]:
+        """ストリーミング呼び出しを実行し、最初の要素を受け取る前の失敗のみ再試行する"""
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with self.slot(tokens):
+                    for item in func():
+                        started = True
+                        yield item
+            except Exception as e:
+                if started:
+                    self._count("failures")
+                    raise
+                time.sleep(self._handle_failure(e, attempt, operation))
+                attempt += 1
+                continue
+            if self.concurrency is not None:
+                self.concurrency.on_success()
+            return
+
+    def get_stats(self) -> Dict[str, Any]:
+        """呼び出し回数や待機時間などの統計情報を取得"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 3)
+        if self.concurrency is not None:
+            stats["concurrency_limit"] = round(self.concurrency.limit, 2)
+        return stats
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def _create_policy(provider: str) -> RequestPolicy:
+    if provider == "openai":
+        return RequestPolicy(
+            "openai",
+            requests_per_minute=OPENAI_REQUESTS_PER_MINUTE,
+            tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+            max_concurrency=OPENAI_MAX_CONCURRENCY
+        )
+    if provider == "pinecone":
+        return RequestPolicy(
+            "pinecone",
+            requests_per_minute=PINECONE_REQUESTS_PER_MINUTE,
+            max_concurrency=PINECONE_MAX_CONCURRENCY
+        )
+    # ローカルのベクトルストアなど、流量制限が不要な呼び出し
+    return RequestPolicy(provider)
+
+def get_request_policy(provider: str) -> RequestPolicy:
+    """プロバイダーごとにプロセス内で共有するリクエストポリシーを取得"""
+    if provider not in _policies:
+        with _policies_lock:
+            if provider not in _policies:
+                _policies[provider] = _create_policy(provider)
+    return _policies[provider]
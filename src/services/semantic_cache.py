@@ -0,0 +1,166 @@
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import copy
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+from ..config.settings import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MAX_DISTANCE,
+    SEMANTIC_CACHE_TTL,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    INDEX_GENERATION_PATH
+)
+
+
+class SemanticAnswerCache:
+    """質問の埋め込みベクトルが近い過去の回答を再利用するキャッシュ
+
+    同じテンプレート・同じインデックス世代で、コサイン距離が
+    ``max_distance`` 以内の質問があればその回答を返す。
+    """
+
+    def __init__(
+        self,
+        max_distance: float = SEMANTIC_CACHE_MAX_DISTANCE,
+        ttl_seconds: float = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES
+    ):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_template_key(system_prompt: str, response_template: str) -> str:
+        """プロンプトの組み合わせを識別するキーを作成"""
+        return hashlib.sha256(f"{system_prompt}\0{response_template}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [
+            entry_id for entry_id, entry in self._entries.items()
+            if now - entry["created_at"] > self.ttl_seconds
+        ]
+        for entry_id in expired:
+            del self._entries[entry_id]
+
+    def lookup(self, query_vector: List[float], template_key: str, generation: int) -> Optional[Tuple[str, Dict[str, Any], float]]:
+        """条件に合う最も近いキャッシュ済み回答を (回答, 詳細情報, 距離) で返す"""
+        with self._lock:
+            self._evict_expired(time.time())
+            candidates = [
+                (entry_id, entry) for entry_id, entry in self._entries.items()
+                if entry["template_key"] == template_key and entry["generation"] == generation
+            ]
+            if not candidates:
+                return None
+
+            matrix = np.stack([entry["vector"] for _, entry in candidates])
+            distances = 1.0 - matrix @ self._normalize(query_vector)
+            best = int(np.argmin(distances))
+            distance = float(distances[best])
+            if distance > self.max_distance:
+                return None
+
+            entry_id, entry = candidates[best]
+            self._entries.move_to_end(entry_id)
+            return entry["answer"], copy.deepcopy(entry["details"]), distance
+
+    def store(self, query_vector: List[float], template_key: str, generation: int, answer: str, details: Dict[str, Any]) -> None:
+        """回答をキャッシュに追加し、容量を超えた分を古い順に削除"""
+        with self._lock:
+            self._entries[self._next_id] = {
+                "vector": self._normalize(query_vector),
+                "template_key": template_key,
+                "generation": generation,
+                "answer": answer,
+                "details": copy.deepcopy(details),
+                "created_at": time.time()
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """キャッシュを全て削除"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_shared_cache = SemanticAnswerCache() if SEMANTIC_CACHE_ENABLED else None
+_index_generation = 0
+_loaded_generation_file = None  # 読み込んだ世代番号ファイルの (inode, 更新時刻)
+_generation_lock = threading.Lock()
+
+def get_semantic_cache() -> Optional[SemanticAnswerCache]:
+    """プロセス内で共有する回答キャッシュを取得（無効化されている場合はNone）"""
+    return _shared_cache
+
+def _refresh_index_generation() -> None:
+    """世代番号ファイルが更新されていれば読み直す（ロックを取得した状態で呼び出す）"""
+    global _index_generation, _loaded_generation_file
+    try:
+        stat = os.stat(INDEX_GENERATION_PATH)
+    except FileNotFoundError:
+        return
+    loaded_file = (stat.st_ino, stat.st_mtime_ns)
+    if loaded_file == _loaded_generation_file:
+        return
+    try:
+        with open(INDEX_GENERATION_PATH, "r", encoding="utf-8") as f:
+            generation = int(f.read().strip())
+    except ValueError:
+        return
+    if generation != _index_generation:
+        # 別のプロセスでインデックスが更新された
+        _index_generation = generation
+        if _shared_cache is not None:
+            _shared_cache.invalidate()
+    _loaded_generation_file = loaded_file
+
+def get_index_generation() -> int:
+    """インデックスの内容が変わるたびに増える世代番号を取得（別のプロセスでの更新も反映する）"""
+    if _shared_cache is None:
+        return _index_generation
+    with _generation_lock:
+        _refresh_index_generation()
+        return _index_generation
+
+def bump_index_generation() -> int:
+    """インデックスの内容が変わったことを記録し、回答キャッシュを無効化
+
+    回答キャッシュが有効な場合は世代番号をファイルにも保存し、
+    ingest.py や migrate_index.py での更新を検索を行うプロセスのキャッシュにも反映する。
+    """
+    global _index_generation, _loaded_generation_file
+    with _generation_lock:
+        if not SEMANTIC_CACHE_ENABLED:
+            _index_generation += 1
+            return _index_generation
+        _refresh_index_generation()
+        _index_generation += 1
+        directory = os.path.dirname(INDEX_GENERATION_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 書きかけの内容を読まれないよう、一時ファイル経由で置き換える
+        temp_path = f"{INDEX_GENERATION_PATH}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(str(_index_generation))
+        os.replace(temp_path, INDEX_GENERATION_PATH)
+        stat = os.stat(INDEX_GENERATION_PATH)
+        _loaded_generation_file = (stat.st_ino, stat.st_mtime_ns)
+        _shared_cache.invalidate()
+        return _index_generation
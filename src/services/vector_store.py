@@ -0,0 +1,303 @@
+from typing import List, Dict, Any, Optional, Iterator
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+
+
+@dataclass
+class VectorMatch:
+    """検索・取得結果の1件（Pineconeのレスポンスと同じ属性名）"""
+    id: str
+    score: float = 0.0
+    metadata: Optional[Dict[str, Any]] = None
+    values: List[float] = field(default_factory=list)
+    rank_score: Optional[float] = None  # 並べ替えに使うスコア（ハイブリッド検索のRRFスコア。Noneの場合は score）
+
+
+@dataclass
+class QueryResponse:
+    """検索結果"""
+    matches: List[VectorMatch]
+
+
+@dataclass
+class FetchResponse:
+    """ID指定での取得結果"""
+    vectors: Dict[str, VectorMatch]
+
+
+@dataclass
+class IndexStats:
+    """インデックスの統計情報"""
+    total_vector_count: int
+    dimension: Optional[int]
+
+
+class VectorStoreBackend(ABC):
+    """PineconeServiceが利用するベクトルストアのインターフェース
+
+    戻り値はPineconeクライアントのレスポンスと同じ属性
+    （``matches``、``vectors``、``total_vector_count`` など）を持つ。
+    """
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        """``{"id", "values", "metadata"}`` 形式のベクトルを登録・更新"""
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True, include_values: bool = False, min_score: Optional[float] = None):
+        """コサイン類似度の高い順に ``top_k`` 件を検索"""
+
+    @abstractmethod
+    def fetch(self, ids: List[str]):
+        """IDを指定してベクトルとメタデータを取得"""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> None:
+        """IDを指定して、または全てのベクトルを削除"""
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> Iterator[List[str]]:
+        """接頭辞に一致するIDをページ単位で列挙"""
+
+    @abstractmethod
+    def describe_index_stats(self):
+        """ベクトル数と次元数を取得"""
+
+
+class PineconeBackend(VectorStoreBackend):
+    """Pineconeのインデックスをそのまま利用するバックエンド"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        self.index.upsert(vectors=vectors)
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True, include_values: bool = False, min_score: Optional[float] = None):
+        results = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=include_values
+        )
+        if min_score is not None:
+            # Pineconeはしきい値指定に対応していないため、取得後に絞り込む
+            return QueryResponse(matches=[match for match in results.matches if match.score >= min_score])
+        return results
+
+    def fetch(self, ids: List[str]):
+        return self.index.fetch(ids=ids)
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> None:
+        if delete_all:
+            self.index.delete(delete_all=True)
+        else:
+            self.index.delete(ids=ids)
+
+    def list(self, prefix: str = "") -> Iterator[List[str]]:
+        return self.index.list(prefix=prefix)
+
+    def describe_index_stats(self):
+        return self.index.describe_index_stats()
+
+
+class LocalVectorStore(VectorStoreBackend):
+    """メモリマップしたfloat32行列とSQLiteのメタデータで構成するローカルバックエンド
+
+    ベクトルは正規化して保存し、検索はNumPyの行列積によるコサイン類似度で行う。
+    メタデータは変更した行のみSQLiteに書き込むため、追加・削除のコストは件数に比例しない。
+    小〜中規模のコーパスやオフラインでの開発・テスト向け。
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    METADATA_FILE = "metadata.sqlite3"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, self.VECTORS_FILE)
+        self._metadata_path = os.path.join(directory, self.METADATA_FILE)
+
+        self.dimension = None
+        self._capacity = 0
+        self._ids = []  # 行番号ごとのID（削除済みの行はNone）
+        self._metadata = []
+        self._rows = {}
+        self._free_rows = []
+        self._matrix = None
+
+        self._conn = sqlite3.connect(self._metadata_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, metadata TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        """保存済みのメタデータを読み込み、行番号の対応を復元"""
+        settings = dict(self._conn.execute("SELECT key, value FROM settings").fetchall())
+        self.dimension = settings.get("dimension")
+        self._capacity = settings.get("capacity", 0)
+
+        stored = self._conn.execute("SELECT row, id, metadata FROM vectors ORDER BY row").fetchall()
+        row_count = stored[-1][0] + 1 if stored else 0
+        self._ids = [None] * row_count
+        self._metadata = [None] * row_count
+        for row, vector_id, metadata in stored:
+            self._ids[row] = vector_id
+            self._metadata[row] = json.loads(metadata)
+            self._rows[vector_id] = row
+        self._free_rows = [row for row, vector_id in enumerate(self._ids) if vector_id is None]
+        if self.dimension:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dimension))
+
+    def _commit(self) -> None:
+        """ベクトルをファイルに書き出してから、メタデータの変更を確定する"""
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [("dimension", self.dimension), ("capacity", self._capacity)]
+        )
+        self._conn.commit()
+
+    def _ensure_capacity(self, required: int) -> None:
+        """行数が足りない場合は容量を倍にしたファイルを作り直す"""
+        if required <= self._capacity:
+            return
+        new_capacity = max(required, self._capacity * 2, 1024)
+        temp_path = self._vectors_path + ".tmp"
+        new_matrix = np.memmap(temp_path, dtype=np.float32, mode="w+", shape=(new_capacity, self.dimension))
+        if self._matrix is not None and len(self._ids):
+            new_matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+        new_matrix.flush()
+        del new_matrix
+        self._matrix = None
+        os.replace(temp_path, self._vectors_path)
+        self._capacity = new_capacity
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dimension))
+
+    @staticmethod
+    def _normalize(values) -> np.ndarray:
+        array = np.asarray(values, dtype=np.float32)
+        norms = np.linalg.norm(array, axis=-1, keepdims=True)
+        return array / np.where(norms > 0, norms, 1.0)
+
+    def upsert(self, vectors: List[Dict[str, Any]]) -> None:
+        if not vectors:
+            return
+        # 同じIDが1回の呼び出しに複数含まれる場合は最後のものを使う（行を重複して割り当てないように）
+        vectors = list({vector["id"]: vector for vector in vectors}.values())
+        with self._lock:
+            values = self._normalize([vector["values"] for vector in vectors])
+            if self.dimension is None:
+                self.dimension = values.shape[1]
+            elif values.shape[1] != self.dimension:
+                raise ValueError(f"ベクトルの次元数が一致しません（期待値: {self.dimension}, 実際: {values.shape[1]}）")
+
+            rows = []
+            appended = 0
+            for vector in vectors:
+                row = self._rows.get(vector["id"])
+                if row is None:
+                    if self._free_rows:
+                        row = self._free_rows.pop()
+                    else:
+                        row = len(self._ids) + appended
+                        appended += 1
+                rows.append(row)
+
+            self._ensure_capacity(len(self._ids) + appended)
+            self._ids.extend([None] * appended)
+            self._metadata.extend([None] * appended)
+
+            for vector, row in zip(vectors, rows):
+                self._ids[row] = vector["id"]
+                self._metadata[row] = vector.get("metadata") or {}
+                self._rows[vector["id"]] = row
+            self._matrix[rows] = values
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (row, id, metadata) VALUES (?, ?, ?)",
+                [
+                    (row, vector["id"], json.dumps(self._metadata[row], ensure_ascii=False))
+                    for vector, row in zip(vectors, rows)
+                ]
+            )
+            self._commit()
+
+    def _to_match(self, row: int, score: float, include_metadata: bool, include_values: bool) -> VectorMatch:
+        return VectorMatch(
+            id=self._ids[row],
+            score=score,
+            metadata=self._metadata[row] if include_metadata else None,
+            values=self._matrix[row].tolist() if include_values else []
+        )
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True, include_values: bool = False, min_score: Optional[float] = None):
+        with self._lock:
+            count = len(self._ids)
+            if not self._rows or top_k <= 0:
+                return QueryResponse(matches=[])
+
+            scores = self._matrix[:count] @ self._normalize(vector)
+            # 削除済みの行は検索対象から外す
+            if self._free_rows:
+                scores[self._free_rows] = -np.inf
+
+            k = min(top_k, len(self._rows))
+            top_rows = np.argpartition(-scores, k - 1)[:k]
+            top_rows = top_rows[np.argsort(-scores[top_rows])]
+            if min_score is not None:
+                top_rows = top_rows[scores[top_rows] >= min_score]
+
+            return QueryResponse(matches=[
+                self._to_match(int(row), float(scores[row]), include_metadata, include_values)
+                for row in top_rows
+            ])
+
+    def fetch(self, ids: List[str]):
+        with self._lock:
+            return FetchResponse(vectors={
+                vector_id: self._to_match(self._rows[vector_id], 0.0, True, True)
+                for vector_id in ids if vector_id in self._rows
+            })
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False) -> None:
+        with self._lock:
+            if delete_all:
+                self._ids = []
+                self._metadata = []
+                self._rows = {}
+                self._free_rows = []
+                self._conn.execute("DELETE FROM vectors")
+            else:
+                deleted = []
+                for vector_id in ids or []:
+                    row = self._rows.pop(vector_id, None)
+                    if row is None:
+                        continue
+                    self._ids[row] = None
+                    self._metadata[row] = None
+                    self._free_rows.append(row)
+                    deleted.append((row,))
+                self._conn.executemany("DELETE FROM vectors WHERE row = ?", deleted)
+            self._commit()
+
+    def list(self, prefix: str = "", page_size: int = 100) -> Iterator[List[str]]:
+        with self._lock:
+            ids = sorted(vector_id for vector_id in self._rows if vector_id.startswith(prefix))
+        for i in range(0, len(ids), page_size):
+            yield ids[i:i + page_size]
+
+    def describe_index_stats(self):
+        with self._lock:
+            return IndexStats(total_vector_count=len(self._rows), dimension=self.dimension)
@@ -0,0 +1,115 @@
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from ..services.vector_store import VectorMatch
+from ..config.settings import (
+    CONTEXT_TOKEN_BUDGET,
+    MMR_LAMBDA,
+    CONTEXT_DUPLICATE_THRESHOLD
+)
+
+
+def estimate_text_tokens(text: str) -> int:
+    """テキストのトークン数を概算（日本語は1文字1トークン程度）"""
+    return len(text)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def assemble_context(
+    query_vector: Optional[List[float]],
+    matches: List[Any],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_chunks: Optional[int] = None,
+    lambda_mult: float = MMR_LAMBDA,
+    duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """検索結果からMMR（Maximal Marginal Relevance）で文脈に含めるチャンクを選ぶ
+
+    質問との類似度が高く、選択済みのチャンクとの類似度が低いものから順に、
+    トークン数の上限に収まる範囲で選ぶ。選択済みのチャンクとのコサイン類似度が
+    ``duplicate_threshold`` 以上のもの（重なりの大きいチャンク）と、本文が同じものは除外する。
+    最も関連度の高いチャンクは、上限を超える場合も除外せず上限まで切り詰めて含める。
+    ベクトル（``values``）を持たない結果は、ベクトルのある結果の後に元の順位で選ぶ。
+    戻り値は (選択したチャンク, 統計情報)。
+    """
+    stats = {"候補数": len(matches), "重複として除外": 0, "上限超過で除外": 0, "切り詰め": 0, "トークン数": 0}
+    if not matches:
+        return [], stats
+
+    count = len(matches)
+    texts = [match.metadata["text"] for match in matches]
+    tokens = np.array([estimate_text_tokens(text) for text in texts])
+
+    # 元の順位（上位ほど大きい値）を、ベクトルがない場合の関連度として使う
+    rank_relevance = np.linspace(1.0, 0.0, count, endpoint=False)
+    has_values = np.array([len(match.values) > 0 for match in matches])
+    if query_vector is not None and has_values.any():
+        dimension = len(next(match.values for match in matches if len(match.values) > 0))
+        vectors = np.zeros((count, dimension), dtype=np.float32)
+        vectors[has_values] = _normalize_rows(np.asarray([match.values for match in matches if len(match.values) > 0], dtype=np.float32))
+        query = _normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        vector_relevance = vectors @ query
+        # ベクトルのない結果は、ベクトルのある結果より後に元の順位で並べる
+        lowest = vector_relevance[has_values].min()
+        relevance = np.where(has_values, vector_relevance, lowest - 1 + rank_relevance)
+        similarity = vectors @ vectors.T
+    else:
+        relevance = rank_relevance
+        similarity = np.zeros((count, count), dtype=np.float32)
+
+    # 本文が完全に同じチャンクは、ベクトルの有無に関係なく重複として扱う
+    first_index = {}
+    for i, text in enumerate(texts):
+        j = first_index.setdefault(text, i)
+        if j != i:
+            similarity[i, j] = similarity[j, i] = 1.0
+
+    selected = []
+    available = np.ones(count, dtype=bool)
+    max_similarity = np.zeros(count, dtype=np.float32)
+    remaining = token_budget
+    limit = max_chunks or count
+
+    while len(selected) < limit and available.any():
+        # 残りの予算に収まらないチャンクは候補から外す
+        over_budget = available & (tokens > remaining)
+        if not selected and remaining > 0:
+            # 文脈が空にならないように、最も関連度の高いチャンクは切り詰めて含める
+            over_budget[int(np.argmax(np.where(available, relevance, -np.inf)))] = False
+        stats["上限超過で除外"] += int(over_budget.sum())
+        available &= ~over_budget
+        if not available.any():
+            break
+
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        best = int(np.argmax(np.where(available, scores, -np.inf)))
+
+        selected.append(best)
+        available[best] = False
+        if tokens[best] > remaining:
+            tokens[best] = remaining
+            stats["切り詰め"] += 1
+        remaining -= int(tokens[best])
+        max_similarity = np.maximum(max_similarity, similarity[best])
+
+        # 選んだチャンクとほぼ同じ内容のチャンクを除外
+        duplicates = available & (similarity[best] >= duplicate_threshold)
+        stats["重複として除外"] += int(duplicates.sum())
+        available &= ~duplicates
+
+    stats["トークン数"] = int(tokens[selected].sum()) if selected else 0
+    selected_matches = []
+    for i in selected:
+        match = matches[i]
+        if tokens[i] < estimate_text_tokens(texts[i]):
+            match = VectorMatch(
+                id=match.id,
+                score=match.score,
+                metadata={**match.metadata, "text": texts[i][:int(tokens[i])]},
+                values=match.values
+            )
+        selected_matches.append(match)
+    return selected_matches, stats
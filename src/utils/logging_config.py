@@ -0,0 +1,13 @@
+import logging
+from ..config.settings import LOG_LEVEL
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    """アプリケーション全体のログ出力を設定（本番環境では LOG_LEVEL=WARNING で詳細ログを抑制）"""
+    logging.basicConfig(
+        level=level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    # アプリケーション以外のライブラリの詳細ログは抑制する
+    logging.getLogger("src").setLevel(level.upper())
+    for name in ("httpx", "openai", "urllib3"):
+        logging.getLogger(name).setLevel(logging.WARNING)
@@ -0,0 +1,225 @@
+from typing import List, Dict, Any, Optional, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import threading
+import time
+from ..config.settings import METRICS_ENABLED, METRICS_LATENCY_BUCKETS
+
+# 処理段階ごとの所要時間を記録するヒストグラム名
+STAGE_DURATION_METRIC = "rag_stage_duration_seconds"
+
+
+class MetricsSink:
+    """メトリクスの送信先（既定では何も記録しない）
+
+    別の監視基盤に送る場合はこのクラスを継承して ``set_metrics_sink`` で差し替える。
+    """
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """ヒストグラムに値を記録"""
+
+    def increment(self, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+        """カウンターを加算"""
+
+
+class Histogram:
+    """累積バケットで値の分布を集計するヒストグラム"""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[Tuple[float, int]]:
+        """(上限値, その値以下の件数) の一覧"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((labels or {}).items()))
+
+def _format_labels(label_key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(label_key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = [
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsRegistry(MetricsSink):
+    """プロセス内でヒストグラムとカウンターを集計し、Prometheusのテキスト形式で出力する"""
+
+    def __init__(self, buckets: List[float] = METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}  # 名前 -> {ラベル: Histogram}
+        self._counters = {}  # 名前 -> {ラベル: 値}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram(self.buckets)
+            series[key].observe(value)
+
+    def increment(self, name: str, amount: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def get_snapshot(self) -> Dict[str, Any]:
+        """集計結果を辞書で取得（画面表示用）"""
+        with self._lock:
+            histograms = {
+                name: {
+                    _format_labels(key) or "{}": {
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "average": round(histogram.sum / histogram.count, 6) if histogram.count else None
+                    }
+                    for key, histogram in series.items()
+                }
+                for name, series in self._histograms.items()
+            }
+            counters = {
+                name: {_format_labels(key) or "{}": value for key, value in series.items()}
+                for name, series in self._counters.items()
+            }
+        return {"histograms": histograms, "counters": counters}
+
+    def to_prometheus_text(self) -> str:
+        """Prometheusのテキスト形式（exposition format 0.0.4）で出力"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """集計結果を全て削除"""
+        with self._lock:
+            self._histograms = {}
+            self._counters = {}
+
+
+_metrics_sink = MetricsRegistry() if METRICS_ENABLED else MetricsSink()
+
+def get_metrics_sink() -> MetricsSink:
+    """現在のメトリクスの送信先を取得"""
+    return _metrics_sink
+
+def set_metrics_sink(sink: MetricsSink) -> None:
+    """メトリクスの送信先を差し替える"""
+    global _metrics_sink
+    _metrics_sink = sink
+
+
+class RequestTimer:
+    """1回のリクエスト内の処理段階ごとの所要時間とデータ量を集計する"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        # 並行して実行した段階（複数クエリの同時検索など）からも記録される
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, sizes: Dict[str, Any]) -> None:
+        with self._lock:
+            record = self.stages.setdefault(stage, {"seconds": 0.0})
+            record["seconds"] += seconds
+            for key, value in sizes.items():
+                if isinstance(value, (int, float)):
+                    record[key] = record.get(key, 0) + value
+
+    def breakdown(self) -> Dict[str, Any]:
+        """段階ごとの所要時間（秒）とデータ量の一覧（並行した段階は合計されるため、合計が全体を超えることがある）"""
+        with self._lock:
+            result = {
+                stage: {**record, "seconds": round(record["seconds"], 4)}
+                for stage, record in self.stages.items()
+            }
+        result["total"] = {"seconds": round(time.perf_counter() - self.started, 4)}
+        return result
+
+
+@contextmanager
+def measure_stage(stage: str, timer: Optional[RequestTimer] = None, **sizes: Any):
+    """処理段階の所要時間とデータ量（件数・文字数・トークン数など）を記録
+
+    データ量は処理後に判明するものも記録できるよう、``with`` で受け取った辞書に追加できる。
+    """
+    started = time.perf_counter()
+    try:
+        yield sizes
+    finally:
+        seconds = time.perf_counter() - started
+        labels = {"stage": stage}
+        sink = get_metrics_sink()
+        sink.observe(STAGE_DURATION_METRIC, seconds, labels)
+        for key, value in sizes.items():
+            if isinstance(value, (int, float)):
+                sink.increment(f"rag_stage_{key}_total", value, labels)
+        if timer is not None:
+            timer.add(stage, seconds, sizes)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        sink = get_metrics_sink()
+        body = sink.to_prometheus_text().encode("utf-8") if isinstance(sink, MetricsRegistry) else b""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> None:
+    """Prometheusが収集できるようにメトリクスをHTTPで公開（プロセス内で1回のみ起動）"""
+    global _metrics_server
+    if _metrics_server is not None:
+        return
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _metrics_server = server
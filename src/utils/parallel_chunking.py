@@ -0,0 +1,100 @@
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from .text_processing import JapaneseTextProcessor, SENTENCE_END_PATTERN, iter_sentences, pack_sentences
+from ..config.runtime_settings import get_runtime_setting
+from ..config.settings import (
+    FAST_CHUNKING,
+    CHUNKING_WORKERS,
+    CHUNKING_SEGMENT_SIZE
+)
+
+# ワーカープロセスごとに1回だけ読み込むテキスト処理器
+_worker_processor = None
+
+def _init_worker(fast: bool) -> None:
+    """ワーカープロセスの初期化（形態素解析器の辞書読み込みはここで1回だけ行う）"""
+    global _worker_processor
+    if not fast:
+        _worker_processor = JapaneseTextProcessor()
+
+def _split_segment(args: Tuple[str, bool, int]) -> List[str]:
+    """テキストの区間を文単位に分割"""
+    segment, fast, chunk_size = args
+    if fast:
+        return list(iter_sentences(segment, chunk_size))
+    return _worker_processor.split_into_sentences(segment)
+
+def split_into_segments(text: str, segment_size: int = CHUNKING_SEGMENT_SIZE) -> List[str]:
+    """テキストを文末記号の直後で区切り、おおよそ ``segment_size`` 文字の区間に分割"""
+    segments = []
+    start = 0
+    while len(text) - start > segment_size:
+        match = SENTENCE_END_PATTERN.search(text, start + segment_size)
+        if match is None:
+            break
+        segments.append(text[start:match.end()])
+        start = match.end()
+    segments.append(text[start:])
+    return segments
+
+def create_chunking_pool(max_workers: int = CHUNKING_WORKERS, fast: bool = FAST_CHUNKING) -> Optional[ProcessPoolExecutor]:
+    """取り込み全体で使い回すチャンク分割用のプロセスプールを作成（プロセスに分散しない場合はNone）
+
+    高速なチャンク分割は文字走査のみでプロセス間の転送の方が高くつくため、プロセスプールを使わない。
+    """
+    if fast or max_workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(fast,))
+
+def process_text_files_parallel(
+    documents: List[Tuple[str, str]],
+    chunk_size: Optional[int] = None,
+    max_workers: int = CHUNKING_WORKERS,
+    segment_size: int = CHUNKING_SEGMENT_SIZE,
+    fast: bool = FAST_CHUNKING,
+    executor: Optional[ProcessPoolExecutor] = None
+) -> List[List[Dict[str, Any]]]:
+    """複数の (ファイル名, 内容) をプロセスプールでチャンクに分割
+
+    文への分割（CPU負荷の高い部分）を文書・区間単位でワーカーに分散し、
+    チャンクへのまとめ直しは元の順序で行うため、チャンクIDは単一プロセスで
+    処理した場合と同じになる。戻り値の i 番目は ``documents[i]`` のチャンク。
+    ``chunk_size`` の指定がなければ実行時設定の値を使う（ワーカーには解決済みの値を渡す）。
+    繰り返し呼び出す場合は ``create_chunking_pool`` で作成したプールを ``executor`` に渡し、
+    呼び出しごとにワーカーの起動と辞書の読み込みを行わないようにする。高速なチャンク分割は
+    プロセスに分散せずに実行する。
+    """
+    chunk_size = get_runtime_setting("chunk_size", chunk_size)
+    # 文書ごとの区間リストを作成し、ワーカーに渡す作業単位に平坦化
+    document_segments = [split_into_segments(content, segment_size) for _, content in documents]
+    tasks = [
+        (segment, fast, chunk_size)
+        for segments in document_segments
+        for segment in segments
+    ]
+
+    if fast or len(tasks) <= 1 or (executor is None and max_workers <= 1):
+        _init_worker(fast)
+        sentence_lists = [_split_segment(task) for task in tasks]
+    elif executor is not None:
+        sentence_lists = list(executor.map(_split_segment, tasks))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(tasks)),
+            initializer=_init_worker,
+            initargs=(fast,)
+        ) as executor:
+            # mapは入力順に結果を返すため、区間の順序が保たれる
+            sentence_lists = list(executor.map(_split_segment, tasks))
+
+    results = []
+    position = 0
+    for (filename, _), segments in zip(documents, document_segments):
+        sentences = [
+            sentence
+            for sentence_list in sentence_lists[position:position + len(segments)]
+            for sentence in sentence_list
+        ]
+        position += len(segments)
+        results.append(list(pack_sentences(sentences, filename, chunk_size)))
+    return results
@@ -1,7 +1,98 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
 from janome.tokenizer import Tokenizer
-from ..config.settings import CHUNK_SIZE
+from ..config.settings import CHUNK_SIZE, FAST_CHUNKING
+from ..config.runtime_settings import get_runtime_setting
+import hashlib
+import re
 import time
+import unicodedata
+
+SENTENCE_END_PATTERN = re.compile(r"[。！？!?]")
+
+def compute_content_hash(text: str) -> str:
+    """チャンクの内容の変更検知に使うハッシュを計算"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def make_chunk(filename: str, chunk_id: int, text: str) -> Dict[str, Any]:
+    """アップロード用のチャンクを作成"""
+    return {
+        "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
+        "text": text,
+        "metadata": {
+            "filename": filename,
+            "chunk_id": chunk_id,
+            "content_hash": compute_content_hash(text)
+        }
+    }
+
+def pack_sentences(sentences: Iterable[str], filename: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """文をチャンクサイズ以内にまとめたチャンクを順に生成"""
+    current_parts = []
+    current_length = 0
+    chunk_id = 0
+    
+    for sentence in sentences:
+        sentence_size = len(sentence)
+        
+        # 現在のチャンクに文を追加できる場合
+        if current_length + sentence_size <= chunk_size:
+            current_parts.append(sentence)
+            current_length += sentence_size + 1
+            continue
+        
+        # 現在のチャンクが空でない場合、新しいチャンクを作成
+        if current_parts:
+            text = "\n".join(current_parts).strip()
+            if text:
+                yield make_chunk(filename, chunk_id, text)
+                chunk_id += 1
+            current_parts = []
+            current_length = 0
+        
+        # 文がチャンクサイズを超える場合は、強制的に分割（分割した各チャンクに別のIDを振る）
+        if sentence_size > chunk_size:
+            for i in range(0, sentence_size, chunk_size):
+                sub_chunk = sentence[i:i + chunk_size]
+                if sub_chunk.strip():
+                    yield make_chunk(filename, chunk_id, sub_chunk)
+                    chunk_id += 1
+        else:
+            current_parts.append(sentence)
+            current_length = sentence_size + 1
+    
+    # 最後のチャンクを追加
+    if current_parts:
+        text = "\n".join(current_parts).strip()
+        if text:
+            yield make_chunk(filename, chunk_id, text)
+
+def iter_sentences(pieces: Union[str, Iterable[str]], max_length: int = CHUNK_SIZE) -> Iterator[str]:
+    """テキスト片の列を文末記号の文字走査で文単位に分割（形態素解析は行わない）
+
+    文末記号が現れないまま ``max_length`` 文字を超えた場合はそこで区切るため、
+    巨大なファイルでも保持するテキストは一定量に収まる。
+    """
+    if isinstance(pieces, str):
+        pieces = [pieces]
+    
+    remainder = ""
+    for piece in pieces:
+        text = remainder + piece
+        start = 0
+        for match in SENTENCE_END_PATTERN.finditer(text):
+            yield text[start:match.end()]
+            start = match.end()
+        remainder = text[start:]
+        if len(remainder) > max_length:
+            yield remainder
+            remainder = ""
+    
+    if remainder:
+        yield remainder
+
+def iter_chunks(pieces: Union[str, Iterable[str]], filename: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """テキスト片の列（ファイルオブジェクトなど）からチャンクを逐次生成する高速モード"""
+    return pack_sentences(iter_sentences(pieces, chunk_size), filename, chunk_size)
 
 class JapaneseTextProcessor:
     def __init__(self):
@@ -23,6 +114,23 @@ class JapaneseTextProcessor:
         
         return sentences
 
+    def extract_terms(self, text: str) -> List[str]:
+        """検索用の索引語を抽出（助詞・助動詞・記号を除き、活用語は基本形にする）"""
+        terms = []
+        for token in self.tokenizer.tokenize(unicodedata.normalize("NFKC", text)):
+            part_of_speech = token.part_of_speech.split(",")[0]
+            if part_of_speech in ("助詞", "助動詞"):
+                continue
+            surface = token.surface.strip().lower()
+            # 記号のみのトークンは除く（型番などの英数字は品詞に関係なく残す）
+            if not any(c.isalnum() for c in surface):
+                continue
+            if part_of_speech in ("動詞", "形容詞") and token.base_form != "*":
+                terms.append(token.base_form)
+            else:
+                terms.append(surface)
+        return terms
+
     def is_sentence_boundary(self, text: str) -> bool:
         """文の区切りかどうかを判定"""
         if not text:
@@ -31,69 +139,16 @@ class JapaneseTextProcessor:
 
     def process_text_file(self, file_content: str, filename: str, chunk_size: int = CHUNK_SIZE) -> List[Dict[str, Any]]:
         """テキストファイルを文脈を考慮したチャンクに分割"""
-        chunks = []
-        current_chunk = ""
-        current_length = 0
-        chunk_id = 0
-        
         # 文単位に分割
         sentences = self.split_into_sentences(file_content)
-        
-        for sentence in sentences:
-            sentence_size = len(sentence)
-            
-            # 現在のチャンクに文を追加できる場合
-            if current_length + sentence_size <= chunk_size:
-                current_chunk += sentence + "\n"
-                current_length += sentence_size + 1
-            else:
-                # 現在のチャンクが空でない場合、新しいチャンクを作成
-                if current_chunk:
-                    chunks.append({
-                        "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
-                        "text": current_chunk.strip(),
-                        "metadata": {
-                            "filename": filename,
-                            "chunk_id": chunk_id
-                        }
-                    })
-                    chunk_id += 1
-                    current_chunk = ""
-                    current_length = 0
-                
-                # 文がチャンクサイズを超える場合は、強制的に分割
-                if sentence_size > chunk_size:
-                    # 文を適切なサイズに分割
-                    for i in range(0, len(sentence), chunk_size):
-                        sub_chunk = sentence[i:i + chunk_size]
-                        chunks.append({
-                            "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
-                            "text": sub_chunk,
-                            "metadata": {
-                                "filename": filename,
-                                "chunk_id": chunk_id
-                            }
-                        })
-                    current_chunk = ""
-                    current_length = 0
-                else:
-                    current_chunk = sentence + "\n"
-                    current_length = sentence_size + 1
-        
-        # 最後のチャンクを追加
-        if current_chunk:
-            chunks.append({
-                "id": f"{filename}_chunk_{chunk_id}",  # ファイル名を含めたID
-                "text": current_chunk.strip(),
-                "metadata": {
-                    "filename": filename,
-                    "chunk_id": chunk_id
-                }
-            })
-        
-        return chunks
+        return list(pack_sentences(sentences, filename, chunk_size))
 
 # 後方互換性のための関数
-def process_text_file(file_content: str, filename: str, chunk_size: int = CHUNK_SIZE) -> List[Dict[str, Any]]:
+def process_text_file(file_content: str, filename: str, chunk_size: Optional[int] = None, fast: bool = FAST_CHUNKING) -> List[Dict[str, Any]]:
+    # チャンクサイズの指定がなければ実行時設定の値を使う
+    chunk_size = get_runtime_setting("chunk_size", chunk_size)
+    if fast:
+        # 形態素解析を行わずに文字走査で文を区切る
+        return list(iter_chunks(file_content, filename, chunk_size))
     processor = JapaneseTextProcessor()
     return processor.process_text_file(file_content, filename, chunk_size)
\ No newline at end of file
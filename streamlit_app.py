@@ -1,10 +1,17 @@
 import streamlit as st
 from src.utils.text_processing import process_text_file
-from src.services.pinecone_service import PineconeService
+from src.services.pinecone_service import get_pinecone_service
 from src.components.file_upload import render_file_upload
 from src.components.chat import render_chat
 from src.components.settings import render_settings
-from src.config.settings import DEFAULT_SYSTEM_PROMPT, DEFAULT_RESPONSE_TEMPLATE
+from src.utils.logging_config import configure_logging
+from src.utils.metrics import start_metrics_server
+from src.config.settings import DEFAULT_SYSTEM_PROMPT, DEFAULT_RESPONSE_TEMPLATE, METRICS_PORT
+
+# ログ出力とメトリクスの公開を設定
+configure_logging()
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT)
 
 # セッション状態の初期化
 if "messages" not in st.session_state:
@@ -16,10 +23,10 @@ if "system_prompt" not in st.session_state:
 if "response_template" not in st.session_state:
     st.session_state.response_template = DEFAULT_RESPONSE_TEMPLATE
 
-# Pineconeサービスの初期化
+# Pineconeサービスの取得（プロセス内で共有し、初期化は初回のみ）
 try:
-    pinecone_service = PineconeService()
-    # インデックスの状態を確認
+    pinecone_service = get_pinecone_service()
+    # インデックスの状態を確認（一定時間キャッシュされる）
     stats = pinecone_service.get_index_stats()
     if stats['total_vector_count'] == 0:
         st.info("データベースは空です。ファイルをアップロードしてデータを追加してください。")